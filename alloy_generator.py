@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+###############################################################################
+##                          Alloy Database Generator                         ##
+###############################################################################
+"""Calculates the lattice constant 'a' over the composition space of an alloy
+described by a spec file, for any number of sublattices and species.
+
+The spec is a JSON object:
+    sublattices        list of the species of every sublattice, e.g.
+                       [["Al", "Ga", "In"], ["P", "As", "Sb"]]
+    lattice_constants  nested lists of the lattice constants of the binary
+                       (one species per sublattice) compounds, indexed by
+                       the species of each sublattice in order
+    bowing             optional list of {"species": [two species of one
+                       sublattice], "with": [species of other sublattices],
+                       "value": b}; b*x_1*x_2*y_with... is subtracted from
+                       the Vegard's law lattice constant
+    fixed              optional {species: percent}, species with a fixed
+                       fraction, e.g. for quaternaries with a fixed component
+
+For every sublattice the free species take all fractions that are multiples
+of the resolution and sum to 100 percent with the fixed ones. Vegard's law is
+evaluated as one broadcast tensor contraction per sublattice. iii_v.json holds
+the constants of iii_v_generator.py, whose database is reproduced exactly.
+
+Returns:
+    Creates a compressed .npz file in the layout of iii_v_generator.py (arr_0
+    holds one float32 row of species fractions and a per composition) with the
+    record field names of the fraction columns (fields) and the decimals they
+    are printed with (decimals), which composition_calculator.py reads.
+"""
+import argparse
+import collections
+import json
+import numpy
+
+
+parser = argparse.ArgumentParser(description="Calculates the lattice constant 'a' over the composition space of an alloy described by a JSON spec file.")
+parser.add_argument("spec", type=str, help="JSON alloy spec with sublattices, lattice_constants and optional bowing and fixed entries.")
+parser.add_argument("resolution", type=float, help="The resolution of the step size in composition in percent where (1 = 1 percent).")
+parser.add_argument("output_file", type=str, help="Name of the compressed npz file where the array of composition and corresponding lattice constant is saved.")
+
+#record field prefixes of the fractions of the first, second, ... sublattice
+SUBLATTICE_PREFIXES = "xyzwvu"
+
+#number of rows filled at once, bounds the size of the temporary arrays
+CHUNK_ROWS = 2**20
+
+AlloySpec = collections.namedtuple("AlloySpec", ["sublattices", "lattice_constants", "bowing", "fixed"])
+# sublattice: the sublattice of the two mixing species, species: their positions in
+# it, others: dict of other sublattice to the position of a species, value: b
+Bowing = collections.namedtuple("Bowing", ["sublattice", "species", "others", "value"])
+
+def parse_spec(spec):
+    """Checks an alloy spec and turns species names into positions.
+
+    Args:
+        spec: dict read from a spec file, see the module documentation
+    Returns:
+        An AlloySpec whose fixed entry maps (sublattice, species position)
+        to percent.
+    Raises:
+        ValueError: if the spec is inconsistent
+    """
+    sublattices = [[str(name) for name in species] for species in spec["sublattices"]]
+    if not sublattices or not all(sublattices):
+        raise ValueError("every sublattice needs at least one species")
+    if len(sublattices) > len(SUBLATTICE_PREFIXES):
+        raise ValueError("at most {} sublattices are supported".format(len(SUBLATTICE_PREFIXES)))
+    lookup = {}
+    for k, species in enumerate(sublattices):
+        for i, name in enumerate(species):
+            if name in lookup:
+                raise ValueError("species {} is listed twice".format(name))
+            lookup[name] = (k, i)
+    def position(name):
+        if name not in lookup:
+            raise ValueError("unknown species {}".format(name))
+        return lookup[name]
+    lattice_constants = numpy.array(spec["lattice_constants"], dtype=numpy.float64)
+    shape = tuple(len(species) for species in sublattices)
+    if lattice_constants.shape != shape:
+        raise ValueError("lattice_constants has the shape {}, the sublattices need {}".format(lattice_constants.shape, shape))
+    bowing = []
+    for term in spec.get("bowing", []):
+        (k, i), (l, j) = [position(name) for name in term["species"]]
+        if k != l or i == j:
+            raise ValueError("bowing species {} are not two species of one sublattice".format(term["species"]))
+        others = {}
+        for name in term.get("with", []):
+            m, n = position(name)
+            if m == k or m in others:
+                raise ValueError("bowing partners {} need one species of each other sublattice".format(term["with"]))
+            others[m] = n
+        bowing.append(Bowing(k, (i, j), others, float(term["value"])))
+    fixed = dict((position(name), float(percent)) for name, percent in spec.get("fixed", {}).items())
+    return AlloySpec(sublattices, lattice_constants, bowing, fixed)
+
+def load_spec(file_name):
+    """Reads and checks a JSON alloy spec, see parse_spec()."""
+    with open(file_name) as spec_file:
+        return parse_spec(json.load(spec_file))
+
+def simplex_grid(species, steps):
+    """Enumerates the ways to split a number of composition steps among
+    species in lexicographic order, the last species takes the rest.
+
+    Args:
+        species: number of species, at least 1
+        steps: number of composition steps
+    Returns:
+        An int64 array with one row of steps per species for every split.
+        For three species the rows are iii_v_generator.simplex_steps().
+    """
+    grid = numpy.zeros((1, 0), dtype=numpy.int64)
+    remaining = numpy.array([steps], dtype=numpy.int64)
+    for level in range(species - 1):
+        counts = remaining + 1
+        rows = numpy.repeat(numpy.arange(len(grid)), counts)
+        values = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        grid = numpy.column_stack([grid[rows], values])
+        remaining = remaining[rows] - values
+    return numpy.column_stack([grid, remaining])
+
+def sublattice_fractions(spec, k, resolution):
+    """Fractions in percent of the species of a sublattice.
+
+    Args:
+        spec: AlloySpec
+        k: sublattice
+        resolution: step size in composition in percent
+    Returns:
+        A float64 array with one row per composition and one column per
+        species of the sublattice.
+    """
+    fixed = dict((i, percent) for (sublattice, i), percent in spec.fixed.items() if sublattice == k)
+    free = [i for i in range(len(spec.sublattices[k])) if i not in fixed]
+    rest = 100.0 - sum(fixed.values())
+    steps = int(round(rest/resolution))
+    if rest < 0 or abs(steps*resolution - rest) > 1e-9*100 or (not free and steps):
+        raise ValueError("the free species of {} cannot share {} percent in steps of {}".format(spec.sublattices[k], rest, resolution))
+    grid = simplex_grid(len(free), steps)*resolution if free else numpy.zeros((1, 0))
+    fractions = numpy.zeros((len(grid), len(spec.sublattices[k])))
+    fractions[:, free] = grid
+    for i, percent in fixed.items():
+        fractions[:, i] = percent
+    return fractions
+
+def contract(table, fractions, composition_axes):
+    """Sums the first species axis of a lattice constant table against the
+    fractions of its sublattice.
+
+    Args:
+        table: array with composition_axes composition axes followed by one
+               species axis per remaining sublattice
+        fractions: (compositions, species) fractions of the sublattice of the
+                   first species axis
+        composition_axes: number of composition axes of table
+    Returns:
+        The table with the summed species axis replaced by a new leading
+        composition axis. For the III-V spec the sums run in the order of
+        iii_v_generator.lattice_constants().
+    """
+    shape = (len(fractions),) + (1,)*composition_axes + (fractions.shape[1],) + (1,)*(table.ndim - composition_axes - 1)
+    return (fractions.reshape(shape)*table[None]).sum(axis=composition_axes + 1)
+
+def field_names(spec):
+    """Record field names of the fraction columns, e.g. x_Al, y_P."""
+    return ["{}_{}".format(SUBLATTICE_PREFIXES[k], name) for k, species in enumerate(spec.sublattices) for name in species]
+
+def fraction_decimals(spec, resolution):
+    """Fewest decimals (at least 2) that print every fraction of the
+    database exactly, at most 8."""
+    percents = [resolution] + list(spec.fixed.values())
+    decimals = 2
+    while decimals < 8 and any(abs(p*10**(decimals - 2) - round(p*10**(decimals - 2))) > 1e-9 for p in percents):
+        decimals += 1
+    return decimals
+
+def alloy_database(spec, resolution):
+    """Builds the composition and lattice constant array of an alloy.
+
+    Args:
+        spec: AlloySpec
+        resolution: step size in composition in percent
+    Returns:
+        A float32 array with one row of fractions (as decimals, the species
+        of every sublattice in spec order) and a per composition. The rows
+        are ordered by the compositions of the last sublattice, then of the
+        one before and so on, as the rows of iii_v_generator.py.
+    """
+    count = len(spec.sublattices)
+    fractions = [sublattice_fractions(spec, k, resolution) for k in range(count)]
+    # all but the last sublattice are summed once, in percent
+    table = spec.lattice_constants
+    for k in range(count - 1):
+        table = contract(table, fractions[k], k)
+    inner_shape = tuple(len(fractions[k]) for k in reversed(range(count - 1)))
+    inner = int(numpy.prod(inner_shape, dtype=numpy.int64))
+    # the columns of the inner sublattices repeat identically for every outer composition
+    positions = numpy.unravel_index(numpy.arange(inner), inner_shape) if inner_shape else ()
+    inner_columns = numpy.zeros((inner, sum(len(species) for species in spec.sublattices[:-1])), dtype=numpy.float32)
+    column = 0
+    for k in range(count - 1):
+        width = len(spec.sublattices[k])
+        inner_columns[:, column:column + width] = (fractions[k][positions[count - 2 - k]]/100.0).astype(numpy.float32)
+        column += width
+    outer = fractions[-1]
+    lst = numpy.zeros((len(outer)*inner, column + outer.shape[1] + 1), dtype=numpy.float32)
+    per_chunk = max(1, CHUNK_ROWS // inner)
+    for start in range(0, len(outer), per_chunk):
+        block = outer[start:start + per_chunk]
+        rows = lst[start*inner:(start + len(block))*inner].reshape(len(block), inner, lst.shape[1])
+        rows[:, :, 0:column] = inner_columns
+        rows[:, :, column:-1] = (block/100.0).astype(numpy.float32)[:, None, :]
+        a = contract(table, block, count - 1)/100.0**count
+        for term in spec.bowing:
+            a = a - term.value*bowing_product(term, fractions, block, count)
+        rows[:, :, -1] = a.reshape(len(block), inner)
+    return lst
+
+def bowing_product(term, fractions, block, count):
+    """x_1*x_2*y_with... of a bowing term as decimals, shaped like the
+    lattice constants of a block of outer compositions."""
+    product = 1.0
+    factors = [(term.sublattice, i) for i in term.species] + list(term.others.items())
+    for k, i in factors:
+        values = (block if k == count - 1 else fractions[k])[:, i]/100.0
+        # the last sublattice is axis 0, sublattice k < count - 1 is axis count - 1 - k
+        axis = 0 if k == count - 1 else count - 1 - k
+        shape = [1]*count
+        shape[axis] = len(values)
+        product = product*values.reshape(shape)
+    return product
+
+def main(argv=None):
+    """Command line interface, see parser."""
+    args = parser.parse_args(argv)
+    try:
+        spec = load_spec(args.spec)
+        lst = alloy_database(spec, args.resolution)
+    except ValueError as error:
+        parser.error(str(error))
+    numpy.savez_compressed(args.output_file, lst, fields=numpy.array(field_names(spec)),
+                           decimals=fraction_decimals(spec, args.resolution))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+###############################################################################
+##                                Benchmarks                                 ##
+###############################################################################
+"""Times and memory profiles lattice_matcher.py, composition_calculator.py
+and iii_v_generator.py end-to-end on synthetic data and writes a JSON report.
+
+Every case runs the command line entry point (main(argv)) of a tool, so file
+parsing and output formatting are included. A case is run once for its wall
+time and, unless --no-memory is given, once more under tracemalloc for its
+peak of traced allocations (numpy reports its array buffers to tracemalloc).
+
+    python benchmarks/run_benchmarks.py report.json
+    python benchmarks/run_benchmarks.py new.json --baseline report.json
+
+With --baseline the cases are compared to an earlier report and the exit
+status is 1 if any case became slower than --max-slowdown times.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import composition_calculator
+import iii_v_generator
+import lattice_matcher
+from synthetic_catalogs import reference_materials, synthetic_catalog, write_catalog
+
+
+parser = argparse.ArgumentParser(description="Benchmarks the lattice matching tools on synthetic catalogs and III-V databases and writes a JSON report.")
+parser.add_argument("report", type=str, help="JSON file the report is written to.")
+parser.add_argument("--sizes", type=str, default="100,1000,10000,100000", help="Comma separated numbers of films of the lattice_matcher cases.")
+parser.add_argument("--max-substrates", type=int, default=10000, help="The substrate catalog of a case has min(size, max-substrates) rows.")
+parser.add_argument("--engines", type=str, default="indexed,vectorized,scalar", help="Comma separated lattice_matcher engines.")
+parser.add_argument("--max-pairs", type=json.loads, default='{"indexed": 1e12, "vectorized": 1e9, "scalar": 1e6}', help="JSON object of the largest film x substrate count run per engine.")
+parser.add_argument("--tolerance", type=float, default=0.01, help="Tolerance of the lattice_matcher cases.")
+parser.add_argument("--resolutions", type=str, default="10,5,2,1", help="Comma separated iii_v_generator.py resolutions in percent.")
+parser.add_argument("--composition-substrates", type=int, default=100, help="Number of substrates of the composition_calculator cases.")
+parser.add_argument("--composition-tolerance", type=float, default=0.005, help="Tolerance of the composition_calculator cases.")
+parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic catalogs.")
+parser.add_argument("--work-dir", type=str, help="Directory for the generated data, a temporary directory that is removed afterwards if not given.")
+parser.add_argument("--no-memory", action="store_true", help="Only measure time.")
+parser.add_argument("--baseline", type=str, help="Earlier report to compare the cases with.")
+parser.add_argument("--max-slowdown", type=float, default=1.25, help="Largest accepted ratio of time to the baseline time.")
+
+def measure(function, memory=True):
+    """Wall time and peak traced memory of function().
+
+    Returns:
+        A dict with seconds and, if memory is True, peak_bytes.
+    """
+    gc.collect()
+    start = time.perf_counter()
+    function()
+    result = {"seconds": time.perf_counter() - start}
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            function()
+            result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+def count_lines(file_name):
+    """Number of data lines of a tab delimited output file."""
+    with open(file_name) as output_file:
+        return sum(1 for line in output_file if not line.startswith("#"))
+
+def lattice_cases(sizes, max_substrates, engines, max_pairs, tolerance, seed, memory):
+    """lattice_matcher.py cases of every catalog size and engine, run in the
+    working directory."""
+    materials = reference_materials()
+    results = []
+    for size in sizes:
+        substrates = min(size, max_substrates)
+        film_file = "films_{}.txt".format(size)
+        substrate_file = "substrates_{}.txt".format(substrates)
+        write_catalog(film_file, synthetic_catalog(size, seed, materials=materials))
+        write_catalog(substrate_file, synthetic_catalog(substrates, seed + 1, materials=materials))
+        output_file = film_file[:-4] + "_on_" + substrate_file
+        for engine in engines:
+            if size*substrates > max_pairs.get(engine, float("inf")):
+                continue
+            argv = [film_file, substrate_file, str(tolerance), "--engine", engine]
+            result = {"benchmark": "lattice_matcher", "engine": engine, "films": size, "substrates": substrates, "tolerance": tolerance}
+            result.update(measure(lambda: lattice_matcher.main(argv), memory))
+            result["matches"] = count_lines(output_file)
+            results.append(result)
+            print_case(result)
+    return results
+
+def generation_cases(resolutions, memory):
+    """iii_v_generator.py cases, the databases are kept for the composition cases."""
+    results = []
+    for resolution in resolutions:
+        database = "iii_v_{}.npz".format(resolution)
+        result = {"benchmark": "iii_v_generator", "resolution": resolution}
+        result.update(measure(lambda: iii_v_generator.main([str(resolution), database]), memory))
+        result["rows"] = iii_v_generator.number_of_rows(resolution)
+        result["file_bytes"] = os.path.getsize(database)
+        results.append(result)
+        print_case(result)
+    return results
+
+def composition_cases(resolutions, substrates, tolerance, seed, memory):
+    """composition_calculator.py cases against the generated databases and
+    against the database-free solver at the same resolutions."""
+    substrate_file = "composition_substrates_{}.txt".format(substrates)
+    write_catalog(substrate_file, synthetic_catalog(substrates, seed + 2))
+    output_file = "composition_matches_for_" + substrate_file
+    results = []
+    for resolution in resolutions:
+        database = "iii_v_{}.npz".format(resolution)
+        sources = [("solver", ["--resolution", str(resolution)])]
+        if os.path.exists(database):
+            # the first run builds the lattice index, the measured runs reuse it
+            composition_calculator.main([substrate_file, database, "--tolerance", str(tolerance)])
+            sources = [("database", [database]), ("database without index", [database, "--no-index"])] + sources
+        for source, arguments in sources:
+            argv = [substrate_file] + arguments + ["--tolerance", str(tolerance)]
+            result = {"benchmark": "composition_calculator", "source": source, "resolution": resolution, "substrates": substrates, "tolerance": tolerance}
+            result.update(measure(lambda: composition_calculator.main(argv), memory))
+            result["matches"] = count_lines(output_file)
+            results.append(result)
+            print_case(result)
+    return results
+
+def print_case(result):
+    """One progress line per case on stderr."""
+    parameters = ", ".join("{}={}".format(key, value) for key, value in result.items() if key not in ("seconds", "peak_bytes"))
+    sys.stderr.write("{:10.3f} s  {}\n".format(result["seconds"], parameters))
+
+def case_key(result):
+    """Parameters identifying a case across reports."""
+    return tuple(sorted((key, value) for key, value in result.items()
+                        if key not in ("seconds", "peak_bytes", "matches", "rows", "file_bytes")))
+
+def compare(results, baseline_results, max_slowdown):
+    """Prints the time ratio of every case found in the baseline.
+
+    Returns:
+        The number of cases slower than max_slowdown times the baseline.
+    """
+    baseline = dict((case_key(result), result) for result in baseline_results)
+    slower = 0
+    for result in results:
+        old = baseline.get(case_key(result))
+        if old is None or old["seconds"] <= 0:
+            continue
+        ratio = result["seconds"]/old["seconds"]
+        flag = ""
+        if ratio > max_slowdown:
+            flag = "  SLOWER"
+            slower += 1
+        print("{:7.2f}x  {}{}".format(ratio, ", ".join("{}={}".format(key, value) for key, value in case_key(result)), flag))
+    return slower
+
+def main(argv=None):
+    """Command line interface, see parser."""
+    args = parser.parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    engines = [engine for engine in args.engines.split(",") if engine]
+    resolutions = [int(resolution) for resolution in args.resolutions.split(",") if resolution]
+    memory = not args.no_memory
+    report_file_name = os.path.abspath(args.report)
+    baseline_file_name = os.path.abspath(args.baseline) if args.baseline else None
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="lattice_benchmarks_")
+    if not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+    # the tools name their output files after their relative input file names
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        results = lattice_cases(sizes, args.max_substrates, engines, args.max_pairs, args.tolerance, args.seed, memory)
+        results += generation_cases(resolutions, memory)
+        results += composition_cases(resolutions, args.composition_substrates, args.composition_tolerance, args.seed, memory)
+    finally:
+        os.chdir(cwd)
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    report = {"environment": {"python": platform.python_version(), "numpy": numpy.__version__,
+                              "platform": platform.platform(), "cpus": os.cpu_count()},
+              "results": results}
+    with open(report_file_name, "w") as report_file:
+        json.dump(report, report_file, indent=1)
+    if baseline_file_name:
+        with open(baseline_file_name) as baseline_file:
+            slower = compare(results, json.load(baseline_file)["results"], args.max_slowdown)
+        if slower:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
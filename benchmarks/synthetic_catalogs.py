@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+###############################################################################
+##                        Synthetic Material Catalogs                        ##
+###############################################################################
+"""Generates film/substrate catalogs in the tab delimited format of
+cubic.txt, tetragonal.txt and hexagonal.txt at any size.
+
+Every synthetic material is a randomly chosen material of the curated
+catalogs with its a and c scaled by a log-normal factor, so the symmetry
+shares and the a and c/a distributions of each symmetry follow the real data.
+"""
+import argparse
+import os
+import numpy
+
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CATALOGS = {"C": "cubic.txt", "T": "tetragonal.txt", "H": "hexagonal.txt"}
+HEADER = "#Composition\tSymmetry\ta\tc\n"
+
+#materials with a larger lattice constant (in Angstrom) are treated as typos
+MAX_LATTICE_CONSTANT = 100.0
+
+parser = argparse.ArgumentParser(description="Generates a synthetic tab delimited material catalog with the a and c distributions of the curated catalogs.")
+parser.add_argument("rows", type=int, help="Number of materials.")
+parser.add_argument("output_file", type=str, help="Name of the catalog file to write.")
+parser.add_argument("--seed", type=int, default=0, help="Seed of the random generator.")
+parser.add_argument("--spread", type=float, default=0.05, help="Standard deviation of the log-normal scaling of a and c.")
+
+def reference_materials(directory=REPOSITORY):
+    """Lattice constants of the curated catalogs.
+
+    Args:
+        directory: directory holding cubic.txt, tetragonal.txt and
+                   hexagonal.txt
+    Returns:
+        A dict of symmetry to an (n, 2) float64 array of a and c values.
+    """
+    materials = {}
+    for symmetry, file_name in CATALOGS.items():
+        catalog = numpy.atleast_1d(numpy.genfromtxt(os.path.join(directory, file_name), comments="#", delimiter="\t", dtype=None))
+        names = catalog.dtype.names
+        lattice = numpy.stack([catalog[names[2]].astype(numpy.float64), catalog[names[3]].astype(numpy.float64)], axis=1)
+        materials[symmetry] = lattice[lattice[:, 0] < MAX_LATTICE_CONSTANT]
+    return materials
+
+def synthetic_catalog(rows, seed=0, spread=0.05, materials=None):
+    """Random materials following the curated catalogs.
+
+    Args:
+        rows: number of materials
+        seed: seed of the random generator
+        spread: standard deviation of the log-normal scaling of a and c
+        materials: reference_materials(), read from the repository if not
+                   given
+    Returns:
+        A structured array with the fields composition, symmetry, a and c
+        like numpy.genfromtxt() returns for a catalog file.
+    """
+    if materials is None:
+        materials = reference_materials()
+    rng = numpy.random.default_rng(seed)
+    symmetries = sorted(materials)
+    shares = numpy.array([len(materials[symmetry]) for symmetry in symmetries], dtype=numpy.float64)
+    chosen = rng.choice(len(symmetries), size=rows, p=shares/shares.sum())
+    catalog = numpy.zeros(rows, dtype=[("composition", "U12"), ("symmetry", "U1"), ("a", "f8"), ("c", "f8")])
+    catalog["composition"] = numpy.char.add("M", numpy.arange(rows).astype(str))
+    for k, symmetry in enumerate(symmetries):
+        selected = numpy.flatnonzero(chosen == k)
+        reference = materials[symmetry][rng.integers(0, len(materials[symmetry]), len(selected))]
+        scale = numpy.exp(rng.normal(0.0, spread, (len(selected), 2)))
+        catalog["symmetry"][selected] = symmetry
+        catalog["a"][selected] = numpy.round(reference[:, 0]*scale[:, 0], 4)
+        # cubic materials keep c = 0 as in cubic.txt
+        catalog["c"][selected] = numpy.round(reference[:, 1]*scale[:, 1], 4)
+    return catalog
+
+def write_catalog(file_name, catalog):
+    """Writes a catalog array as a tab delimited material file."""
+    with open(file_name, "w") as catalog_file:
+        catalog_file.write(HEADER)
+        for composition, symmetry, a, c in catalog.tolist():
+            catalog_file.write("{}\t{}\t{}\t{}\n".format(composition, symmetry, a, c))
+
+def main(argv=None):
+    """Command line interface, see parser."""
+    args = parser.parse_args(argv)
+    write_catalog(args.output_file, synthetic_catalog(args.rows, args.seed, args.spread))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,481 @@
+#!/usr/bin/env python
+###############################################################################
+##                          Metamorphic Buffer Paths                         ##
+###############################################################################
+"""Finds graded buffers: sequences of compositions from a composition database
+that step from a substrate lattice constant to a target lattice constant,
+each layer mismatched by less than --step-mismatch to the one below it.
+
+The fewest layers that can reach the target are found first, following the
+gaps between the lattice constants of the database. Among buffers with that
+number of layers (or --layers) a beam search looks for the smoothest one,
+the one with the smallest total composition change. The change between two
+layers is half the sum of the absolute fraction differences, i.e. the
+fraction of each sublattice that is exchanged, summed over the sublattices.
+
+Two indexes keep the queries fast on large databases:
+    - the sorted lattice constant index of composition_calculator.py gives
+      the rows inside each mismatch window
+    - a composition grid index (<database>.grid.npz, built once like the
+      lattice constant index) sorts the rows by their composition as integer
+      steps, so the compositions closest to a layer are looked up around it
+      instead of scanning its whole mismatch window
+
+    python buffer_path.py iii_v.npz 5.6533 5.8687 --step-mismatch 0.01
+
+writes the layers as tab delimited lines to the standard output.
+"""
+import argparse
+import collections
+import os
+import sys
+import numpy
+from composition_calculator import composition_fields, float32_above, float32_below, load_lattice_index
+from composition_database import CHUNK_ROWS, load_database, memmap_npz, save_aligned_npz
+from match_output import composition_match_records, format_compositions
+
+
+parser = argparse.ArgumentParser(description="Finds the graded buffer with the fewest layers and the smallest composition change from a substrate lattice constant to a target lattice constant.")
+parser.add_argument("lattice_constant_database", type=str, help="Compressed npz file or compact database (see composition_database.py) containing composition and lattice constant information.")
+parser.add_argument("start", type=float, help="Lattice constant of the substrate.")
+parser.add_argument("target", type=float, help="Lattice constant of the top of the buffer.")
+parser.add_argument("--step-mismatch", type=float, default=0.01, help="Largest mismatch of a layer to the layer below it as a decimal (default %(default)s).")
+parser.add_argument("--target-tolerance", type=float, default=0.001, help="Largest mismatch of the top layer to the target as a decimal (default %(default)s).")
+parser.add_argument("--layers", type=int, help="Number of layers, the fewest that reach the target if not given.")
+parser.add_argument("--max-layers", type=int, default=50, help="Give up when more layers would be needed (default %(default)s).")
+parser.add_argument("--beam", type=int, default=16, help="Partial buffers kept per layer (default %(default)s).")
+parser.add_argument("--branch", type=int, default=8, help="Closest compositions tried on top of each kept buffer (default %(default)s).")
+
+#largest ratio of the size bound of a composition ball to its lattice constant window that is built
+BALL_WINDOW_RATIO = 8
+
+#header of the written buffer
+BUFFER_HEADER = "#Layer\tComposition\ta\tMismatch\tComposition Change\n"
+
+#a buffer: database row numbers and rows of its layers, bottom first, and its total composition change
+BufferPath = collections.namedtuple("BufferPath", ["rows", "layers", "cost"])
+
+def composition_sublattices(fields):
+    """Column numbers of the composition fields of each sublattice, the
+    fields of a sublattice share their prefix (x_Al, x_Ga, ...)."""
+    sublattices = collections.OrderedDict()
+    for k, name in enumerate(fields):
+        sublattices.setdefault(name.split("_", 1)[0], []).append(k)
+    return list(sublattices.values())
+
+def simplex_offsets(species, radius):
+    """Integer changes of the fractions of one sublattice that keep their sum.
+
+    Args:
+        species: number of species of the sublattice
+        radius: largest change, half the sum of the absolute changes
+    Returns:
+        An int64 array with one row per change, including no change.
+    """
+    offsets = numpy.zeros((1, 0), dtype=numpy.int64)
+    used = numpy.zeros(1, dtype=numpy.int64)
+    for level in range(species - 1):
+        values = numpy.arange(-radius, radius + 1)
+        offsets = numpy.column_stack([numpy.repeat(offsets, len(values), axis=0), numpy.tile(values, len(offsets))])
+        used = numpy.repeat(used, len(values)) + abs(numpy.tile(values, len(used)))
+        keep = used <= 2*radius
+        offsets, used = offsets[keep], used[keep]
+    last = -offsets.sum(axis=1)
+    keep = used + abs(last) <= 2*radius
+    return numpy.column_stack([offsets[keep], last[keep]])
+
+class CompositionGrid(object):
+    """Composition columns of a database as integer steps, sorted by a mixed
+    radix code, so the rows with given compositions are found with
+    numpy.searchsorted.
+
+    Attributes:
+        codes: sorted int64 codes of the rows
+        order: row numbers in the order of codes
+        scale: steps per unit fraction, every sublattice sums to scale steps
+        sublattices: column numbers of the fields of every sublattice
+    """
+
+    def __init__(self, codes, order, scale, sublattices):
+        self.codes = codes
+        self.order = order
+        self.scale = scale
+        self.sublattices = sublattices
+        columns = sum(len(sublattice) for sublattice in sublattices)
+        self.powers = (scale + 1)**numpy.arange(columns, dtype=numpy.int64)
+        self.simplices = {}
+        self.balls = {}
+
+    @classmethod
+    def build(cls, lattice_consts, fields, decimals=2):
+        """Encodes and sorts the compositions of a database.
+
+        Args:
+            lattice_consts: array or database of composition and lattice
+                            constant rows
+            fields: names of the composition columns
+            decimals: decimals of the fractions, they are multiples of
+                      10**-decimals
+        Raises:
+            ValueError: if the fractions are not on a grid that fits an int64
+                        code
+        """
+        unit = 10**decimals
+        step = 0
+        for start in range(0, len(lattice_consts), CHUNK_ROWS):
+            units = numpy.rint(numpy.asarray(lattice_consts[start:start + CHUNK_ROWS])[:, :len(fields)].astype(numpy.float64)*unit).astype(numpy.int64)
+            step = numpy.gcd.reduce(numpy.append(units.ravel(), step))
+        step = int(step) or unit
+        scale = unit // step
+        if float(scale + 1)**len(fields) >= 2.0**63:
+            raise ValueError("{} composition steps of {} fields do not fit a grid code".format(scale, len(fields)))
+        grid = cls(None, None, scale, composition_sublattices(fields))
+        codes = numpy.empty(len(lattice_consts), dtype=numpy.int64)
+        for start in range(0, len(lattice_consts), CHUNK_ROWS):
+            codes[start:start + CHUNK_ROWS] = grid.encode(grid.steps(lattice_consts[start:start + CHUNK_ROWS]))
+        order = numpy.argsort(codes, kind="stable")
+        if len(order) < 2**31:
+            order = order.astype(numpy.int32)
+        grid.codes, grid.order = codes[order], order
+        return grid
+
+    def steps(self, rows):
+        """Integer steps of the composition columns of database rows."""
+        rows = numpy.asarray(rows)
+        return numpy.rint(rows[:, :len(self.powers)].astype(numpy.float64)*self.scale).astype(numpy.int64)
+
+    def encode(self, steps):
+        """Codes of integer step rows."""
+        return steps.dot(self.powers)
+
+    def find(self, steps):
+        """Row numbers of the compositions of integer step rows, -1 for those
+        missing from the database."""
+        codes = self.encode(steps)
+        positions = numpy.minimum(numpy.searchsorted(self.codes, codes), len(self.codes) - 1)
+        found = self.codes[positions] == codes
+        return numpy.where(found, self.order[positions], -1)
+
+    def simplex(self, species, radius):
+        """simplex_offsets() of a sublattice, cached."""
+        if (species, radius) not in self.simplices:
+            self.simplices[species, radius] = simplex_offsets(species, radius)
+        return self.simplices[species, radius]
+
+    def ball_bound(self, radius):
+        """Upper bound of the size of ball(radius), known before building it."""
+        return numpy.prod([float(len(self.simplex(len(columns), radius))) for columns in self.sublattices])
+
+    def ball(self, radius):
+        """Step changes of all sublattices with a composition change of at
+        most radius steps, and their changes."""
+        if radius not in self.balls:
+            offsets = numpy.zeros((1, len(self.powers)), dtype=numpy.int64)
+            changes = numpy.zeros(1, dtype=numpy.int64)
+            for columns in self.sublattices:
+                simplex = self.simplex(len(columns), radius)
+                simplex_changes = abs(simplex).sum(axis=1) // 2
+                total = numpy.repeat(changes, len(simplex)) + numpy.tile(simplex_changes, len(changes))
+                offsets = numpy.repeat(offsets, len(simplex), axis=0)
+                offsets[:, columns] = numpy.tile(simplex, (len(changes), 1))
+                keep = total <= radius
+                offsets, changes = offsets[keep], total[keep]
+            self.balls[radius] = (offsets, changes)
+        return self.balls[radius]
+
+def grid_file_name(database_file_name):
+    """Name of the composition grid index stored next to a database. The
+    whole file name is kept, so db.npz and db.cdb have grids of their own."""
+    return database_file_name + ".grid.npz"
+
+def load_composition_grid(database_file_name, lattice_consts):
+    """Loads the composition grid index of a database, building and saving it
+    next to the database when it is missing or out of date, as
+    composition_calculator.load_lattice_index() does for the lattice
+    constant index.
+
+    Args:
+        database_file_name: path of the lattice constant database
+        lattice_consts: the database as returned by load_database()
+    Returns:
+        A CompositionGrid for lattice_consts.
+    """
+    fields = composition_fields(lattice_consts)
+    grid_name = grid_file_name(database_file_name)
+    stat = os.stat(database_file_name)
+    if os.path.exists(grid_name):
+        stored = memmap_npz(grid_name)
+        if (int(stored["source_size"]) == stat.st_size and int(stored["source_mtime"]) == stat.st_mtime_ns
+                and len(stored["order"]) == len(lattice_consts)):
+            return CompositionGrid(stored["codes"], stored["order"], int(stored["scale"]), composition_sublattices(fields))
+    grid = CompositionGrid.build(lattice_consts, fields, getattr(lattice_consts, "decimals", 2))
+    try:
+        with open(grid_name, "wb") as grid_file:
+            save_aligned_npz(grid_file, codes=grid.codes, order=grid.order, scale=grid.scale,
+                             source_size=stat.st_size, source_mtime=stat.st_mtime_ns)
+    except IOError:
+        pass # a read-only database directory only costs the rebuild next time
+    return grid
+
+def minimum_layers(start, target, step_mismatch, target_tolerance, max_layers):
+    """Fewest layers whose lattice constants can reach the target window, None
+    if more than max_layers are needed."""
+    for layers in range(1, max_layers + 1):
+        if (start*(1 + step_mismatch)**layers > (1 - target_tolerance)*target
+                and start*(1 - step_mismatch)**layers < (1 + target_tolerance)*target):
+            return layers
+    return None
+
+def reachable_bounds(target, step_mismatch, target_tolerance, remaining):
+    """Lattice constants from which the target window can be reached with
+    remaining more layers."""
+    return (1 - target_tolerance)*target/(1 + step_mismatch)**remaining, (1 + target_tolerance)*target/(1 - step_mismatch)**remaining
+
+def reaching_levels(index, target, step_mismatch, target_tolerance, layers):
+    """Lattice constants of the database from which the target window is
+    reached with exactly k more layers, for k from 0 to layers - 1.
+
+    Unlike reachable_bounds() this follows the gaps of the database. Going
+    back one layer maps a run of consecutive lattice constants x to the
+    lattice constants between min(x)/(1 + step_mismatch) and
+    max(x)/(1 - step_mismatch): the windows of neighbouring constants of the
+    run only leave out values between them, which are not in the database.
+
+    Args:
+        index: LatticeIndex of the database
+        target: lattice constant of the target
+        step_mismatch: largest mismatch of a layer to the one below it
+        target_tolerance: largest mismatch of the top layer to the target
+        layers: number of levels
+    Returns:
+        A list of (lows, highs), sorted float32 bounds of disjoint closed
+        intervals of index.keys, for k = 0, 1, ...
+    """
+    keys = index.keys
+    runs = [(numpy.searchsorted(keys, float32_above((1 - target_tolerance)*target), side="left"),
+             numpy.searchsorted(keys, float32_below((1 + target_tolerance)*target), side="right"))]
+    levels = []
+    for k in range(layers):
+        runs = [(first, last) for first, last in runs if last > first]
+        levels.append((keys[[first for first, last in runs]], keys[[last - 1 for first, last in runs]]))
+        below = []
+        for first, last in runs:
+            first = numpy.searchsorted(keys, float32_above(keys[first]/(1 + step_mismatch)), side="left")
+            last = numpy.searchsorted(keys, float32_below(keys[last - 1]/(1 - step_mismatch)), side="right")
+            if below and first <= below[-1][1]:
+                below[-1] = (below[-1][0], max(last, below[-1][1]))
+            else:
+                below.append((first, last))
+        runs = below
+    return levels
+
+def reaching_rows(lattice_consts, rows, level):
+    """Which rows have a lattice constant in a level of reaching_levels()."""
+    lows, highs = level
+    a = lattice_consts[rows, -1] if len(rows) else numpy.zeros(0, dtype=lows.dtype)
+    run = numpy.searchsorted(lows, a, side="right") - 1
+    return (run >= 0) & (a <= highs[numpy.maximum(run, 0)]) if len(lows) else numpy.zeros(len(rows), dtype=bool)
+
+def smallest_by_keys(keys, k):
+    """Positions of the k smallest entries ordered by several keys, the first
+    key most significant. Each key is partitioned before the remaining
+    entries are sorted, so large inputs are not sorted completely."""
+    candidates = numpy.arange(len(keys[0]))
+    for key in keys:
+        if len(candidates) <= k:
+            break
+        values = key[candidates]
+        candidates = candidates[values <= numpy.partition(values, k - 1)[k - 1]]
+    return candidates[numpy.lexsort(tuple(key[candidates] for key in reversed(keys)))[:k]]
+
+def closest_rows(lattice_consts, index, grid, steps, lower, upper, exclude, branch, level=None):
+    """The branch compositions closest to a composition with a lattice
+    constant inside a window.
+
+    The L1 ball around the composition grows until it holds branch rows inside
+    the window; once it would be larger than the window the window is
+    scanned instead.
+
+    Args:
+        lattice_consts: database
+        index: LatticeIndex of the database
+        grid: CompositionGrid of the database
+        steps: integer steps of the composition
+        lower, upper: exclusive lattice constant bounds
+        exclude: row number that is not returned, the composition itself
+        branch: number of rows returned
+        level: only rows inside this level of reaching_levels(), all if None
+    Returns:
+        (rows, changes): row numbers and their composition changes in steps,
+        at most branch of them.
+    """
+    start = numpy.searchsorted(index.keys, float32_above(lower), side="left")
+    stop = numpy.searchsorted(index.keys, float32_below(upper), side="right")
+    if stop <= start:
+        return numpy.zeros(0, dtype=numpy.intp), numpy.zeros(0, dtype=numpy.int64)
+    radius = 1
+    while True:
+        # balls are only built up to a few times the size of the window, then the window is scanned
+        if grid.ball_bound(radius) > BALL_WINDOW_RATIO*(stop - start) or len(grid.ball(radius)[0]) > stop - start \
+                or radius > grid.scale*len(grid.sublattices):
+            rows = index.order[start:stop].astype(numpy.intp)
+            if level is not None:
+                rows = rows[reaching_rows(lattice_consts, rows, level)]
+            changes = abs(grid.steps(lattice_consts[rows]) - steps).sum(axis=1) // 2
+            break
+        offsets, changes = grid.ball(radius)
+        neighbours = steps + offsets
+        valid = ((neighbours >= 0) & (neighbours <= grid.scale)).all(axis=1)
+        rows = grid.find(neighbours[valid]).astype(numpy.intp)
+        changes = changes[valid]
+        found = rows >= 0
+        rows, changes = rows[found], changes[found]
+        a = lattice_consts[rows, -1] if len(rows) else numpy.zeros(0)
+        inside = (a > lower) & (a < upper)
+        if level is not None:
+            inside &= reaching_rows(lattice_consts, rows, level)
+        rows, changes = rows[inside], changes[inside]
+        if numpy.count_nonzero(rows != exclude) >= branch:
+            break
+        radius *= 2
+    keep = rows != exclude
+    rows, changes = rows[keep], changes[keep]
+    best = smallest_by_keys([changes, rows], branch)
+    return rows[best], changes[best]
+
+def beam_search(lattice_consts, index, grid, start, target, layers, step_mismatch, target_tolerance, beam=16, branch=8, levels=None):
+    """Smoothest buffer with a given number of layers found by beam search.
+
+    The buffers kept after each layer are ranked by their composition change,
+    then by the number of species in their top layer and by how close it is
+    to the target, so the first layer prefers the simplest alloys. With the
+    levels of reaching_levels() only compositions that can still reach the
+    target in the remaining layers are kept, so a narrow beam does not end in
+    a gap of the database.
+
+    Args:
+        lattice_consts, index, grid: database and its indexes
+        start, target: lattice constants of the substrate and the target
+        layers: number of layers
+        step_mismatch: largest mismatch of a layer to the one below it
+        target_tolerance: largest mismatch of the top layer to the target
+        beam: buffers kept per layer
+        branch: closest compositions tried on top of each kept buffer
+        levels: reaching_levels() of at least layers levels, or None
+    Returns:
+        A BufferPath or None if the search finds no buffer.
+    """
+    columns = len(grid.powers)
+    a = numpy.array([start])
+    cost = numpy.zeros(1, dtype=numpy.int64)
+    steps = rows = None
+    history = []
+    for layer in range(1, layers + 1):
+        low, high = reachable_bounds(target, step_mismatch, target_tolerance, layers - layer)
+        level = levels[layers - layer] if levels is not None else None
+        candidates, parents, changes = [], [], []
+        for state in range(len(a)):
+            lower, upper = max((1 - step_mismatch)*a[state], low), min((1 + step_mismatch)*a[state], high)
+            if lower >= upper:
+                continue
+            if steps is None:
+                # the first layer, every composition of the window is a candidate
+                first = numpy.searchsorted(index.keys, float32_above(lower), side="left")
+                last = numpy.searchsorted(index.keys, float32_below(upper), side="right")
+                found = index.order[first:max(first, last)].astype(numpy.intp)
+                if level is not None:
+                    found = found[reaching_rows(lattice_consts, found, level)]
+                found_changes = numpy.zeros(len(found), dtype=numpy.int64)
+            else:
+                found, found_changes = closest_rows(lattice_consts, index, grid, steps[state], lower, upper, rows[state], branch, level)
+            candidates.append(found)
+            parents.append(numpy.full(len(found), state))
+            changes.append(found_changes)
+        if not candidates or not sum(len(found) for found in candidates):
+            return None
+        candidates, parents, changes = [numpy.concatenate(parts) for parts in (candidates, parents, changes)]
+        total = cost[parents] + changes
+        if len(a) > 1:
+            # a composition reached from several buffers keeps the smoothest
+            first = numpy.lexsort((parents, total, candidates))
+            first = first[numpy.r_[True, candidates[first][1:] != candidates[first][:-1]]]
+            candidates, parents, total = candidates[first], parents[first], total[first]
+        layer_rows = numpy.asarray(lattice_consts[candidates])
+        species = numpy.count_nonzero(layer_rows[:, :columns] > 0, axis=1)
+        distance = abs(numpy.log(target/layer_rows[:, -1].astype(numpy.float64)))
+        kept = smallest_by_keys([total, species, distance, candidates], beam)
+        rows, cost, a = candidates[kept], total[kept], layer_rows[kept, -1].astype(numpy.float64)
+        steps = grid.steps(layer_rows[kept])
+        history.append((rows, parents[kept]))
+    path = []
+    state = 0
+    for layer_rows, layer_parents in reversed(history):
+        path.append(layer_rows[state])
+        state = layer_parents[state]
+    path = numpy.array(path[::-1], dtype=numpy.intp)
+    return BufferPath(path, numpy.asarray(lattice_consts[path]), cost[0]/float(grid.scale))
+
+def buffer_path(lattice_consts, index, grid, start, target, step_mismatch=0.01, target_tolerance=0.001, layers=None, max_layers=50, beam=16, branch=8):
+    """Smoothest buffer with the fewest layers, or with a given number of
+    layers, see the module documentation.
+
+    Args:
+        lattice_consts, index, grid: database, its LatticeIndex and its
+                                     CompositionGrid
+        start, target: lattice constants of the substrate and the target
+        step_mismatch: largest mismatch of a layer to the one below it
+        target_tolerance: largest mismatch of the top layer to the target
+        layers: number of layers, the fewest possible if None
+        max_layers: largest number of layers tried
+        beam, branch: width of the beam search, see beam_search()
+    Returns:
+        A BufferPath.
+    Raises:
+        ValueError: if no buffer is found
+    """
+    fewest = minimum_layers(start, target, step_mismatch, target_tolerance, max_layers)
+    if fewest is None:
+        raise ValueError("the target cannot be reached with {} layers".format(max_layers))
+    if layers is not None and layers < fewest:
+        raise ValueError("at least {} layers are needed to reach the target".format(fewest))
+    # a database with gaps in its lattice constants may need more than the fewest layers
+    counts = [layers] if layers is not None else range(fewest, max_layers + 1)
+    levels = reaching_levels(index, target, step_mismatch, target_tolerance, max(counts))
+    for count in counts:
+        path = beam_search(lattice_consts, index, grid, start, target, count, step_mismatch, target_tolerance, beam, branch, levels)
+        if path is not None:
+            return path
+    raise ValueError("no buffer of the database reaches the target")
+
+def format_buffer(path, start, fields, decimals=2):
+    """Tab delimited lines of a buffer, starting with the substrate."""
+    records = composition_match_records(path.layers, "", "", "", fields)
+    compositions = format_compositions(records, decimals)
+    steps = numpy.rint(path.layers[:, :len(fields)].astype(numpy.float64)*10**decimals)
+    below = numpy.concatenate([[start], path.layers[:-1, -1].astype(numpy.float64)])
+    lines = ["0\tsubstrate\t{!r}\t\t\n".format(start)]
+    for k in range(len(path.rows)):
+        change = "" if k == 0 else "{0:.{1}f}".format(abs(steps[k] - steps[k - 1]).sum()/2/10**decimals, decimals)
+        lines.append("{}\t{}\t{!r}\t{:.6f}\t{}\n".format(k + 1, compositions[k], float(path.layers[k, -1]), float(path.layers[k, -1])/below[k] - 1, change))
+    return "".join(lines)
+
+def main(argv=None):
+    """Command line interface, see parser."""
+    args = parser.parse_args(argv)
+    if args.start <= 0 or args.target <= 0 or not 0 < args.step_mismatch < 1 or args.target_tolerance < 0:
+        parser.error("lattice constants must be positive, --step-mismatch between 0 and 1 and --target-tolerance not negative")
+    if args.beam < 1 or args.branch < 1 or (args.layers is not None and args.layers < 1):
+        parser.error("--beam, --branch and --layers must be at least 1")
+    lattice_constants = load_database(args.lattice_constant_database)
+    index = load_lattice_index(args.lattice_constant_database, lattice_constants)
+    try:
+        grid = load_composition_grid(args.lattice_constant_database, lattice_constants)
+        path = buffer_path(lattice_constants, index, grid, args.start, args.target, args.step_mismatch, args.target_tolerance,
+                           args.layers, args.max_layers, args.beam, args.branch)
+    except ValueError as error:
+        parser.error(str(error))
+    sys.stdout.write(BUFFER_HEADER)
+    sys.stdout.write(format_buffer(path, args.start, composition_fields(lattice_constants), getattr(lattice_constants, "decimals", 2)))
+
+if __name__ == "__main__":
+    main()
@@ -12,73 +12,507 @@ semiconductor lattice constant .npz file, compares lattice constants and writes
 matches to a tab delimited txt file.
 """
 
+import os #for locating and validating the lattice constant index file
+import tempfile #--stream spool of the matches of several blocks
+import time #--stats timings
 import numpy #includes numpy.sqrt()
 import argparse #for command line implementation
+from iii_v_generator import REFERENCE_LATTICE_CONSTANTS, simplex_steps, paired_lattice_constants
+from composition_database import (CHUNK_ROWS, III_V_FIELDS, CompactDatabase, NamedDatabase, database_chunks,
+                                  database_fields, load_database, memmap_npz, save_aligned_npz)
+from match_output import (COMPRESSIONS, OUTPUT_FORMATS, WRITE_QUEUE, BackgroundMatchWriter, RecordCollector,
+                          composition_match_records, concatenate_records, open_match_writer, output_file_name,
+                          pair_match_records)
+from match_stats import MatchStats, StatsWriter
+from match_summary import CompositionSummary
+from material_catalog import load_catalog
+from parallel_shards import map_shards, shard_bounds, worker_arrays, worker_state
+from result_store import (digest_numbers, expand_to_rows, load_store, row_hashes, save_store, unique_rows,
+                          within_group_rank)
 
 parser = argparse.ArgumentParser(description="Software for calculating a range of material composition for an epitaxially grown film on a given substrate.")
 parser.add_argument("substrate", type=str, help="Tab-delimited txt file with substrate material data.")
-parser.add_argument("lattice_constant_database", type=str, help="Compressed npz file containing composition and lattice constant information.")
-args = parser.parse_args()
+parser.add_argument("lattice_constant_database", type=str, nargs="?", help="Compressed npz file (see iii_v_generator.py and alloy_generator.py) or compact database (see composition_database.py) containing composition and lattice constant information.")
+parser.add_argument("--resolution", type=float, help="Solve for matching compositions on a grid with this step in percent instead of reading a database. The step must divide 100.")
+parser.add_argument("--tolerance", type=float, default=0.005, help="Tolerance level for mismatch as a decimal (default 0.005).")
+parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default="tsv", help="Write matches as tab delimited text (tsv) or as a structured numpy array (npy, npz).")
+parser.add_argument("--jobs", type=int, default=1, help="Number of worker processes, substrates are split into shards that are matched in parallel.")
+parser.add_argument("--incremental", action="store_true", help="Keep the matches in a store keyed by the content of every substrate row and only compute new or changed substrates.")
+parser.add_argument("--top-k", type=int, help="Only write the K compositions with the smallest mismatch for each substrate, over all of its orientations.")
+parser.add_argument("--stats", type=str, help="Write counters of time per substrate and of matches and bytes written per substrate and orientation to this JSON file.")
+parser.add_argument("--stream", action="store_true", help="Read the database once in blocks of --chunk-rows rows and match every block against all substrates, instead of searching the whole database for each substrate. The output is the same, the matches of several blocks are kept in a temporary file until all blocks are read.")
+parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help="Database rows per block of --stream (default %(default)s).")
+parser.add_argument("--summary", type=int, metavar="BINS", help="Write per substrate and orientation statistics of the matches (a mismatch histogram with BINS bins, fraction ranges, family counts and representative compositions) to a JSON file instead of the matches.")
+parser.add_argument("--representatives", type=int, default=3, help="Compositions kept per mismatch bin by --summary (default %(default)s).")
+parser.add_argument("--no-index", action="store_true", help="Scan the whole database for every substrate instead of using the sorted lattice constant index.")
+parser.add_argument("--pairs", type=float, metavar="RATIO", help="Write strain balanced pairs of a tensile and a compressive composition whose average lattice constant, weighted by thickness with the tensile layer RATIO times as thick as the compressive one, matches each substrate within --tolerance, to composition_pairs_for_<substrates>.txt.")
+parser.add_argument("--tensile-mismatch", type=float, default=0.02, help="Largest mismatch of the tensile layer of a --pairs pair as a decimal (default %(default)s).")
+parser.add_argument("--compressive-mismatch", type=float, default=0.02, help="Largest mismatch of the compressive layer of a --pairs pair as a decimal (default %(default)s).")
+parser.add_argument("--compress", choices=sorted(COMPRESSIONS), default="none", help="Compress tsv output with gzip (.txt.gz) or xz (.txt.xz).")
+parser.add_argument("--write-queue", type=int, default=WRITE_QUEUE, help="Batches of matches waiting to be formatted and written by a writer thread while matching goes on, 0 writes them in between (default %(default)s).")
 
-def check_substrate_file(sub_file, lattice_const_file, tolerance_percentage, output_file):
+class LatticeIndex(object):
+    """Lattice constant column of a composition database sorted once, so that
+    each tolerance window becomes a pair of numpy.searchsorted lookups.
+
+    Attributes:
+        order: row numbers of the database sorted by lattice constant
+        keys: float32 lattice constants in sorted order
+    """
+
+    def __init__(self, order, keys):
+        self.order = order
+        self.keys = keys
+
+    @classmethod
+    def build(cls, lattice_consts):
+        """Sorts the right-most column of a lattice constant array."""
+        column = numpy.ascontiguousarray(lattice_consts[:,-1], dtype=numpy.float32)
+        order = numpy.argsort(column, kind="stable")
+        if len(order) < 2**31:
+            order = order.astype(numpy.int32)
+        return cls(order, column[order])
+
+    def window(self, lower, upper):
+        """Row numbers with lower < a < upper in database order.
+
+        Args:
+            lower: exclusive lower bound of the lattice constant
+            upper: exclusive upper bound of the lattice constant
+        Returns:
+            A sorted array of row numbers, the same rows selected by
+            (lattice_consts[:,-1] > lower) & (lattice_consts[:,-1] < upper).
+        """
+        start = numpy.searchsorted(self.keys, float32_above(lower), side="left")
+        stop = numpy.searchsorted(self.keys, float32_below(upper), side="right")
+        if stop <= start:
+            return numpy.zeros(0, dtype=self.order.dtype)
+        return numpy.sort(self.order[start:stop])
+
+def float32_above(value):
+    """Smallest float32 strictly greater than the float64 value."""
+    bound = numpy.float32(value)
+    if numpy.float64(bound) <= value:
+        bound = numpy.nextafter(bound, numpy.float32(numpy.inf))
+    return bound
+
+def float32_below(value):
+    """Largest float32 strictly smaller than the float64 value."""
+    bound = numpy.float32(value)
+    if numpy.float64(bound) >= value:
+        bound = numpy.nextafter(bound, numpy.float32(-numpy.inf))
+    return bound
+
+def index_file_name(database_file_name):
+    """Name of the index file stored next to a lattice constant database. The
+    whole file name is kept, so db.npz and db.cdb have indexes of their own."""
+    return database_file_name + ".index.npz"
+
+def load_lattice_index(database_file_name, lattice_consts):
+    """Loads the sorted lattice constant index of a database, building and
+    saving it next to the database when it is missing or out of date.
+
+    Args:
+        database_file_name: path of the lattice constant database
+        lattice_consts: the array stored in the database or a CompactDatabase
+    Returns:
+        A LatticeIndex for lattice_consts.
+    """
+    index_name = index_file_name(database_file_name)
+    stat = os.stat(database_file_name)
+    if os.path.exists(index_name):
+        # memory mapped, only the searched parts of the index are read
+        stored = memmap_npz(index_name)
+        if (int(stored["source_size"]) == stat.st_size and int(stored["source_mtime"]) == stat.st_mtime_ns
+                and len(stored["order"]) == len(lattice_consts)):
+            return LatticeIndex(stored["order"], stored["keys"])
+    index = LatticeIndex.build(lattice_consts)
+    try:
+        with open(index_name, "wb") as index_file:
+            save_aligned_npz(index_file, order=index.order, keys=index.keys,
+                             source_size=stat.st_size, source_mtime=stat.st_mtime_ns)
+    except IOError:
+        pass # a read-only database directory only costs the rebuild next time
+    return index
+
+def lattice_window(lattice_consts, lower, upper, index=None):
+    """Row numbers of the database with a lattice constant between two bounds.
+
+    Args:
+        lattice_consts: array of composition and lattice constants
+        lower: exclusive lower bound of the lattice constant
+        upper: exclusive upper bound of the lattice constant
+        index: optional LatticeIndex of lattice_consts. Without it the whole
+               lattice constant column is scanned.
+    Returns:
+        A sorted array of row numbers.
+    """
+    if index is not None:
+        return index.window(lower, upper)
+    return numpy.flatnonzero((lattice_consts[:,-1] > lower) & (lattice_consts[:,-1] < upper))
+
+def composition_fields(lattice_consts):
+    """Field names of the composition columns of a database, see
+    composition_database.NamedDatabase."""
+    return getattr(lattice_consts, "fields", III_V_FIELDS)
+
+def lattice_blocks(lattice_consts, lower, upper, index=None):
+    """Rows of the database with a lattice constant between two bounds.
+
+    Args:
+        lattice_consts: array of composition and lattice constants or an
+                        IsoLatticeSolver
+        lower: exclusive lower bound of the lattice constant
+        upper: exclusive upper bound of the lattice constant
+        index: optional LatticeIndex of lattice_consts
+    Returns:
+        An iterable of arrays of rows x_Al, x_Ga, x_In, y_P, y_As, y_Sb, a in
+        database order.
+    """
+    if isinstance(lattice_consts, IsoLatticeSolver):
+        return lattice_consts.window(lower, upper)
+    return [lattice_consts[lattice_window(lattice_consts, lower, upper, index)]]
+
+def resolution_steps(fraction_resolution):
+    """Number of composition steps between 0 and 100 percent.
+
+    Args:
+        fraction_resolution: composition step in percent
+    Returns:
+        The integer 100/fraction_resolution.
+    Raises:
+        ValueError: if fraction_resolution does not divide 100 percent
+    """
+    steps = 100.0/fraction_resolution if fraction_resolution > 0 else 0
+    if not 1 <= steps < float("inf") or abs(steps - round(steps)) > 1e-9*steps:
+        raise ValueError("resolution {} does not divide 100 percent".format(fraction_resolution))
+    return int(round(steps))
+
+class IsoLatticeSolver(object):
+    """Solves Vegard's law of iii_v_generator.py for the compositions inside a
+    lattice constant window instead of reading them from a database.
+
+    For fixed anion fractions the lattice constant is linear in x_Al and x_Ga,
+    so for every grid value of y_P, y_As and x_Al the x_Ga steps inside the
+    window form one interval that is found analytically. Only the rows of
+    those intervals are evaluated, which keeps the work close to the number of
+    matches at any resolution. At integer resolutions the rows are identical
+    to the ones stored by iii_v_generator.py.
+
+    Attributes:
+        steps: number of composition steps between 0 and 100 percent
+        decimals: decimals needed to print the composition fractions
+    """
+
+    #number of candidate rows evaluated at once
+    chunk_rows = 2**20
+
+    def __init__(self, fraction_resolution):
+        self.steps = resolution_steps(fraction_resolution)
+        # fewest decimals that print every multiple of 1/steps exactly, if any do
+        self.decimals = 2
+        while 10**self.decimals % self.steps and self.decimals < 8:
+            self.decimals += 1
+        if 10**self.decimals % self.steps:
+            self.decimals = max(2, len(str(self.steps)) + 1)
+        percentages = numpy.arange(self.steps + 1)*100.0/self.steps
+        first, second = simplex_steps(self.steps)
+        self.anions = numpy.stack([percentages[first], percentages[second],
+                                   100 - percentages[first] - percentages[second]], axis=1)
+        self.percentages = percentages
+        # Al, Ga, In contributions per percent of cation for every anion composition
+        self.per_cation = numpy.dot(self.anions, REFERENCE_LATTICE_CONSTANTS.T)/10000.0
+
+    def window(self, lower, upper):
+        """Compositions with lower < a < upper.
+
+        Args:
+            lower: exclusive lower bound of the lattice constant
+            upper: exclusive upper bound of the lattice constant
+        Yields:
+            float32 arrays of rows x_Al, x_Ga, x_In, y_P, y_As, y_Sb, a in the
+            order of the iii_v_generator.py database.
+        """
+        n = self.steps
+        step = 100.0/n
+        # a is linear over the cation triangle, so the pure binaries bound it
+        low_end = self.per_cation.min(axis=1)*100
+        high_end = self.per_cation.max(axis=1)*100
+        margin = 1e-9*upper
+        anions = numpy.flatnonzero((high_end > lower - margin) & (low_end < upper + margin))
+        if len(anions) == 0:
+            return
+        al_steps = numpy.arange(n + 1)
+        anions_per_chunk = max(1, self.chunk_rows // (n + 1))
+        for start in range(0, len(anions), anions_per_chunk):
+            anion = numpy.repeat(anions[start:start + anions_per_chunk], n + 1)
+            k_al = numpy.tile(al_steps, len(anion) // (n + 1))
+            x_al = self.percentages[k_al]
+            w = self.per_cation[anion]
+            # a = c0 + c1*x_Ga with x_In = 100 - x_Al - x_Ga
+            c0 = x_al*w[:, 0] + (100 - x_al)*w[:, 2]
+            c1 = w[:, 1] - w[:, 2]
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                bound_a = (lower - c0)/c1
+                bound_b = (upper - c0)/c1
+            flat = c1 == 0
+            x_low = numpy.where(flat, 0, numpy.minimum(bound_a, bound_b))
+            x_high = numpy.where(flat, 100, numpy.maximum(bound_a, bound_b))
+            # one step of slack on both sides, the exact test below decides
+            k_low = numpy.maximum(0, numpy.floor(x_low/step) - 1)
+            k_high = numpy.minimum(n - k_al, numpy.ceil(x_high/step) + 1)
+            k_low = numpy.where(numpy.isnan(k_low), 0, k_low).astype(numpy.int64)
+            k_high = numpy.where(numpy.isnan(k_high), -1, k_high).astype(numpy.int64)
+            counts = numpy.maximum(0, k_high - k_low + 1)
+            for segment in self._segments(counts):
+                rows = self._rows(anion[segment], k_al[segment], k_low[segment], counts[segment], lower, upper)
+                if len(rows):
+                    yield rows
+
+    def _segments(self, counts):
+        """Splits consecutive candidate intervals into slices of about
+        chunk_rows candidate rows."""
+        totals = numpy.cumsum(counts)
+        start = 0
+        while start < len(counts):
+            offset = totals[start - 1] if start else 0
+            stop = max(start + 1, int(numpy.searchsorted(totals, offset + self.chunk_rows, side="right")))
+            yield slice(start, stop)
+            start = stop
+
+    def _rows(self, anion, k_al, k_low, counts, lower, upper):
+        """Evaluates the candidate x_Ga intervals and keeps the rows inside the
+        window."""
+        total = counts.sum()
+        if total == 0:
+            return numpy.zeros((0, 7), dtype=numpy.float32)
+        starts = numpy.cumsum(counts) - counts
+        k_ga = numpy.repeat(k_low - starts, counts) + numpy.arange(total)
+        anion = numpy.repeat(anion, counts)
+        x_al = self.percentages[numpy.repeat(k_al, counts)]
+        x_ga = self.percentages[k_ga]
+        cations = numpy.stack([x_al, x_ga, 100 - x_al - x_ga], axis=1)
+        anions = self.anions[anion]
+        a = paired_lattice_constants(cations, anions).astype(numpy.float32)
+        keep = (a > numpy.float64(lower)) & (a < numpy.float64(upper))
+        rows = numpy.empty((numpy.count_nonzero(keep), 7), dtype=numpy.float32)
+        rows[:, 0:3] = cations[keep]/100.0
+        rows[:, 3:6] = anions[keep]/100.0
+        rows[:, 6] = a[keep]
+        return rows
+
+def check_substrate_file(sub_file, lattice_const_file, tolerance_percentage, output_file, index=None, stats=None, top_k=None):
     """Calls functions for calculations based on the information obtained from
        a supplied database file.
     
     Args:
         sub_file: database file with substrate material information
-        lattice_const_file: npz file containing lattice constants and composition
-                            information
+        lattice_const_file: array or CompactDatabase containing lattice
+                            constants and composition information, or an
+                            IsoLatticeSolver
         tolerance_percentage: tolerance percentage of mismatch error represented
                               as a decimal value
-        output_file: tab delimited .txt file where results are written
+        output_file: match_output writer where results are written
+        index: optional LatticeIndex of lattice_const_file
+        stats: optional match_stats.MatchStats receiving the time spent on
+               each substrate
+        top_k: only write the top_k best compositions of each substrate, see
+               top_k_sub()
         
     Returns:
         A tab delimited .txt file with the maximum and minimum values related
         to the lattice constants of the substrate material. 
     """
-    output_file.write("#Film Composition\tFilm Symmetry\tFlim a\tSubstrate\tSymmetry\n")
     for i, l in enumerate(sub_file):
-        if sub_file[i][1] == "C":
-            cubic_sub(sub_file[i][0], sub_file[i][1], sub_file[i][2], lattice_const_file, tolerance_percentage, output_file)
-        if sub_file[i][1] == "T":
-            tetragonal_sub(sub_file[i][0], sub_file[i][1], sub_file[i][2], sub_file[i][3], lattice_const_file, tolerance_percentage, output_file)
-        if sub_file[i][1] == "H":
-            hexagonal_sub(sub_file[i][0], sub_file[i][1], sub_file[i][2], sub_file[i][3], lattice_const_file, tolerance_percentage, output_file)
+        started = time.perf_counter() if stats is not None else None
+        if top_k is not None:
+            if sub_file[i][1] in SUBSTRATE_ORIENTATIONS:
+                top_k_sub(sub_file[i][0], sub_file[i][1], sub_file[i][2], lattice_const_file, tolerance_percentage, top_k, output_file, index)
+        else:
+            if sub_file[i][1] == "C":
+                cubic_sub(sub_file[i][0], sub_file[i][1], sub_file[i][2], lattice_const_file, tolerance_percentage, output_file, index)
+            if sub_file[i][1] == "T":
+                tetragonal_sub(sub_file[i][0], sub_file[i][1], sub_file[i][2], sub_file[i][3], lattice_const_file, tolerance_percentage, output_file, index)
+            if sub_file[i][1] == "H":
+                hexagonal_sub(sub_file[i][0], sub_file[i][1], sub_file[i][2], sub_file[i][3], lattice_const_file, tolerance_percentage, output_file, index)
+        if stats is not None:
+            stats.add("substrate_timings", (("substrate", str(sub_file[i][0])), ("substrate_symmetry", str(sub_file[i][1]))),
+                      seconds=time.perf_counter() - started)
+
+def check_substrate_rows(sub_file, lattice_const_file, tolerance_percentage, index=None, stats=None, top_k=None):
+    """check_substrate_file() that also tells the substrate of every match.
+
+    Args:
+        sub_file, lattice_const_file, tolerance_percentage, index, stats,
+        top_k: as for check_substrate_file()
+    Returns:
+        (records, rows): the match records, None if there are none, and the
+        row of sub_file of every record.
+    """
+    collector = RecordCollector()
+    rows = []
+    for i in range(len(sub_file)):
+        written = len(collector.batches)
+        check_substrate_file(sub_file[i:i + 1], lattice_const_file, tolerance_percentage, collector, index, stats, top_k)
+        rows.append(numpy.full(sum(len(batch) for batch in collector.batches[written:]), i, dtype=numpy.intp))
+    return collector.records(), numpy.concatenate(rows) if rows else numpy.zeros(0, dtype=numpy.intp)
+
+def substrate_shard(bounds):
+    """Worker of parallel_substrate_blocks(): the match records of the
+    substrates bounds[0]:bounds[1] (None if there are none), their substrate
+    rows (None unless requested) and the MatchStats.tables of the shard (None
+    without stats)."""
+    arrays, state = worker_arrays(), worker_state()
+    if "solver" in state:
+        lattice_consts = state["solver"]
+    elif "compact_file" in state:
+        lattice_consts = CompactDatabase(state["compact_file"])
+    elif "fields" in state:
+        lattice_consts = NamedDatabase(arrays["database"], state["fields"], state["decimals"])
+    else:
+        lattice_consts = arrays["database"]
+    index = LatticeIndex(arrays["index_order"], arrays["index_keys"]) if "index_order" in arrays else None
+    stats = MatchStats() if state["stats"] else None
+    substrates = arrays["substrates"][bounds[0]:bounds[1]]
+    if state["rows"]:
+        records, rows = check_substrate_rows(substrates, lattice_consts, state["tolerance"], index, stats, state["top_k"])
+        rows = rows + bounds[0]
+    else:
+        collector = RecordCollector()
+        check_substrate_file(substrates, lattice_consts, state["tolerance"], collector, index, stats, state["top_k"])
+        records, rows = collector.records(), None
+    return records, rows, stats.tables if stats is not None else None
+
+def parallel_substrate_blocks(sub_file, lattice_const_file, tolerance_percentage, index=None, jobs=2, stats=None, top_k=None, rows=False):
+    """Runs check_substrate_file() on shards of the substrates in a process pool.
 
+    The database and its index are shared with the workers as memory maps (a
+    compact database is opened by each worker, an IsoLatticeSolver is passed
+    once per worker).
 
-def cubic_sub(sub_comp, sub_sym, sub_a_val, lattice_consts, tol, result_file):
+    Args:
+        sub_file, lattice_const_file, tolerance_percentage, index, stats,
+        top_k: as for check_substrate_file()
+        jobs: number of worker processes
+        rows: also return the substrate row of every match, see
+              check_substrate_rows()
+    Yields:
+        (records, rows) of every shard in substrate order, rows is None
+        unless requested.
+    """
+    sub_file = numpy.atleast_1d(sub_file)
+    arrays = {"substrates": sub_file}
+    state = {"tolerance": tolerance_percentage, "stats": stats is not None, "top_k": top_k, "rows": rows}
+    if isinstance(lattice_const_file, IsoLatticeSolver):
+        state["solver"] = lattice_const_file
+    elif isinstance(lattice_const_file, CompactDatabase):
+        state["compact_file"] = lattice_const_file.file_name
+    elif isinstance(lattice_const_file, NamedDatabase):
+        arrays["database"] = lattice_const_file.rows
+        state["fields"], state["decimals"] = lattice_const_file.fields, lattice_const_file.decimals
+    else:
+        arrays["database"] = lattice_const_file
+    if index is not None:
+        arrays["index_order"] = index.order
+        arrays["index_keys"] = index.keys
+    for records, shard_rows, tables in map_shards(substrate_shard, shard_bounds(len(sub_file), jobs), jobs, arrays, state):
+        if tables:
+            stats.merge(tables)
+        yield records, shard_rows
+
+def parallel_check_substrate_file(sub_file, lattice_const_file, tolerance_percentage, output_file, index=None, jobs=1, stats=None, top_k=None):
+    """check_substrate_file() on shards of the substrates in a process pool,
+    see parallel_substrate_blocks(). The shard results are written in
+    substrate order, so the output is the same as with one process.
+
+    Args:
+        sub_file, lattice_const_file, tolerance_percentage, output_file,
+        index, stats, top_k: as for check_substrate_file()
+        jobs: number of worker processes, 1 runs check_substrate_file()
+    """
+    if jobs <= 1:
+        check_substrate_file(sub_file, lattice_const_file, tolerance_percentage, output_file, index, stats, top_k)
+        return
+    for records, rows in parallel_substrate_blocks(sub_file, lattice_const_file, tolerance_percentage, index, jobs, stats, top_k):
+        output_file.write(records)
+
+def substrate_hashes(sub_file):
+    """result_store.row_hashes() of the rows of a substrate file."""
+    names = sub_file.dtype.names
+    c = sub_file[names[3]].astype(numpy.float64) if len(names) > 3 else numpy.zeros(len(sub_file))
+    return row_hashes(sub_file[names[0]].astype(str), sub_file[names[1]].astype(str), sub_file[names[2]].astype(numpy.float64), c)
+
+def incremental_check_substrate_file(sub_file, lattice_const_file, tolerance_percentage, output_file, store_file_name, source,
+                                     index=None, jobs=1, stats=None, top_k=None, batch_rows=2**20):
+    """check_substrate_file() that only computes the substrates that are not in
+    a result store (see result_store.py) yet. Stored matches of substrates
+    that are gone are dropped and the store is saved again.
+
+    Args:
+        sub_file, lattice_const_file, tolerance_percentage, output_file,
+        index, stats, top_k: as for check_substrate_file()
+        store_file_name: name of the .npz result store
+        source: string identifying the composition database, a store made
+                with another one is not used
+        jobs: number of worker processes
+        batch_rows: number of matches passed to output_file at once
+    """
+    sub_file = numpy.atleast_1d(sub_file)
+    hashes = substrate_hashes(sub_file)
+    digests, first, numbers = unique_rows(hashes)
+    settings = {"tolerance": tolerance_percentage, "source": source, "top_k": top_k}
+    store = load_store(store_file_name, settings)
+    if store is None:
+        fields = composition_fields(lattice_const_file)
+        store = {"records": composition_match_records(numpy.zeros((0, len(fields) + 1), dtype=numpy.float32), "", "", "", fields),
+                 "substrate_hash": numpy.zeros(0, dtype="S20"), "rank": numpy.zeros(0, dtype=numpy.intp),
+                 "substrate_digests": numpy.zeros(0, dtype="S20")}
+    keep = numpy.isin(store["substrate_hash"], digests)
+    parts = [(store["records"][keep], store["substrate_hash"][keep], store["rank"][keep])]
+    new = first[~numpy.isin(digests, store["substrate_digests"])]
+    if jobs <= 1:
+        blocks = [check_substrate_rows(sub_file[new], lattice_const_file, tolerance_percentage, index, stats, top_k)]
+    else:
+        blocks = parallel_substrate_blocks(sub_file[new], lattice_const_file, tolerance_percentage, index, jobs, stats, top_k, rows=True)
+    for records, rows in blocks:
+        if records is not None:
+            # the matches of a substrate are consecutive
+            parts.append((records, hashes[new[rows]], within_group_rank(rows)))
+    records = concatenate_records([part[0] for part in parts])
+    sub_hash, rank = [numpy.concatenate([part[k] for part in parts]) for k in (1, 2)]
+    save_store(store_file_name, settings, {"records": records, "substrate_hash": sub_hash, "rank": rank, "substrate_digests": digests})
+    # one copy of every match for each substrate row with its content, in output order
+    matches, sub_rows = expand_to_rows(digest_numbers(digests, sub_hash), numbers)
+    matches = matches[numpy.lexsort((rank[matches], sub_rows))]
+    for start in range(0, len(matches), batch_rows):
+        output_file.write(records[matches[start:start + batch_rows]])
+
+def cubic_sub(sub_comp, sub_sym, sub_a_val, lattice_consts, tol, result_file, index=None):
     """Calculates max/min lattice constant values for a cubic substrate.
     
     Args:
         sub_comp: substrate composition
         sub_sym: substrate symmetry
         sub_a_val: value of lattice constant 'a'
-        lattice_consts: npz file of composition and lattice constants. Lattice 
-                        constants must be the right-most entry in each line of 
-                        the array
+        lattice_consts: array or CompactDatabase of composition and lattice
+                        constants. Lattice constants must be the right-most
+                        entry in each line of the array. An IsoLatticeSolver
+                        may be used instead.
         tol: tolerance percentage of mismatch error represented as a decimal
-        result_file: a tab delimited .txt file with the calculated maximum and
-                      minimum lattice constant values for a specified tolerance
-                      value.
+        result_file: match_output writer receiving the matching compositions
+                     as record arrays.
+        index: optional LatticeIndex of lattice_consts
         
     Returns:
-        Writes a new line to the result_file which contains the results of the
-        lattice constant comparision.    
+        Writes the matching compositions of each orientation to the
+        result_file.
     """    
-    good_lattice_vals = (lattice_consts[:,-1] > (1. - tol)*sub_a_val) & (lattice_consts[:,-1] < (1. + tol)*sub_a_val)
-    for i, line in enumerate(good_lattice_vals):
-        if line:
-            film_comp = cust_print(lattice_consts[i][0], lattice_consts[i][1], lattice_consts[i][2], 
-                                   lattice_consts[i][3], lattice_consts[i][4], lattice_consts[i][5])
-            result_file.write("{}\t{}\t{}\t{}\t{}\n".format(film_comp, "C", round(lattice_consts[i][6], 4), sub_comp, sub_sym))
-    good_lattice_vals45 = (lattice_consts[:,-1] > (1. - tol)*sub_a_val*numpy.sqrt(2.0)) & (lattice_consts[:,-1] < (1. + tol)*sub_a_val*numpy.sqrt(2.0))
-    for i, line in enumerate(good_lattice_vals45):
-        if line:
-            film_comp = cust_print(lattice_consts[i][0], lattice_consts[i][1], lattice_consts[i][2], 
-                                   lattice_consts[i][3], lattice_consts[i][4], lattice_consts[i][5])
-            result_file.write("{}\t{}\t{}\t{}\t{}\n".format(film_comp, "C (45deg)", round(lattice_consts[i][6], 4), sub_comp, sub_sym))
+    for good_lattice_vals in lattice_blocks(lattice_consts, (1. - tol)*sub_a_val, (1. + tol)*sub_a_val, index):
+        result_file.write(composition_match_records(good_lattice_vals, "C", sub_comp, sub_sym, composition_fields(lattice_consts)))
+    for good_lattice_vals45 in lattice_blocks(lattice_consts, (1. - tol)*sub_a_val*numpy.sqrt(2.0), (1. + tol)*sub_a_val*numpy.sqrt(2.0), index):
+        result_file.write(composition_match_records(good_lattice_vals45, "C (45deg)", sub_comp, sub_sym, composition_fields(lattice_consts)))
                            
-def tetragonal_sub(sub_comp, sub_sym, sub_a_val, sub_c_val, lattice_consts, tol, result_file):
+def tetragonal_sub(sub_comp, sub_sym, sub_a_val, sub_c_val, lattice_consts, tol, result_file, index=None):
     """Calculates max/min lattice constant values for a tetragonal substrate.
     
     Args:
@@ -86,32 +520,25 @@ def tetragonal_sub(sub_comp, sub_sym, sub_a_val, sub_c_val, lattice_consts, tol,
         sub_sym: substrate symmetry
         sub_a_val: value of lattice constant 'a'
         sub_c_val: value of lattice constant 'c'
-        lattice_consts: npz file of composition and lattice constants. Lattice 
-                        constants must be the right-most entry in each line of 
-                        the array
+        lattice_consts: array or CompactDatabase of composition and lattice
+                        constants. Lattice constants must be the right-most
+                        entry in each line of the array. An IsoLatticeSolver
+                        may be used instead.
         tol: tolerance percentage of mismatch error represented as a decimal
-        result_file: a tab delimited .txt file with the calculated maximum and
-                      minimum lattice constant values for a specified tolerance
-                      value.
+        result_file: match_output writer receiving the matching compositions
+                     as record arrays.
+        index: optional LatticeIndex of lattice_consts
     Returns:
-        Writes a new line to the result_file which contains the results of the
-        lattice constant comparision.    
-    """
-    good_lattice_vals = (lattice_consts[:,-1] > (1. - tol)*sub_a_val) & (lattice_consts[:,-1] < (1. + tol)*sub_a_val)
-    for i, line in enumerate(good_lattice_vals):
-        if line:
-            film_comp = cust_print(lattice_consts[i][0], lattice_consts[i][1], lattice_consts[i][2], 
-                                   lattice_consts[i][3], lattice_consts[i][4], lattice_consts[i][5])
-            result_file.write("{}\t{}\t{}\t{}\t{}\n".format(film_comp, "C", round(lattice_consts[i][6], 4), sub_comp, sub_sym))
-    good_lattice_vals45 = (lattice_consts[:,-1] > (1. - tol)*sub_a_val*numpy.sqrt(2.0)) & (lattice_consts[:,-1] < (1. + tol)*sub_a_val*numpy.sqrt(2.0))
-    for i, line in enumerate(good_lattice_vals45):
-        if line:
-            film_comp = cust_print(lattice_consts[i][0], lattice_consts[i][1], lattice_consts[i][2], 
-                                   lattice_consts[i][3], lattice_consts[i][4], lattice_consts[i][5])
-            result_file.write("{}\t{}\t{}\t{}\t{}\n".format(film_comp, "C (45deg)", round(lattice_consts[i][6], 4), sub_comp, sub_sym))
+        Writes the matching compositions of each orientation to the
+        result_file.
+    """
+    for good_lattice_vals in lattice_blocks(lattice_consts, (1. - tol)*sub_a_val, (1. + tol)*sub_a_val, index):
+        result_file.write(composition_match_records(good_lattice_vals, "C", sub_comp, sub_sym, composition_fields(lattice_consts)))
+    for good_lattice_vals45 in lattice_blocks(lattice_consts, (1. - tol)*sub_a_val*numpy.sqrt(2.0), (1. + tol)*sub_a_val*numpy.sqrt(2.0), index):
+        result_file.write(composition_match_records(good_lattice_vals45, "C (45deg)", sub_comp, sub_sym, composition_fields(lattice_consts)))
             
 
-def hexagonal_sub(sub_comp, sub_sym, sub_a_val, sub_c_val, lattice_consts, tol, result_file):
+def hexagonal_sub(sub_comp, sub_sym, sub_a_val, sub_c_val, lattice_consts, tol, result_file, index=None):
     """Calculates max/min lattice constant values for a hexagonal substrate.
     
     Args:
@@ -119,61 +546,513 @@ def hexagonal_sub(sub_comp, sub_sym, sub_a_val, sub_c_val, lattice_consts, tol,
         sub_sym: substrate symmetry
         sub_a_val: value of lattice constant 'a'
         sub_c_val: value of lattice constant 'c'
-        lattice_consts: npz file of composition and lattice constants. Lattice 
-                        constants must be the right-most entry in each line of 
-                        the array
+        lattice_consts: array or CompactDatabase of composition and lattice
+                        constants. Lattice constants must be the right-most
+                        entry in each line of the array. An IsoLatticeSolver
+                        may be used instead.
         tol: tolerance percentage of mismatch error represented as a decimal
-        result_file: a tab delimited .txt file with the calculated maximum and
-                      minimum lattice constant values for a specified tolerance
-                      value.
+        result_file: match_output writer receiving the matching compositions
+                     as record arrays.
+        index: optional LatticeIndex of lattice_consts
     Returns:
-        Writes a new line to the result_file which contains the results of the
-        lattice constant comparision.    
-    """
-    good_lattice_vals = (lattice_consts[:,-1] > (1. - tol)*sub_a_val*numpy.sqrt(2.0)) & (lattice_consts[:,-1] < (1. + tol)*sub_a_val*numpy.sqrt(2.0))
-    for i, line in enumerate(good_lattice_vals):
-        if line:
-            film_comp = cust_print(lattice_consts[i][0], lattice_consts[i][1], lattice_consts[i][2], 
-                                   lattice_consts[i][3], lattice_consts[i][4], lattice_consts[i][5])
-            result_file.write("{}\t{}\t{}\t{}\t{}\n".format(film_comp, "C (111)", round(lattice_consts[i][6], 4), sub_comp, sub_sym))
+        Writes the matching compositions of each orientation to the
+        result_file.
+    """
+    for good_lattice_vals in lattice_blocks(lattice_consts, (1. - tol)*sub_a_val*numpy.sqrt(2.0), (1. + tol)*sub_a_val*numpy.sqrt(2.0), index):
+        result_file.write(composition_match_records(good_lattice_vals, "C (111)", sub_comp, sub_sym, composition_fields(lattice_consts)))
     
-def cust_print(x_Al, x_Ga, x_In, y_P, y_As, y_Sb):
-    """Custom print function to simplify output of composition. Input arguments
-    agree with the following rules:
-            x_Al + x_Ga + x_In = 1
-            y_P  + y_As + y_Sb = 1
-            
+# film orientations of each substrate symmetry as written by cubic_sub(),
+# tetragonal_sub() and hexagonal_sub(): (film symmetry label, factor of the
+# substrate a giving the matched lattice constant)
+SUBSTRATE_ORIENTATIONS = {"C": [("C", 1.0), ("C (45deg)", numpy.sqrt(2.0))],
+                          "T": [("C", 1.0), ("C (45deg)", numpy.sqrt(2.0))],
+                          "H": [("C (111)", numpy.sqrt(2.0))]}
+
+#first tolerance tried by top_k_sub(), as a fraction of the full tolerance
+TOP_K_START = 2.0**-10
+
+def smallest_k(values, k):
+    """Positions of the k smallest values, ordered by value and then
+    position. numpy.partition finds the k-th value, so only the values up to
+    it are sorted."""
+    if len(values) > k:
+        candidates = numpy.flatnonzero(values <= numpy.partition(values, k - 1)[k - 1])
+    else:
+        candidates = numpy.arange(len(values))
+    return candidates[numpy.lexsort((candidates, values[candidates]))[:k]]
+
+def top_k_sub(sub_comp, sub_sym, sub_a_val, lattice_consts, tol, k, result_file, index=None):
+    """Writes the k compositions of all orientations of a substrate with the
+    smallest |a/a_sub - 1|, where a_sub is the substrate lattice constant of
+    the orientation. Ties are written in the order of the full output.
+
+    The windows start at TOP_K_START*tol around every orientation and double
+    until they hold k compositions or reach tol, so with a LatticeIndex or an
+    IsoLatticeSolver only compositions close to the best k are read.
+
     Args:
-        x_Al: amount of Al in material 
-        x_Ga: amount of Ga in material
-        x_In: amount of In in material
-        y_P:  amount of P in material
-        y_As: amount of As in material
-        y_Sb: amount of Sb in material
-        
+        sub_comp, sub_sym, sub_a_val, lattice_consts, tol, result_file,
+        index: as for cubic_sub()
+        k: number of compositions written
+    """
+    orientations = SUBSTRATE_ORIENTATIONS[sub_sym]
+    window = tol*TOP_K_START if index is not None or isinstance(lattice_consts, IsoLatticeSolver) else tol
+    while True:
+        window = min(window, tol)
+        rows, labels, mismatch = [], [], []
+        for label, factor in orientations:
+            for good_lattice_vals in lattice_blocks(lattice_consts, (1. - window)*sub_a_val*factor, (1. + window)*sub_a_val*factor, index):
+                rows.append(good_lattice_vals)
+                labels.append(numpy.full(len(good_lattice_vals), label))
+                mismatch.append(abs(good_lattice_vals[:, -1].astype(numpy.float64)/(sub_a_val*factor) - 1))
+        # the k best are final once k compositions lie clearly inside the window
+        if window >= tol or sum(numpy.count_nonzero(block < window*(1 - 1e-6)) for block in mismatch) >= k:
+            break
+        window *= 2
+    if not rows:
+        return
+    best = smallest_k(numpy.concatenate(mismatch), k)
+    result_file.write(composition_match_records(numpy.concatenate(rows)[best], numpy.concatenate(labels)[best], sub_comp, sub_sym,
+                                                composition_fields(lattice_consts)))
+
+#pairs passed to the output writer at once by pair_sub()
+PAIR_BATCH_ROWS = 2**16
+
+#relative widening of the compressive windows searched by PairWindows, covering
+#the rounding of the rearranged bounds, every pair is checked exactly after
+PAIR_SLACK = 1e-9
+
+#halvings of the tolerance tried by pair_sub() with top_k, the averages of
+#float32 lattice constants tie long before the window is tol*2**-40
+PAIR_WINDOW_STEPS = 40
+
+def pair_weight(thickness_ratio):
+    """Weight of the tensile layer in the average lattice constant of a pair
+    whose tensile layer is thickness_ratio times as thick as its compressive
+    layer."""
+    return thickness_ratio/(1. + thickness_ratio)
+
+class PairWindows(object):
+    """Tensile and compressive layers of one substrate orientation in a
+    LatticeIndex and the pairs of them whose thickness weighted average
+    lattice constant matches the substrate.
+
+    The layers are two slices of the sorted index keys. As the tensile
+    lattice constant grows, the range of compressive lattice constants that
+    balance it shrinks, so the partners of all tensile layers are found with
+    two numpy.searchsorted calls and the pairs are enumerated without
+    comparing any pair that does not match.
+
+    Args:
+        index: LatticeIndex of the database
+        target: lattice constant matched by the orientation, a_sub*factor
+        weight: weight of the tensile layer, see pair_weight()
+        tensile_mismatch: the tensile layers have
+                          target*(1 - tensile_mismatch) < a < target
+        compressive_mismatch: the compressive layers have
+                              target < a < target*(1 + compressive_mismatch)
+    """
+
+    def __init__(self, index, target, weight, tensile_mismatch, compressive_mismatch):
+        self.index = index
+        self.target = target
+        self.weight = weight
+        keys = index.keys
+        start = int(numpy.searchsorted(keys, float32_above((1. - tensile_mismatch)*target), side="left"))
+        self.tensile = slice(start, max(start, int(numpy.searchsorted(keys, float32_below(target), side="right"))))
+        start = int(numpy.searchsorted(keys, float32_above(target), side="left"))
+        self.compressive = slice(start, max(start, int(numpy.searchsorted(keys, float32_below((1. + compressive_mismatch)*target), side="right"))))
+        self.tensile_keys = numpy.asarray(keys[self.tensile], dtype=numpy.float64)
+        self.compressive_keys = numpy.asarray(keys[self.compressive], dtype=numpy.float64)
+
+    def bounds(self, window, slack=PAIR_SLACK):
+        """Positions [lo, hi) in compressive_keys of the partners of every
+        tensile layer whose average lies within about window of the target,
+        widened by slack relative to the target."""
+        lower = ((1. - window - slack)*self.target - self.weight*self.tensile_keys)/(1. - self.weight)
+        upper = ((1. + window + slack)*self.target - self.weight*self.tensile_keys)/(1. - self.weight)
+        lo = numpy.searchsorted(self.compressive_keys, lower, side="left")
+        return lo, numpy.maximum(lo, numpy.searchsorted(self.compressive_keys, upper, side="right"))
+
+    def count(self, window):
+        """Number of pairs with |average/target - 1| < window, up to the
+        rounding of bounds()."""
+        lo, hi = self.bounds(window, 0.)
+        return int((hi - lo).sum())
+
+    def pairs(self, window, batch_rows=PAIR_BATCH_ROWS):
+        """Yields the pairs with |average/target - 1| < window in batches of
+        about batch_rows, ordered by the tensile and then the compressive
+        position in the index.
+
+        Yields:
+            (tensile, compressive, average): positions in tensile_keys and
+            compressive_keys and the float64 average lattice constant of
+            every pair of the batch
+        """
+        lo, hi = self.bounds(window)
+        counts = hi - lo
+        ends = numpy.cumsum(counts)
+        lower, upper = (1. - window)*self.target, (1. + window)*self.target
+        first = 0
+        while first < len(counts):
+            done = ends[first - 1] if first else 0
+            last = max(first + 1, int(numpy.searchsorted(ends, done + batch_rows, side="right")))
+            part = counts[first:last]
+            tensile = numpy.repeat(numpy.arange(first, last), part)
+            compressive = numpy.arange(len(tensile)) - numpy.repeat(numpy.cumsum(part) - part - lo[first:last], part)
+            average = self.weight*self.tensile_keys[tensile] + (1. - self.weight)*self.compressive_keys[compressive]
+            keep = (average > lower) & (average < upper)
+            if not keep.all():
+                tensile, compressive, average = tensile[keep], compressive[keep], average[keep]
+            if len(average):
+                yield tensile, compressive, average
+            first = last
+
+    def rows(self, lattice_consts, positions, layer):
+        """Database rows of the tensile ("tensile") or compressive
+        ("compressive") layers at positions. The many pairs of a batch share
+        their layers, so a range of the index holding all of them is read
+        once unless the positions are sparse in it."""
+        start = getattr(self, layer).start
+        if len(positions) == 0:
+            return lattice_consts[numpy.zeros(0, dtype=numpy.intp)]
+        low, high = int(positions.min()), int(positions.max()) + 1
+        if high - low > 2*len(positions):
+            return lattice_consts[numpy.asarray(self.index.order[start + positions], dtype=numpy.intp)]
+        block = lattice_consts[numpy.asarray(self.index.order[start + low:start + high], dtype=numpy.intp)]
+        return block[positions - low]
+
+def pair_records(pairs, lattice_consts, tensile, compressive, average, label, sub_comp, sub_sym):
+    """Match records of pairs of a PairWindows, see
+    match_output.pair_match_records()."""
+    return pair_match_records(pairs.rows(lattice_consts, tensile, "tensile"), pairs.rows(lattice_consts, compressive, "compressive"),
+                              label, sub_comp, sub_sym, average, average/pairs.target - 1, composition_fields(lattice_consts))
+
+def pair_sub(sub_comp, sub_sym, sub_a_val, lattice_consts, index, tol, weight, tensile_mismatch, compressive_mismatch, result_file, top_k=None):
+    """Writes the strain balanced pairs of a tensile and a compressive
+    composition whose thickness weighted average lattice constant a matches
+    a substrate with |a/a_sub - 1| < tol, for every orientation of the
+    substrate, a_sub the substrate lattice constant of the orientation.
+
+    With top_k only the top_k pairs of all orientations with the smallest
+    |a/a_sub - 1| are written, ties in the order of the full output. The
+    window is the smallest tol*2**-n that holds top_k pairs, bisected over n,
+    so that only about top_k pairs (and their ties) are enumerated. The
+    pairs of a window are counted from the bounds of PairWindows without
+    enumerating them.
+
+    Args:
+        sub_comp, sub_sym, sub_a_val, lattice_consts, tol, result_file: as
+        for cubic_sub()
+        index: LatticeIndex of lattice_consts
+        weight: weight of the tensile layer, see pair_weight()
+        tensile_mismatch, compressive_mismatch: largest mismatch of each
+                                                layer, see PairWindows
+        top_k: optional number of pairs written
+    """
+    orientations = [(label, PairWindows(index, sub_a_val*factor, weight, tensile_mismatch, compressive_mismatch))
+                    for label, factor in SUBSTRATE_ORIENTATIONS[sub_sym]]
+    if top_k is None:
+        for label, pairs in orientations:
+            for tensile, compressive, average in pairs.pairs(tol):
+                result_file.write(pair_records(pairs, lattice_consts, tensile, compressive, average, label, sub_comp, sub_sym))
+        return
+    def count(window):
+        # pairs clearly inside the window
+        return sum(pairs.count(window*(1 - 1e-6)) for label, pairs in orientations)
+    # the smallest window tol*2**-steps holding top_k pairs, bisected over steps
+    low, high = 0, PAIR_WINDOW_STEPS
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count(tol*2.0**-middle) >= top_k:
+            low = middle
+        else:
+            high = middle - 1
+    window = tol*2.0**-low
+    # the best pairs so far as (mismatch, orientation, tensile, compressive, average), ordered by
+    # mismatch and then output order, merged with every batch so memory stays bounded
+    best = None
+    for k, (label, pairs) in enumerate(orientations):
+        for tensile, compressive, average in pairs.pairs(window):
+            batch = (abs(average/pairs.target - 1), numpy.full(len(average), k), tensile, compressive, average)
+            if best is not None:
+                if len(best[0]) == top_k:
+                    # later batches come later in the output, so they lose ties
+                    keep = batch[0] < best[0][-1]
+                    batch = tuple(column[keep] for column in batch)
+                batch = tuple(numpy.concatenate(columns) for columns in zip(best, batch))
+            chosen = smallest_k(batch[0], top_k)
+            best = tuple(column[chosen] for column in batch)
+    if best is None:
+        return
+    mismatch, orientation, tensile, compressive, average = best
+    ranks, records = [], []
+    for k in numpy.unique(orientation).tolist():
+        label, pairs = orientations[k]
+        chosen = numpy.flatnonzero(orientation == k)
+        ranks.append(chosen)
+        records.append(pair_records(pairs, lattice_consts, tensile[chosen], compressive[chosen], average[chosen], label, sub_comp, sub_sym))
+    # the best pair first
+    result_file.write(concatenate_records(records)[numpy.argsort(numpy.concatenate(ranks), kind="stable")])
+
+def pair_check_substrate_file(sub_file, lattice_const_file, index, tolerance_percentage, output_file, weight, tensile_mismatch, compressive_mismatch,
+                              stats=None, top_k=None):
+    """pair_sub() for every substrate, see check_substrate_file().
+
+    Args:
+        sub_file, lattice_const_file, tolerance_percentage, output_file,
+        stats: as for check_substrate_file()
+        index: LatticeIndex of lattice_const_file
+        weight, tensile_mismatch, compressive_mismatch, top_k: as for
+                                                             pair_sub()
+    """
+    for i in range(len(sub_file)):
+        started = time.perf_counter() if stats is not None else None
+        if sub_file[i][1] in SUBSTRATE_ORIENTATIONS:
+            pair_sub(sub_file[i][0], sub_file[i][1], sub_file[i][2], lattice_const_file, index, tolerance_percentage, weight,
+                     tensile_mismatch, compressive_mismatch, output_file, top_k)
+        if stats is not None:
+            stats.add("substrate_timings", (("substrate", str(sub_file[i][0])), ("substrate_symmetry", str(sub_file[i][1]))),
+                      seconds=time.perf_counter() - started)
+
+#matches passed to the output writer at once by stream_check_substrate_file()
+STREAM_BATCH_ROWS = 2**16
+
+def substrate_windows(sub_file, tol):
+    """Lattice constant windows of all substrates and orientations.
+
+    Args:
+        sub_file: database file with substrate material information
+        tol: tolerance percentage of mismatch error represented as a decimal
     Returns:
-        composition: a string representing the composition formula 
-    """
-    composition = ""
-    composition += "Al"+'{0:.{1}f}'.format(x_Al, 2)
-    composition += "Ga"+'{0:.{1}f}'.format(x_Ga, 2)
-    composition += "In"+'{0:.{1}f}'.format(x_In, 2)
-    composition += "P"+'{0:.{1}f}'.format(y_P, 2)
-    composition += "As"+'{0:.{1}f}'.format(y_As, 2)
-    composition += "Sb"+'{0:.{1}f}'.format(y_Sb, 2)
-    return composition
-    
+        A list of (substrate row, film symmetry label, lower, upper) in the
+        order check_substrate_file() writes them, with the bounds computed as
+        cubic_sub(), tetragonal_sub() and hexagonal_sub() compute them.
+    """
+    windows = []
+    for i in range(len(sub_file)):
+        for label, factor in SUBSTRATE_ORIENTATIONS.get(sub_file[i][1], []):
+            # multiplying by a factor of 1.0 is exact
+            windows.append((i, label, (1. - tol)*sub_file[i][2]*factor, (1. + tol)*sub_file[i][2]*factor))
+    return windows
 
-if __name__ == "__main__":
+def summary_targets(sub_file):
+    """Lattice constants matched by every substrate and orientation, for
+    match_summary.CompositionSummary.
+
+    Args:
+        sub_file: database file with substrate material information
+    Returns:
+        A dict of (substrate, substrate symmetry, film symmetry) to
+        a_substrate*factor in the order of check_substrate_file(). Rows
+        repeating a substrate and symmetry keep the first lattice constant.
+    """
+    targets = {}
+    for i in range(len(sub_file)):
+        for label, factor in SUBSTRATE_ORIENTATIONS.get(sub_file[i][1], []):
+            targets.setdefault((str(sub_file[i][0]), str(sub_file[i][1]), label), sub_file[i][2]*factor)
+    return targets
+
+class WindowSpool(object):
+    """Matches of the blocks of stream_check_substrate_file() kept in a
+    temporary file and read back window by window, so they are written in
+    the order of check_substrate_file() instead of block by block.
+
+    Args:
+        windows: number of substrate windows
+    """
+
+    def __init__(self, windows):
+        self.windows = windows
+        self.spool_file = tempfile.TemporaryFile()
+        self.counts = []
+        self.rows = 0
+        self.dtype = None
+        self.columns = 0
+
+    def add(self, block, matches, window_of_match):
+        """Stores the rows block[matches] of a block, ordered by window."""
+        self.dtype, self.columns = block.dtype, block.shape[1]
+        for batch in range(0, len(matches), STREAM_BATCH_ROWS):
+            self.spool_file.write(numpy.ascontiguousarray(block[matches[batch:batch + STREAM_BATCH_ROWS]]).tobytes())
+        self.counts.append(numpy.bincount(window_of_match, minlength=self.windows))
+        self.rows += len(matches)
+
+    def batches(self):
+        """Yields (rows, window of every row) of at most STREAM_BATCH_ROWS
+        rows, by window and within a window in database order."""
+        if self.rows == 0:
+            return
+        self.spool_file.flush()
+        stored = numpy.memmap(self.spool_file, dtype=self.dtype, mode="r", shape=(self.rows, self.columns))
+        counts = numpy.array(self.counts)
+        # segments of one window in one block, blocks follow each other in the spool
+        spool_starts = (numpy.cumsum(counts.ravel()) - counts.ravel()).reshape(counts.shape).T.ravel()
+        segment_counts = counts.T.ravel()
+        segment_windows = numpy.repeat(numpy.arange(self.windows), len(counts))
+        segment_ends = numpy.cumsum(segment_counts)
+        for batch in range(0, self.rows, STREAM_BATCH_ROWS):
+            positions = numpy.arange(batch, min(batch + STREAM_BATCH_ROWS, self.rows))
+            segments = numpy.searchsorted(segment_ends, positions, side="right")
+            offsets = positions - (segment_ends - segment_counts)[segments]
+            yield numpy.asarray(stored[spool_starts[segments] + offsets]), segment_windows[segments]
+        del stored
+
+    def close(self):
+        self.spool_file.close()
+
+def stream_check_substrate_file(sub_file, database_file_name, tolerance_percentage, output_file, chunk_rows=CHUNK_ROWS, stats=None):
+    """check_substrate_file() reading the database only once.
+
+    The database is read in blocks of chunk_rows rows (see
+    composition_database.database_chunks()). The lattice constants of a block
+    are sorted once and the windows of all substrates and orientations are
+    looked up with numpy.searchsorted, so the memory used does not depend on
+    the size of the database. The output is the same as that of
+    check_substrate_file(): the matches of a single block are written
+    directly, those of several blocks are kept in a WindowSpool and written
+    window by window once all blocks are read.
+
+    Args:
+        sub_file, tolerance_percentage, output_file: as for
+        check_substrate_file()
+        database_file_name: .npz or compact composition database
+        chunk_rows: database rows per block
+        stats: optional match_stats.MatchStats receiving the rows and time
+               of the scan
+    """
+    sub_file = numpy.atleast_1d(sub_file)
+    windows = substrate_windows(sub_file, tolerance_percentage)
+    lower = numpy.array([window[2] for window in windows], dtype=numpy.float64)
+    upper = numpy.array([window[3] for window in windows], dtype=numpy.float64)
+    names = sub_file.dtype.names
+    labels = numpy.array([window[1] for window in windows])
+    subs = numpy.array([window[0] for window in windows], dtype=numpy.intp)
+    fields = database_fields(database_file_name)[0]
+
+    def write(rows, window_of_match):
+        output_file.write(composition_match_records(rows, labels[window_of_match], sub_file[subs[window_of_match]][names[0]],
+                                                    sub_file[subs[window_of_match]][names[1]], fields))
+
+    # the matches of the first block wait until it is known whether more follow
+    pending = spool = None
+    try:
+        for start, block in database_chunks(database_file_name, chunk_rows):
+            started = time.perf_counter() if stats is not None else None
+            # the same float64 comparisons as lattice_window() without an index
+            order = numpy.argsort(block[:, -1], kind="stable")
+            keys = block[order, -1].astype(numpy.float64)
+            first = numpy.searchsorted(keys, lower, side="right")
+            last = numpy.searchsorted(keys, upper, side="left")
+            found = numpy.flatnonzero(last > first)
+            # database order within each window
+            matches = numpy.concatenate([numpy.sort(order[first[k]:last[k]]) for k in found]) if len(found) else numpy.zeros(0, dtype=numpy.intp)
+            window_of_match = numpy.repeat(found, (last - first)[found])
+            if pending is not None:
+                if spool is None:
+                    spool = WindowSpool(len(windows))
+                spool.add(*pending)
+            pending = (block, matches, window_of_match)
+            if stats is not None:
+                stats.add("stream", (), blocks=1, rows=len(block), seconds=time.perf_counter() - started)
+        if spool is None and pending is not None:
+            block, matches, window_of_match = pending
+            for batch in range(0, len(matches), STREAM_BATCH_ROWS):
+                write(block[matches[batch:batch + STREAM_BATCH_ROWS]], window_of_match[batch:batch + STREAM_BATCH_ROWS])
+        elif spool is not None:
+            spool.add(*pending)
+            pending = None
+            for rows, window_of_match in spool.batches():
+                write(rows, window_of_match)
+    finally:
+        if spool is not None:
+            spool.close()
+
+def main(argv=None):
+    """Command line interface, see parser."""
+    args = parser.parse_args(argv)
+    if (args.lattice_constant_database is None) == (args.resolution is None):
+        parser.error("give either a lattice_constant_database or --resolution")
+    if args.resolution is not None:
+        try:
+            resolution_steps(args.resolution)
+        except ValueError as error:
+            parser.error("--{}".format(error))
+    if args.stream and (args.lattice_constant_database is None or args.top_k is not None or args.incremental or args.jobs > 1):
+        parser.error("--stream reads a lattice_constant_database with one process and without --top-k or --incremental")
+    if args.chunk_rows < 1:
+        parser.error("--chunk-rows must be at least 1")
+    if args.summary is not None and (args.summary < 1 or args.representatives < 0 or args.output_format != "tsv"):
+        parser.error("--summary needs at least 1 bin, --representatives at least 0 and writes JSON instead of --output-format")
+    if args.pairs is not None:
+        if args.lattice_constant_database is None or args.no_index or args.stream or args.incremental or args.summary is not None or args.jobs > 1:
+            parser.error("--pairs searches the lattice constant index of a lattice_constant_database with one process, without --no-index, --stream, --incremental or --summary")
+        if args.pairs <= 0 or not 0 < args.tensile_mismatch < 1 or args.compressive_mismatch <= 0:
+            parser.error("--pairs needs a positive thickness ratio and positive layer mismatches, --tensile-mismatch below 1")
+    if args.compress != "none" and (args.output_format != "tsv" or args.summary is not None):
+        parser.error("--compress compresses tsv output, npy, npz and --summary are not text matches")
+    if args.write_queue < 0:
+        parser.error("--write-queue must not be negative")
+    if args.top_k is not None and args.top_k < 1:
+        parser.error("--top-k must be at least 1")
     # create a label for the matches file.
-    results_file_label = "composition_matches_for_" + args.substrate[:-4] + ".txt"
-    results_file = open(results_file_label, "w")
-    substrate_file = numpy.genfromtxt(args.substrate, comments='#', delimiter="\t", dtype=None)
-    # Tolerance is set narrow becuase there are a large number of outputs which causes the code to take a very long time to run
-    tolerance = 0.005  
-    npz_lattice_constant_database = numpy.load(args.lattice_constant_database)
-    lattice_constants = npz_lattice_constant_database['arr_0']
-    npz_lattice_constant_database.close()
+    results_file_label = output_file_name("composition_matches_for_" + args.substrate[:-4], args.output_format, args.compress)
+    substrate_file = load_catalog(args.substrate)
+    # The default tolerance is narrow because wide tolerances produce a very large number of outputs
+    tolerance = args.tolerance
+    if args.resolution is not None:
+        # no database, matching compositions are solved for directly
+        lattice_constants = IsoLatticeSolver(args.resolution)
+        index = None
+        decimals = lattice_constants.decimals
+    elif args.stream:
+        # read block by block by stream_check_substrate_file()
+        lattice_constants = index = None
+        decimals = database_fields(args.lattice_constant_database)[1]
+    else:
+        # .npz arrays are decompressed, compact databases are memory mapped
+        lattice_constants = load_database(args.lattice_constant_database)
+        # sorted lattice constant index, built once and stored next to the database
+        index = None if args.no_index else load_lattice_index(args.lattice_constant_database, lattice_constants)
+        decimals = getattr(lattice_constants, "decimals", 2)
+    if args.summary is not None:
+        # statistics instead of the matches
+        results_file = CompositionSummary("composition_summary_for_" + args.substrate[:-4] + ".json", summary_targets(numpy.atleast_1d(substrate_file)),
+                                          tolerance, args.summary, args.representatives, decimals)
+    elif args.pairs is not None:
+        results_file = open_match_writer(output_file_name("composition_pairs_for_" + args.substrate[:-4], args.output_format, args.compress),
+                                         args.output_format, "pair", decimals, args.compress)
+    else:
+        results_file = open_match_writer(results_file_label, args.output_format, "composition", decimals, args.compress)
+    # counters are only collected with --stats
+    stats = MatchStats() if args.stats else None
+    if stats is not None:
+        results_file = StatsWriter(results_file, stats, "orientations", ("substrate", "substrate_symmetry", "film_symmetry"))
+    if args.output_format == "tsv" and args.summary is None and args.write_queue:
+        # formatting and writing overlap the matching, the batches stay in order
+        results_file = BackgroundMatchWriter(results_file, args.write_queue)
     #call checker
-    check_substrate_file(substrate_file, lattice_constants, tolerance, results_file)
+    if args.incremental:
+        if args.resolution is not None:
+            source = "resolution {!r}".format(args.resolution)
+        else:
+            # a replaced database changes size or modification time, as for the lattice index
+            stat = os.stat(args.lattice_constant_database)
+            source = "{} {} {}".format(os.path.abspath(args.lattice_constant_database), stat.st_size, stat.st_mtime_ns)
+        store_label = "composition_matches_for_" + args.substrate[:-4] + ".incremental.npz"
+        incremental_check_substrate_file(substrate_file, lattice_constants, tolerance, results_file, store_label, source, index, args.jobs, stats, args.top_k)
+    elif args.pairs is not None:
+        pair_check_substrate_file(substrate_file, lattice_constants, index, tolerance, results_file, pair_weight(args.pairs),
+                                  args.tensile_mismatch, args.compressive_mismatch, stats, args.top_k)
+    elif args.stream:
+        stream_check_substrate_file(substrate_file, args.lattice_constant_database, tolerance, results_file, args.chunk_rows, stats)
+    else:
+        parallel_check_substrate_file(substrate_file, lattice_constants, tolerance, results_file, index, args.jobs, stats, args.top_k)
     results_file.close()
+    if stats is not None:
+        stats.save(args.stats, tolerance=tolerance, jobs=args.jobs, substrates=len(numpy.atleast_1d(substrate_file)),
+                   database=args.lattice_constant_database, resolution=args.resolution, top_k=args.top_k)
+
+if __name__ == "__main__":
+    main()
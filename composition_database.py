@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+###############################################################################
+##                     Compact Composition Database Format                   ##
+###############################################################################
+"""Integer encoded, memory mapped storage for the III-V composition database.
+
+The .npz files written by iii_v_generator.py hold seven float32 columns per
+composition and have to be decompressed completely before use. Only x_Al,
+x_Ga, y_P and y_As are independent, and they are multiples of the composition
+step, so the compact format stores them as uint8 (uint16 for more than 255
+steps) step counts. The lattice constant column is optional because it can be
+recomputed from the reference constants kept in the header.
+
+File layout (little endian):
+    header   HEADER_DTYPE record padded to HEADER_SIZE bytes
+    steps    rows x 4 step counts of x_Al, x_Ga, y_P, y_As
+    a        rows float32 lattice constants, present if has_a is set
+
+The file is opened with numpy.memmap, so only the touched rows are read.
+Decoded rows are identical to the rows of the .npz the file was converted
+from.
+"""
+import argparse
+import io
+import struct
+import zipfile
+import numpy
+from iii_v_generator import REFERENCE_LATTICE_CONSTANTS, paired_lattice_constants
+
+
+parser = argparse.ArgumentParser(description="Converts III-V composition databases between the .npz layout of iii_v_generator.py and the compact memory mapped format.")
+parser.add_argument("direction", choices=["to-compact", "to-npz"], help="Conversion direction.")
+parser.add_argument("input_file", type=str, help="Database to convert.")
+parser.add_argument("output_file", type=str, help="Name of the converted database.")
+parser.add_argument("--resolution", type=int, help="Composition step in percent, inferred from the data if not given.")
+parser.add_argument("--no-lattice-constants", action="store_true", help="Do not store the lattice constant column, it is recomputed from the reference constants when read.")
+
+MAGIC = b"IIIVCDB1"
+HEADER_SIZE = 256
+HEADER_DTYPE = numpy.dtype([("magic", "S8"),
+                            ("rows", "<u8"),
+                            ("resolution", "<f8"),
+                            ("steps_itemsize", "<u4"),
+                            ("has_a", "<u4"),
+                            ("reference", "<f8", (3, 3))])
+
+#rows decoded at once when a whole database is converted or scanned
+CHUNK_ROWS = 2**20
+
+#byte alignment of the members written by save_aligned_npz()
+NPZ_ALIGNMENT = 64
+
+#record field names of the composition columns of III-V databases
+III_V_FIELDS = ("x_Al", "x_Ga", "x_In", "y_P", "y_As", "y_Sb")
+
+def percentages(steps, resolution):
+    """Composition in percent of integer step counts.
+
+    Integer resolutions reproduce the integer percentages of
+    iii_v_generator.py exactly.
+    """
+    return steps*float(resolution)
+
+def decode_rows(steps, resolution, a=None, reference=REFERENCE_LATTICE_CONSTANTS):
+    """Expands step counts to the seven float32 database columns.
+
+    Args:
+        steps: array of shape (n, 4) of x_Al, x_Ga, y_P, y_As step counts
+        resolution: composition step in percent
+        a: optional stored float32 lattice constants of the rows
+        reference: 3x3 binary lattice constants used when a is not given
+    Returns:
+        A float32 array of rows x_Al, x_Ga, x_In, y_P, y_As, y_Sb, a.
+    """
+    pct = percentages(numpy.asarray(steps, dtype=numpy.int64), resolution)
+    cations = numpy.stack([pct[:, 0], pct[:, 1], 100 - pct[:, 0] - pct[:, 1]], axis=1)
+    anions = numpy.stack([pct[:, 2], pct[:, 3], 100 - pct[:, 2] - pct[:, 3]], axis=1)
+    rows = numpy.empty((len(pct), 7), dtype=numpy.float32)
+    rows[:, 0:3] = cations/100.0
+    rows[:, 3:6] = anions/100.0
+    if a is None:
+        rows[:, 6] = paired_lattice_constants(cations, anions, reference)
+    else:
+        rows[:, 6] = a
+    return rows
+
+class CompactDatabase(object):
+    """Memory mapped compact composition database.
+
+    Supports the parts of the ndarray interface used by
+    composition_calculator.py: len(), db[rows] for row numbers or slices and
+    db[:, -1] for the lattice constant column.
+
+    Attributes:
+        file_name: path of the database file
+        resolution: composition step in percent
+        steps: memory mapped (rows, 4) step counts
+        a: memory mapped float32 lattice constants or None
+        reference: 3x3 binary lattice constants of the database
+    """
+
+    def __init__(self, file_name):
+        header = numpy.fromfile(file_name, dtype=HEADER_DTYPE, count=1)
+        if len(header) == 0 or header["magic"][0] != MAGIC:
+            raise ValueError("{} is not a compact composition database".format(file_name))
+        header = header[0]
+        self.file_name = file_name
+        rows = int(header["rows"])
+        self.resolution = float(header["resolution"])
+        self.reference = numpy.array(header["reference"])
+        steps_dtype = numpy.dtype("<u{}".format(int(header["steps_itemsize"])))
+        self.steps = numpy.memmap(file_name, dtype=steps_dtype, mode="r", offset=HEADER_SIZE, shape=(rows, 4)) if rows else numpy.zeros((0, 4), steps_dtype)
+        self.a = None
+        if header["has_a"]:
+            offset = HEADER_SIZE + rows*4*steps_dtype.itemsize
+            self.a = numpy.memmap(file_name, dtype="<f4", mode="r", offset=offset, shape=(rows,)) if rows else numpy.zeros(0, "<f4")
+        self.shape = (rows, 7)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def lattice_constants(self):
+        """The float32 lattice constant column, stored or recomputed."""
+        if self.a is not None:
+            return self.a
+        column = numpy.empty(len(self), dtype=numpy.float32)
+        for start in range(0, len(self), CHUNK_ROWS):
+            column[start:start + CHUNK_ROWS] = self.take(slice(start, start + CHUNK_ROWS))[:, 6]
+        return column
+
+    def take(self, rows):
+        """Decoded rows for an array of row numbers or a slice."""
+        a = None if self.a is None else self.a[rows]
+        return decode_rows(numpy.atleast_2d(self.steps[rows]), self.resolution, a, self.reference)
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            rows, column = key
+            if isinstance(rows, slice) and rows == slice(None) and column in (-1, 6):
+                return self.lattice_constants()
+            if column in (-1, 6) and self.a is not None:
+                return numpy.asarray(self.a[rows])
+            return self.take(rows)[:, column]
+        if isinstance(key, (int, numpy.integer)):
+            return self.take(numpy.array([key]))[0]
+        return self.take(key)
+
+class NamedDatabase(object):
+    """Composition database with named composition columns, as written by
+    alloy_generator.py.
+
+    Indexes like its rows array, so it can be used wherever the arr_0 array
+    of a III-V .npz database is.
+
+    Attributes:
+        rows: float32 array of composition columns followed by a
+        fields: record field names of the composition columns, e.g. x_Al
+        decimals: decimals needed to print the composition fractions
+    """
+
+    def __init__(self, rows, fields, decimals=2):
+        self.rows = rows
+        self.fields = tuple(fields)
+        self.decimals = decimals
+        if rows.ndim != 2 or rows.shape[1] != len(self.fields) + 1:
+            raise ValueError("{} composition fields for {} columns".format(len(self.fields), rows.shape[1:]))
+        self.shape = rows.shape
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, key):
+        return self.rows[key]
+
+def is_compact_database(file_name):
+    """True if the file starts with the compact database magic bytes."""
+    with open(file_name, "rb") as database_file:
+        return database_file.read(len(MAGIC)) == MAGIC
+
+def load_database(file_name):
+    """Opens a composition database in either format.
+
+    Args:
+        file_name: a .npz file written by iii_v_generator.py or a compact
+                   database
+    Returns:
+        The float32 array of the .npz, a NamedDatabase if the .npz names its
+        composition columns (alloy_generator.py) or a memory mapped
+        CompactDatabase.
+    """
+    if is_compact_database(file_name):
+        return CompactDatabase(file_name)
+    npz_database = numpy.load(file_name)
+    lattice_constants = npz_database['arr_0']
+    if "fields" in npz_database.files:
+        lattice_constants = NamedDatabase(lattice_constants, npz_database["fields"].tolist(),
+                                          int(npz_database["decimals"]) if "decimals" in npz_database.files else 2)
+    npz_database.close()
+    return lattice_constants
+
+def database_fields(file_name):
+    """Names of the composition columns of a database and the decimals its
+    fractions are printed with, without reading its rows.
+
+    Args:
+        file_name: a .npz file or a compact database
+    Returns:
+        (fields, decimals): III_V_FIELDS and 2 unless the .npz was written by
+        alloy_generator.py.
+    """
+    if is_compact_database(file_name):
+        return III_V_FIELDS, 2
+    with numpy.load(file_name) as npz_database:
+        if "fields" not in npz_database.files:
+            return III_V_FIELDS, 2
+        return tuple(npz_database["fields"].tolist()), int(npz_database["decimals"]) if "decimals" in npz_database.files else 2
+
+def database_chunks(file_name, chunk_rows=CHUNK_ROWS):
+    """Reads a composition database in either format a block of rows at a time.
+
+    The arr_0 member of a .npz database is decompressed as a stream and a
+    compact database is memory mapped, so only one block is in memory at once.
+
+    Args:
+        file_name: a .npz file written by iii_v_generator.py or a compact
+                   database
+        chunk_rows: number of rows per block
+    Yields:
+        (start, rows): the row number of the first row of the block and an
+        array of rows x_Al, x_Ga, x_In, y_P, y_As, y_Sb, a.
+    """
+    if is_compact_database(file_name):
+        database = CompactDatabase(file_name)
+        for start in range(0, len(database), chunk_rows):
+            yield start, database.take(slice(start, start + chunk_rows))
+        return
+    with zipfile.ZipFile(file_name) as archive, archive.open("arr_0.npy") as member:
+        version = numpy.lib.format.read_magic(member)
+        if version == (1, 0):
+            shape, fortran_order, dtype = numpy.lib.format.read_array_header_1_0(member)
+        else:
+            shape, fortran_order, dtype = numpy.lib.format.read_array_header_2_0(member)
+        streamable = len(shape) == 2 and not fortran_order and not dtype.hasobject
+        if streamable:
+            row_bytes = dtype.itemsize*shape[1]
+            for start in range(0, shape[0], chunk_rows):
+                count = min(chunk_rows, shape[0] - start)
+                data = member.read(count*row_bytes)
+                if len(data) != count*row_bytes:
+                    raise ValueError("{} ends after {} of {} rows".format(file_name, start + len(data)//row_bytes, shape[0]))
+                yield start, numpy.frombuffer(data, dtype=dtype).reshape(count, shape[1])
+    if not streamable:
+        # rows are not stored one after the other, the whole array is read
+        lattice_consts = load_database(file_name)
+        for start in range(0, len(lattice_consts), chunk_rows):
+            yield start, lattice_consts[start:start + chunk_rows]
+
+def infer_resolution(lattice_consts):
+    """Largest integer step in percent that all composition fractions of a
+    database are multiples of."""
+    resolution = 0
+    for start in range(0, len(lattice_consts), CHUNK_ROWS):
+        pct = numpy.rint(lattice_consts[start:start + CHUNK_ROWS, [0, 1, 3, 4]].astype(numpy.float64)*100).astype(numpy.int64)
+        resolution = numpy.gcd.reduce(numpy.append(pct.ravel(), resolution))
+    return int(resolution) if resolution else 100
+
+def write_compact(file_name, lattice_consts, resolution=None, store_a=True, reference=REFERENCE_LATTICE_CONSTANTS):
+    """Writes a composition array in the compact format.
+
+    Args:
+        file_name: name of the compact database to write
+        lattice_consts: (n, 7) float32 array of compositions and lattice
+                        constants, for example arr_0 of a .npz database
+        resolution: composition step in percent, inferred if not given
+        store_a: store the lattice constant column instead of recomputing it
+        reference: 3x3 binary lattice constants the database was built with
+    Raises:
+        ValueError: if the rows cannot be reproduced exactly from step counts
+    """
+    if resolution is None:
+        resolution = infer_resolution(lattice_consts)
+    rows = len(lattice_consts)
+    max_steps = int(numpy.ceil(100.0/resolution)) + 1
+    steps_dtype = numpy.dtype("<u1") if max_steps <= 255 else numpy.dtype("<u2")
+    header = numpy.zeros(1, dtype=HEADER_DTYPE)
+    header["magic"] = MAGIC
+    header["rows"] = rows
+    header["resolution"] = resolution
+    header["steps_itemsize"] = steps_dtype.itemsize
+    header["has_a"] = store_a
+    header["reference"] = reference
+    with open(file_name, "wb") as compact_file:
+        compact_file.write(header.tobytes().ljust(HEADER_SIZE, b"\0"))
+        for start in range(0, rows, CHUNK_ROWS):
+            block = numpy.asarray(lattice_consts[start:start + CHUNK_ROWS], dtype=numpy.float32)
+            steps = numpy.rint(block[:, [0, 1, 3, 4]].astype(numpy.float64)*100/resolution).astype(steps_dtype)
+            decoded = decode_rows(steps, resolution, block[:, 6] if store_a else None, reference)
+            if not numpy.array_equal(decoded.view(numpy.uint32), block.view(numpy.uint32)):
+                raise ValueError("rows {}-{} are not reproduced at a resolution of {} percent".format(start, start + len(block) - 1, resolution))
+            compact_file.write(steps.tobytes())
+        if store_a:
+            for start in range(0, rows, CHUNK_ROWS):
+                compact_file.write(numpy.asarray(lattice_consts[start:start + CHUNK_ROWS, 6], dtype="<f4").tobytes())
+
+def npz_to_compact(npz_file_name, compact_file_name, resolution=None, store_a=True):
+    """Converts a .npz database of iii_v_generator.py to the compact format."""
+    lattice_consts = load_database(npz_file_name)
+    if tuple(getattr(lattice_consts, "fields", III_V_FIELDS)) != III_V_FIELDS:
+        raise ValueError("the compact format only stores III-V databases, {} has the columns {}".format(npz_file_name, lattice_consts.fields))
+    write_compact(compact_file_name, lattice_consts, resolution, store_a)
+
+def compact_to_npz(compact_file_name, npz_file_name):
+    """Converts a compact database back to the .npz layout of iii_v_generator.py."""
+    database = CompactDatabase(compact_file_name)
+    lst = numpy.empty(database.shape, dtype=numpy.float32)
+    for start in range(0, len(database), CHUNK_ROWS):
+        lst[start:start + CHUNK_ROWS] = database.take(slice(start, start + CHUNK_ROWS))
+    numpy.savez_compressed(npz_file_name, lst)
+
+def memmap_npz(file_name):
+    """Memory maps the members of an uncompressed .npz file written by
+    numpy.savez.
+
+    Args:
+        file_name: path of the .npz file
+    Returns:
+        A dict of read-only memory mapped arrays by member name (without the
+        .npy suffix). Compressed members are read into memory instead.
+    """
+    arrays = {}
+    with zipfile.ZipFile(file_name) as archive, open(file_name, "rb") as raw:
+        for info in archive.infolist():
+            name = info.filename[:-4] if info.filename.endswith(".npy") else info.filename
+            if info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[name] = numpy.lib.format.read_array(member)
+                continue
+            raw.seek(info.header_offset)
+            local_header = struct.unpack("<4s5H3L2H", raw.read(30))
+            raw.seek(info.header_offset + 30 + local_header[-2] + local_header[-1])
+            version = numpy.lib.format.read_magic(raw)
+            if version == (1, 0):
+                shape, fortran_order, dtype = numpy.lib.format.read_array_header_1_0(raw)
+            else:
+                shape, fortran_order, dtype = numpy.lib.format.read_array_header_2_0(raw)
+            if dtype.hasobject or 0 in shape or shape == () or raw.tell() % dtype.alignment:
+                # numpy copies unaligned arrays on every use, they are read once instead
+                raw.seek(info.header_offset + 30 + local_header[-2] + local_header[-1])
+                arrays[name] = numpy.lib.format.read_array(raw)
+                continue
+            arrays[name] = numpy.memmap(file_name, dtype=dtype, mode="r", offset=raw.tell(), shape=shape,
+                                        order="F" if fortran_order else "C")
+    return arrays
+
+def save_aligned_npz(file_name, **arrays):
+    """Writes arrays as an uncompressed .npz file like numpy.savez, with the
+    data of every member starting at a multiple of NPZ_ALIGNMENT bytes, so
+    memmap_npz() maps them aligned. Unaligned memory maps are copied by numpy
+    on every use, e.g. on every numpy.searchsorted.
+
+    Args:
+        file_name: path of the .npz file
+        arrays: arrays by member name (without the .npy suffix)
+    """
+    with zipfile.ZipFile(file_name, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for name, array in arrays.items():
+            array = numpy.asarray(array, order="C")
+            header = io.BytesIO()
+            numpy.lib.format.write_array_header_2_0(header, numpy.lib.format.header_data_from_array_1_0(array))
+            header = header.getvalue()
+            info = zipfile.ZipInfo(name + ".npy", date_time=(1980, 1, 1, 0, 0, 0))
+            info.compress_type = zipfile.ZIP_STORED
+            # local header, name, padding extra field (4 bytes and its data), zip64 extra field, .npy header
+            start = archive.fp.tell() + 30 + len(info.filename.encode("utf-8")) + 4 + 20 + len(header)
+            info.extra = struct.pack("<HH", 0x6e70, (-start) % NPZ_ALIGNMENT) + b"\0"*((-start) % NPZ_ALIGNMENT)
+            with archive.open(info, "w", force_zip64=True) as member:
+                member.write(header)
+                member.write(array.data if array.size else b"")
+
+def main(argv=None):
+    """Command line interface, see parser."""
+    args = parser.parse_args(argv)
+    if args.direction == "to-compact":
+        npz_to_compact(args.input_file, args.output_file, args.resolution, not args.no_lattice_constants)
+    else:
+        compact_to_npz(args.input_file, args.output_file)
+
+if __name__ == "__main__":
+    main()
@@ -6,8 +6,8 @@
 satisfies the III-V semidonductor composition equation found on the III-V Calc
 information page. <http://ahrenkiel.sdsmt.edu/III_V_Calc/info/>
 
-WARNING: For small fractional_resolution values the code takes a long time to 
-         run and creates a large output file. 
+WARNING: For small fractional_resolution values the code creates a large
+         output file.
 
 Returns:
     Creates a compressed .npz file containing the composition information and
@@ -20,7 +20,6 @@ import numpy
 parser = argparse.ArgumentParser(description="Calculates the lattice constant 'a' for the entire parameter space which satisfies the III-V semidonductor composition equation found on the III-V Calc information page. <http://ahrenkiel.sdsmt.edu/III_V_Calc/info/>")
 parser.add_argument("resolution", type=int, help="The resolution of the step size in composition in percent where (1 = 1 percent).")
 parser.add_argument("output_file", type=str, help="Name of the compressed npz file where the array of composition and corresponding lattice constant is saved.")
-args = parser.parse_args()
 
 #define all reference lattice constants
 a_AlP = 5.4510
@@ -33,31 +32,117 @@ a_AlSb = 6.1355
 a_GaSb = 6.0950
 a_InSb = 6.4794
 
-#This sets the resolution of the steps in compsition in percent (1 = 1%)
-fraction_resolution = args.resolution
-
-#This code counts the number of iterations in order to pre-allocate a numpy array
-i = 0
-for y_P in numpy.arange(0, 100 + fraction_resolution, fraction_resolution):
-    for y_As in numpy.arange(0, 100 + fraction_resolution - y_P, fraction_resolution):
-        for x_Al in numpy.arange(0, 100 + fraction_resolution, fraction_resolution):
-            for x_Ga in numpy.arange(0, 100 + fraction_resolution - x_Al, fraction_resolution):
-                i+=1
-
-lst = numpy.zeros((i, 7), dtype=numpy.float32) #Pre allocate a numpy array of float32, which is enough precision, size is the number of iterations the below code does
-
-i = 0
-for y_P in numpy.arange(0, 100 + fraction_resolution, fraction_resolution):
-    for y_As in numpy.arange(0, 100 + fraction_resolution - y_P, fraction_resolution):
-        for x_Al in numpy.arange(0, 100 + fraction_resolution, fraction_resolution):
-            for x_Ga in numpy.arange(0, 100 + fraction_resolution - x_Al, fraction_resolution):
-                y_Sb = 100 - y_P - y_As
-                x_In = 100 - x_Al - x_Ga
-                a = (y_P*(x_Al*a_AlP + x_Ga*a_GaP + x_In*a_InP) + \
-                y_As*(x_Al*a_AlAs + x_Ga*a_GaAs + x_In*a_InAs) + \
-                y_Sb*(x_Al*a_AlSb + x_Ga*a_GaSb + x_In*a_InSb))/10000.0
-                lst[i] = [x_Al/100.0, x_Ga/100.0, x_In/100.0, y_P/100.0, y_As/100.0, y_Sb/100.0, a]
-                i+=1
-
-
-numpy.savez_compressed(args.output_file, lst)
\ No newline at end of file
+#binary lattice constants, rows are the cations Al, Ga, In and columns the anions P, As, Sb
+REFERENCE_LATTICE_CONSTANTS = numpy.array([[a_AlP, a_AlAs, a_AlSb],
+                                           [a_GaP, a_GaAs, a_GaSb],
+                                           [a_InP, a_InAs, a_InSb]])
+
+#number of rows filled at once, bounds the size of the temporary arrays
+CHUNK_ROWS = 2**20
+
+def simplex_steps(n):
+    """Enumerates the step pairs (first, second) with first + second <= n in
+    lexicographic order.
+
+    Args:
+        n: number of composition steps, each level has n + 1 values
+    Returns:
+        (first, second): integer arrays of (n + 1)*(n + 2)/2 step pairs.
+    """
+    counts = n + 1 - numpy.arange(n + 1)
+    first_steps = numpy.repeat(numpy.arange(n + 1), counts)
+    # position of each pair inside its block of equal first_steps
+    block_starts = numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    second_steps = numpy.arange(len(first_steps)) - block_starts
+    return first_steps, second_steps
+
+def fraction_pairs(fraction_resolution):
+    """Enumerates the pairs of the two-level composition loop
+           for first in numpy.arange(0, 100 + res, res):
+               for second in numpy.arange(0, 100 + res - first, res):
+
+    Args:
+        fraction_resolution: step size in composition in percent
+    Returns:
+        (first, second): integer arrays of percentages in loop order. With
+        n = len(numpy.arange(0, 100 + res, res)) values per level there are
+        n*(n+1)/2 pairs.
+    """
+    n = len(range(0, 100 + fraction_resolution, fraction_resolution))
+    first_steps, second_steps = simplex_steps(n - 1)
+    return first_steps*fraction_resolution, second_steps*fraction_resolution
+
+def number_of_rows(fraction_resolution):
+    """Closed form row count of the database for a resolution in percent."""
+    n = len(range(0, 100 + fraction_resolution, fraction_resolution))
+    return (n*(n + 1)//2)**2
+
+def lattice_constants(cations, anions):
+    """Vegard's law lattice constant for blocks of cation and anion fractions.
+
+    The bilinear form a = sum_ij y_j x_i a_ij against the nine binary lattice
+    constants is evaluated as one broadcast tensor contraction. The sums run in
+    the same order as the original per-row expression, so the values are
+    identical to it.
+
+    Args:
+        cations: array of shape (m, 3) of Al, Ga, In fractions in percent
+        anions: array of shape (n, 3) of P, As, Sb fractions in percent
+    Returns:
+        An (n, m) float64 array of lattice constants for every anion/cation
+        combination.
+    """
+    per_anion = (cations[:, :, None]*REFERENCE_LATTICE_CONSTANTS[None, :, :]).sum(axis=1)
+    return (anions[:, None, :]*per_anion[None, :, :]).sum(axis=2)/10000.0
+
+def paired_lattice_constants(cations, anions, reference=REFERENCE_LATTICE_CONSTANTS):
+    """Same as lattice_constants() for matching rows of cations and anions.
+
+    Args:
+        cations: array of shape (n, 3) of Al, Ga, In fractions in percent
+        anions: array of shape (n, 3) of P, As, Sb fractions in percent
+        reference: 3x3 binary lattice constants, cations by anions
+    Returns:
+        An (n,) float64 array, element i is the lattice constant of cations[i]
+        combined with anions[i].
+    """
+    per_anion = (cations[:, :, None]*reference[None, :, :]).sum(axis=1)
+    return (anions*per_anion).sum(axis=1)/10000.0
+
+def iii_v_database(fraction_resolution):
+    """Builds the composition and lattice constant array.
+
+    Args:
+        fraction_resolution: step size in composition in percent
+    Returns:
+        A float32 array with one row x_Al, x_Ga, x_In, y_P, y_As, y_Sb, a per
+        composition. Fractions are decimals and the rows are in the order of
+        the loops over y_P, y_As, x_Al, x_Ga.
+    """
+    x_Al, x_Ga = fraction_pairs(fraction_resolution)
+    y_P, y_As = fraction_pairs(fraction_resolution)
+    cations = numpy.stack([x_Al, x_Ga, 100 - x_Al - x_Ga], axis=1)
+    anions = numpy.stack([y_P, y_As, 100 - y_P - y_As], axis=1)
+    per_anion = len(cations)
+    lst = numpy.zeros((number_of_rows(fraction_resolution), 7), dtype=numpy.float32)
+    # the cation columns repeat identically for every anion composition
+    cation_columns = (cations/100.0).astype(numpy.float32)
+    anions_per_chunk = max(1, CHUNK_ROWS // per_anion)
+    for start in range(0, len(anions), anions_per_chunk):
+        block = anions[start:start + anions_per_chunk]
+        rows = lst[start*per_anion:(start + len(block))*per_anion].reshape(len(block), per_anion, 7)
+        rows[:, :, 0:3] = cation_columns
+        rows[:, :, 3:6] = (block/100.0).astype(numpy.float32)[:, None, :]
+        rows[:, :, 6] = lattice_constants(cations, block)
+    return lst
+
+def main(argv=None):
+    """Command line interface, see parser."""
+    args = parser.parse_args(argv)
+    #This sets the resolution of the steps in compsition in percent (1 = 1%)
+    fraction_resolution = args.resolution
+    lst = iii_v_database(fraction_resolution)
+    numpy.savez_compressed(args.output_file, lst)
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,15 @@
 
 import numpy # includes numpy.sqrt()
 import argparse # command line implementation
+from lattice_stores import incremental_match_records, load_mismatch_cache, query_mismatch_cache
+from match_output import (COMPRESSIONS, LATTICE_HEADER, OUTPUT_FORMATS, WRITE_QUEUE, BackgroundMatchWriter,
+                          open_match_writer, open_text_output, output_file_name)
+from match_stats import MatchStats, StatsWriter
+from material_catalog import load_catalog
+from orientation_rules import ratio_check, round_ratio # shared by the scalar engine and the orientation rules
+from parallel_engines import parallel_match_blocks
+from supercell_search import parallel_supercell_blocks
+from top_k_matches import TopKMatches, top_k_match_blocks
 
 
 #### Command line code ###
@@ -14,10 +23,21 @@ parser = argparse.ArgumentParser(description="Software for calculating epitaxial
 parser.add_argument("film", type=str, help="File with film material data")
 parser.add_argument("substrate", type=str, help="File with substrate material data")
 parser.add_argument("tolerance", type=float, help="Tolerance level for mismatch. Enter percent as a decimal")
-# Parse all arguments
-args = parser.parse_args()
+parser.add_argument("--engine", choices=["indexed", "vectorized", "scalar"], default="indexed", help="Matching engine: 'indexed' evaluates only the pairs found in a sorted index of substrate lengths, 'vectorized' evaluates all film/substrate pairs with numpy broadcasting, 'scalar' uses the original per-pair loop")
+parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default="tsv", help="Write matches as tab delimited text (tsv) or as a structured numpy array (npy, npz)")
+parser.add_argument("--cache", action="store_true", help="Answer from a tolerance independent mismatch cache of the two databases, built on first use")
+parser.add_argument("--cache-max-tolerance", type=float, default=0.1, help="Largest tolerance a newly built mismatch cache can answer")
+parser.add_argument("--jobs", type=int, default=1, help="Number of worker processes, substrates are split into shards that are matched in parallel")
+parser.add_argument("--incremental", action="store_true", help="Keep the matches in a store keyed by the content of every film and substrate row and only compute the pairs of new or changed rows")
+parser.add_argument("--top-k", type=int, help="Only write the K matches with the smallest absolute mismatch for each film, of those passing the tolerance")
+parser.add_argument("--stats", type=str, help="Write counters of pairs evaluated, pairs passing ratio_check, matches, time and bytes written per symmetry pair and orientation rule to this JSON file")
+parser.add_argument("--supercell", type=int, metavar="N", help="Search every orientation for domain matches of m film cells on n substrate cells with m, n up to N along each interface direction instead of the nearest integer ratio, written to <film>_on_<substrate>_supercells")
+parser.add_argument("--chunk-pairs", type=int, default=2**20, help="Maximum number of film/substrate pairs evaluated at once by the vectorized engine")
+parser.add_argument("--compress", choices=sorted(COMPRESSIONS), default="none", help="Compress tsv output with gzip (.txt.gz) or xz (.txt.xz)")
+parser.add_argument("--write-queue", type=int, default=WRITE_QUEUE, help="Batches of matches waiting to be formatted and written by a writer thread while matching goes on, 0 writes them in between (default %(default)s)")
+MATCHES_HEADER = LATTICE_HEADER
 
-def lattice_matcher(film_file, substrate_file, matches_file):
+def lattice_matcher(film_file, substrate_file, matches_file, tolerance):
     """Creates a file of all acceptable lattice symmetry matches for two input 
        database files.
 
@@ -26,17 +46,18 @@ def lattice_matcher(film_file, substrate_file, matches_file):
         substrate_file: a tab delimited .txt file containing data for substrate
         materials matches_file: a tab delimited .txt file where all accepted 
         matches are written to
+        tolerance: tolerance level for mismatch as a decimal
     Returns:
         A tab delimited .txt file with all acceptable lattice matches. Lattice 
         matches are calculated by passing values to a function which in turn 
         calls other functions to perform the desired calculations and write the
         values to the results .txt file.
     """
-    matches_file.write("#Film\tSymmetry\tSubstrate\tSymmetry\tMismatch\tRounded Ratio\tOriginal Ratio\tC Mismatch\tC Rounded Ratio\tC Original Ratio\n")
+    matches_file.write(MATCHES_HEADER)
     for i, line in enumerate(substrate_file):
-        film_substrate_comparison(film_file, substrate_file[i][0], substrate_file[i][1], substrate_file[i][2], substrate_file[i][3], matches_file)
+        film_substrate_comparison(film_file, substrate_file[i][0], substrate_file[i][1], substrate_file[i][2], substrate_file[i][3], matches_file, tolerance)
 
-def film_substrate_comparison(input_film_file, substrate_composition, substrate_symmetry, sub_a, sub_c, result_file):
+def film_substrate_comparison(input_film_file, substrate_composition, substrate_symmetry, sub_a, sub_c, result_file, tolerance):
     """Passes values to various functions to perform mismatch calculations.
 
     Args:
@@ -48,6 +69,7 @@ def film_substrate_comparison(input_film_file, substrate_composition, substrate_
         sub_c: substrate lattice constant 'c' value
         results_file: a tab delimited .txt file where all accepted matches are 
                       written to
+        tolerance: tolerance level for mismatch as a decimal
     Returns:
         A tab delimited .txt file with all acceptable lattice matches. Lattice 
         matches are calculated by calling various functions which perform the 
@@ -57,13 +79,13 @@ def film_substrate_comparison(input_film_file, substrate_composition, substrate_
         if input_film_file[i][0] == substrate_composition and input_film_file[i][1] == substrate_symmetry:
             pass
         elif input_film_file[i][1] == "C":
-            cubic_film(input_film_file[i][0], input_film_file[i][1], substrate_composition, substrate_symmetry, sub_a, sub_c, input_film_file[i][2], result_file)
+            cubic_film(input_film_file[i][0], input_film_file[i][1], substrate_composition, substrate_symmetry, sub_a, sub_c, input_film_file[i][2], result_file, tolerance)
         elif input_film_file[i][1] == "T":
-            tetragonal_film(input_film_file[i][0], input_film_file[i][1], substrate_composition, substrate_symmetry, sub_a, sub_c, input_film_file[i][2], input_film_file[i][3], result_file)
+            tetragonal_film(input_film_file[i][0], input_film_file[i][1], substrate_composition, substrate_symmetry, sub_a, sub_c, input_film_file[i][2], input_film_file[i][3], result_file, tolerance)
         elif input_film_file[i][1] == "H":
-            hexagonal_film(input_film_file[i][0], input_film_file[i][1], substrate_composition, substrate_symmetry, sub_a, sub_c, input_film_file[i][2], input_film_file[i][3], result_file)
+            hexagonal_film(input_film_file[i][0], input_film_file[i][1], substrate_composition, substrate_symmetry, sub_a, sub_c, input_film_file[i][2], input_film_file[i][3], result_file, tolerance)
 
-def cubic_film(film_comp, film_sym, sub_comp, sub_sym, sub_a, sub_c, film_a, output_file):
+def cubic_film(film_comp, film_sym, sub_comp, sub_sym, sub_a, sub_c, film_a, output_file, tolerance):
     """Performs mismatch and ratio checks for a cubic film on various substrates.
 
     Args:
@@ -76,6 +98,7 @@ def cubic_film(film_comp, film_sym, sub_comp, sub_sym, sub_a, sub_c, film_a, out
         film_a: film lattice constant 'a' value
         output_file: a tab delimited .txt file where all accepted matches are 
                      written to
+        tolerance: tolerance level for mismatch as a decimal
     Returns:
         Write a new line containing match information in a tab delimited .txt 
         file. The calculated mismatch values must be less than the chosen 
@@ -139,7 +162,7 @@ def cubic_film(film_comp, film_sym, sub_comp, sub_sym, sub_a, sub_c, film_a, out
         if ratio_check(r_plane_c, sub_a) < tolerance and abs(mismatch_c_r) and abs(mismatch_a) < tolerance:
             output_file.write("{}\t{} (110)\t{}\t{} (r-plane)\t{}\t{}\t{}\t{}\t{}\t{}\n".format(film_comp, film_sym, sub_comp, sub_sym, mismatch_a, ratio_a, original_ratio_a, mismatch_c_r, ratio_c_r, original_ratio_c_r))
 
-def tetragonal_film(film_comp, film_sym, sub_comp, sub_sym, sub_a, sub_c, film_a, film_c, output_file):
+def tetragonal_film(film_comp, film_sym, sub_comp, sub_sym, sub_a, sub_c, film_a, film_c, output_file, tolerance):
     """Performs mismatch and ratio checks for a tetragonal film on various substrates.
 
     Args:
@@ -153,6 +176,7 @@ def tetragonal_film(film_comp, film_sym, sub_comp, sub_sym, sub_a, sub_c, film_a
         film_c: film lattice constant 'c' value
         output_file: a tab delimited .txt file where all accepted matches are 
                      written to
+        tolerance: tolerance level for mismatch as a decimal
     Returns:
         Write a new line containing match information in a tab delimited .txt 
         file. The calculated mismatch values must be less than the chosen 
@@ -215,7 +239,7 @@ def tetragonal_film(film_comp, film_sym, sub_comp, sub_sym, sub_a, sub_c, film_a
         if abs(mismatch_a) < tolerance and abs(mismatch_c_r) < tolerance:
             output_file.write("{}\t{} (a-plane)\t{}\t{} (r-plane)\t{}\t{}\t{}\t{}\t{}\t{}\n".format(film_comp, film_sym, sub_comp, sub_sym, mismatch_a, ratio_a, original_ratio_a, mismatch_c_r, ratio_c_r, original_ratio_c_r))
 
-def hexagonal_film(film_comp, film_sym, sub_comp, sub_sym, sub_a, sub_c, film_a, film_c, output_file):
+def hexagonal_film(film_comp, film_sym, sub_comp, sub_sym, sub_a, sub_c, film_a, film_c, output_file, tolerance):
     """Performs mismatch and ratio checks for a hexagonal film on various substrates.
 
     Args:
@@ -229,6 +253,7 @@ def hexagonal_film(film_comp, film_sym, sub_comp, sub_sym, sub_a, sub_c, film_a,
         film_c: film lattice constant 'c' value
         output_file: a tab delimited .txt file where all accepted matches are 
                      written to
+        tolerance: tolerance level for mismatch as a decimal
     Returns:
         Write a new line containing match information in a tab delimited .txt 
         file. The calculated mismatch values must be less than the chosen 
@@ -317,42 +342,136 @@ def hexagonal_film(film_comp, film_sym, sub_comp, sub_sym, sub_a, sub_c, film_a,
         if abs(mismatch_a_r_a) < tolerance and abs(mismatch_c_r_a) < tolerance:
             output_file.write("{}\t{} (a-plane)\t{}\t{} (r-plane)\t{}\t{}\t{}\n".format(film_comp, film_sym, sub_comp, sub_sym, mismatch_a, ratio_a, original_ratio_a))
 
-def round_ratio(original_ratio):
-    """Rounds a ratio to an integer value.
+def vectorized_lattice_matcher(film_database, substrate_database, tolerance, match_writer, chunk_pairs=2**20, jobs=1, stats=None):
+    """Vectorized equivalent of lattice_matcher().
+
+    Every orientation rule is evaluated for blocks of substrates against all
+    films at once with numpy broadcasting. At most chunk_pairs pairs are held
+    in memory at a time. As text the written matches are identical to the
+    file produced by lattice_matcher().
 
     Args:
-        original_ratio: the ratio value to be rounded.
+        film_database: structured array of film materials (material_catalog.py)
+        substrate_database: structured array of substrate materials
+        tolerance: tolerance level for mismatch as a decimal
+        match_writer: a match_output writer receiving one record array per
+                      block of substrates
+        chunk_pairs: maximum number of film/substrate pairs per block
+        jobs: number of worker processes, see parallel_match_blocks()
+        stats: optional match_stats.MatchStats counting the evaluated pairs
     Returns:
-        ratio: the rounded value of original_ratio.
+        All acceptable lattice matches written to match_writer.
     """
-    if original_ratio < 1:
-        ratio = 1.0 / round(1.0/original_ratio)
-    else:
-        ratio = round(original_ratio)
-    return ratio
+    for records, critical in parallel_match_blocks(film_database, substrate_database, tolerance, chunk_pairs, jobs, "vectorized", stats):
+        match_writer.write(records)
 
-def ratio_check(c_value, a_value):
-    """Checks to see if the ratio of lattice constants (a,c) is close to c = sqrt(2)*a.
+def indexed_lattice_matcher(film_database, substrate_database, tolerance, match_writer, chunk_pairs=2**20, jobs=1, stats=None):
+    """Indexed equivalent of lattice_matcher(), see indexed_match_blocks().
 
     Args:
-        a_value: value of lattice constant 'a'
-        c_value: value of lattice constant 'c'
+        film_database: structured array of film materials (material_catalog.py)
+        substrate_database: structured array of substrate materials
+        tolerance: tolerance level for mismatch as a decimal
+        match_writer: a match_output writer receiving the record arrays
+        chunk_pairs: maximum number of candidate pairs evaluated at once
+        jobs: number of worker processes, see parallel_match_blocks()
+        stats: optional match_stats.MatchStats counting the evaluated pairs
     Returns:
-        abs(percent_off): the absolute value of the percent (as a decimal) of 
-                          how far off the ratio is
+        All acceptable lattice matches written to match_writer.
     """
-    percent_off = ((c_value/(numpy.sqrt(2.0)*a_value)) - 1)
-    return abs(percent_off) #returns a percentage of how far off the ratio is
+    for records, critical in parallel_match_blocks(film_database, substrate_database, tolerance, chunk_pairs, jobs, "indexed", stats):
+        match_writer.write(records)
 
-if __name__ == "__main__":
+def main(argv=None):
+    """Command line interface, see parser."""
+    args = parser.parse_args(argv)
+    if args.compress != "none" and args.output_format != "tsv":
+        parser.error("--compress compresses tsv output, npy and npz are binary")
+    if args.write_queue < 0:
+        parser.error("--write-queue must not be negative")
     # Create a label for the matches file. [:-4] strips last 4 characters of file name string
-    matches_database_label = args.film[:-4] + "_on_" + args.substrate[:-4] + ".txt" # Added ".txt" to specify type of file
-    matches_database = open(matches_database_label, "w")
-    # Read input .txt files using numpy.genfromtxt()
-    film_database = numpy.genfromtxt(args.film, comments="#", delimiter="\t", dtype=None)
-    substrate_database = numpy.genfromtxt(args.substrate, comments="#", delimiter="\t", dtype=None)
+    matches_database_label = output_file_name(args.film[:-4] + "_on_" + args.substrate[:-4], args.output_format, args.compress)
+    # Read input .txt files, parsed once into binary .catalog.npz sidecars (see material_catalog.py)
+    film_database = load_catalog(args.film)
+    substrate_database = load_catalog(args.substrate)
     tolerance = args.tolerance # Percent tolerance for lattice mismatch as a decimal
+    # counters are only collected with --stats
+    stats = MatchStats() if args.stats else None
+    if args.supercell is not None:
+        # a search of its own, independent of --engine
+        if args.supercell < 1:
+            parser.error("--supercell must be at least 1")
+        if args.cache or args.incremental or args.top_k is not None:
+            parser.error("--supercell writes every supercell match, it cannot be combined with --cache, --incremental or --top-k")
+        supercell_label = output_file_name(args.film[:-4] + "_on_" + args.substrate[:-4] + "_supercells", args.output_format, args.compress)
+        matches_database = open_match_writer(supercell_label, args.output_format, "supercell", compression=args.compress)
+        if stats is not None:
+            matches_database = StatsWriter(matches_database, stats, "rules", ("film_symmetry", "substrate_symmetry"))
+        if args.output_format == "tsv" and args.write_queue:
+            matches_database = BackgroundMatchWriter(matches_database, args.write_queue)
+        for records in parallel_supercell_blocks(film_database, substrate_database, tolerance, args.supercell, args.chunk_pairs, args.jobs, stats):
+            matches_database.write(records)
+        matches_database.close()
+        if stats is not None:
+            stats.save(args.stats, engine="supercell", tolerance=tolerance, jobs=args.jobs, supercell=args.supercell,
+                       films=len(film_database), substrates=len(substrate_database))
+        return
     # Call lattice_check to perform the check
-    lattice_matcher(film_database, substrate_database, matches_database)
+    if args.engine == "scalar":
+        if args.output_format != "tsv":
+            parser.error("the scalar engine only writes tsv output")
+        if args.jobs > 1:
+            parser.error("the scalar engine runs in one process, use --jobs with the indexed or vectorized engine")
+        if stats is not None:
+            parser.error("the scalar engine is not instrumented, use --stats with the indexed or vectorized engine")
+        if args.top_k is not None:
+            parser.error("the scalar engine writes every match, use --top-k with the indexed or vectorized engine")
+        if args.incremental:
+            parser.error("the scalar engine has no result store, use --incremental with the indexed or vectorized engine")
+        matches_database = open_text_output(matches_database_label, args.compress)
+        lattice_matcher(film_database, substrate_database, matches_database, tolerance)
+        matches_database.close()
+        return
+    if args.top_k is not None and args.top_k < 1:
+        parser.error("--top-k must be at least 1")
+    if args.cache and args.incremental:
+        parser.error("--cache and --incremental are different result stores, use one of them")
+    matches_database = open_match_writer(matches_database_label, args.output_format, "lattice", compression=args.compress)
+    if stats is not None:
+        matches_database = StatsWriter(matches_database, stats, "rules", ("film_symmetry", "substrate_symmetry"))
+    if args.output_format == "tsv" and args.write_queue:
+        # formatting and writing overlap the matching, the batches stay in order
+        matches_database = BackgroundMatchWriter(matches_database, args.write_queue)
+    if args.cache:
+        cache_label = args.film[:-4] + "_on_" + args.substrate[:-4] + ".mismatch_cache.npz"
+        records, critical = load_mismatch_cache(args.film, args.substrate, cache_label, tolerance, args.cache_max_tolerance, args.chunk_pairs, args.jobs)
+        if args.top_k is not None:
+            top = TopKMatches(film_database, args.top_k)
+            selected = critical < tolerance
+            top.add(records[selected], critical[selected])
+            records, critical = top.result()
+        query_mismatch_cache(records, critical, tolerance, matches_database)
+    elif args.incremental:
+        store_label = args.film[:-4] + "_on_" + args.substrate[:-4] + ".incremental.npz"
+        records, critical = incremental_match_records(film_database, substrate_database, tolerance, store_label, args.chunk_pairs, args.jobs, args.engine, stats)
+        if args.top_k is not None:
+            top = TopKMatches(film_database, args.top_k)
+            top.add(records, critical)
+            records, critical = top.result()
+        for start in range(0, len(records), args.chunk_pairs):
+            matches_database.write(records[start:start + args.chunk_pairs])
+    elif args.top_k is not None:
+        records, critical = top_k_match_blocks(film_database, substrate_database, tolerance, args.top_k, args.chunk_pairs, args.jobs, args.engine, stats)
+        matches_database.write(records)
+    elif args.engine == "indexed":
+        indexed_lattice_matcher(film_database, substrate_database, tolerance, matches_database, args.chunk_pairs, args.jobs, stats)
+    else:
+        vectorized_lattice_matcher(film_database, substrate_database, tolerance, matches_database, args.chunk_pairs, args.jobs, stats)
     # Close any open files
     matches_database.close()
+    if stats is not None:
+        stats.save(args.stats, engine="cache" if args.cache else args.engine, tolerance=tolerance, jobs=args.jobs, top_k=args.top_k,
+                   films=len(numpy.atleast_1d(film_database)), substrates=len(numpy.atleast_1d(substrate_database)))
+
+if __name__ == "__main__":
+    main()
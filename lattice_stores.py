@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+###############################################################################
+##                            Lattice Match Stores                           ##
+###############################################################################
+"""Stored matches of lattice_matcher.py: the tolerance independent mismatch
+cache of --cache and the content keyed result store of --incremental (see
+result_store.py).
+"""
+import hashlib
+import os
+import numpy
+from match_output import concatenate_records, lattice_match_records
+from material_catalog import load_catalog
+from orientation_rules import database_columns
+from parallel_engines import parallel_match_blocks
+from result_store import (digest_numbers, expand_to_rows, load_store, row_hashes, save_store, unique_rows,
+                          within_group_rank)
+
+def file_hash(file_name):
+    """SHA-1 hex digest of a file's contents."""
+    digest = hashlib.sha1()
+    with open(file_name, "rb") as hashed_file:
+        for block in iter(lambda: hashed_file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def build_mismatch_cache(film_file_name, substrate_file_name, cache_file_name, max_tolerance, chunk_pairs=2**20, jobs=1):
+    """Computes every candidate match with a critical value below max_tolerance
+    once and saves it, so that any tolerance up to max_tolerance can be queried
+    without recomputing ratios and mismatches.
+
+    Args:
+        film_file_name: tab delimited .txt file with film material data
+        substrate_file_name: tab delimited .txt file with substrate material data
+        cache_file_name: name of the .npz cache file
+        max_tolerance: largest tolerance the cache can answer
+        chunk_pairs: maximum number of film/substrate pairs per block
+        jobs: number of worker processes
+    Returns:
+        (records, critical): the cached matches in output order and their
+        critical values.
+    """
+    film_database = load_catalog(film_file_name)
+    substrate_database = load_catalog(substrate_file_name)
+    blocks = list(parallel_match_blocks(film_database, substrate_database, max_tolerance, chunk_pairs, jobs))
+    records = concatenate_records([block[0] for block in blocks])
+    if records is None:
+        records = lattice_match_records([], "", [], "", [numpy.zeros(0)]*3)
+    critical = numpy.concatenate([block[1] for block in blocks]) if blocks else numpy.zeros(0)
+    numpy.savez(cache_file_name, records=records, critical=critical, max_tolerance=max_tolerance,
+                film_hash=file_hash(film_file_name), substrate_hash=file_hash(substrate_file_name))
+    return records, critical
+
+def load_mismatch_cache(film_file_name, substrate_file_name, cache_file_name, tolerance, max_tolerance, chunk_pairs=2**20, jobs=1):
+    """Loads the mismatch cache of a film and substrate database, rebuilding it
+    when the databases changed or it cannot answer the tolerance.
+
+    Args:
+        film_file_name, substrate_file_name: the tab delimited databases
+        cache_file_name: name of the .npz cache file
+        tolerance: tolerance that will be queried
+        max_tolerance: largest tolerance of a rebuilt cache, raised to the
+                       tolerance if that is larger
+        chunk_pairs: maximum number of film/substrate pairs per block
+        jobs: number of worker processes for a rebuild
+    Returns:
+        (records, critical) as returned by build_mismatch_cache().
+    """
+    if os.path.exists(cache_file_name):
+        with numpy.load(cache_file_name) as cache:
+            if (str(cache["film_hash"]) == file_hash(film_file_name) and str(cache["substrate_hash"]) == file_hash(substrate_file_name)
+                    and tolerance <= float(cache["max_tolerance"])):
+                return cache["records"], cache["critical"]
+    return build_mismatch_cache(film_file_name, substrate_file_name, cache_file_name, max(tolerance, max_tolerance), chunk_pairs, jobs)
+
+def query_mismatch_cache(records, critical, tolerance, match_writer):
+    """Writes the cached matches that pass a tolerance, in output order."""
+    match_writer.write(records[critical < tolerance])
+
+def incremental_match_records(film_database, substrate_database, tolerance, store_file_name, chunk_pairs=2**20, jobs=1, engine="indexed", stats=None):
+    """All matches of a full run, computing only the pairs of film or
+    substrate rows that are not in a result store (see result_store.py) yet.
+
+    New films are matched against all substrates and the stored films against
+    the new substrates. Stored matches of rows that are gone are dropped and
+    the store is saved again.
+
+    Args:
+        film_database: structured array of film materials (material_catalog.py)
+        substrate_database: structured array of substrate materials
+        tolerance: tolerance level for mismatch as a decimal
+        store_file_name: name of the .npz result store
+        chunk_pairs, jobs, engine, stats: as for parallel_match_blocks()
+    Returns:
+        (records, critical) of all matches in output order.
+    """
+    film_database = numpy.atleast_1d(film_database)
+    substrate_database = numpy.atleast_1d(substrate_database)
+    film_hashes = row_hashes(*database_columns(film_database))
+    sub_hashes = row_hashes(*database_columns(substrate_database))
+    film_digests, film_first, film_numbers = unique_rows(film_hashes)
+    sub_digests, sub_first, sub_numbers = unique_rows(sub_hashes)
+    settings = {"tolerance": tolerance}
+    store = load_store(store_file_name, settings)
+    if store is None:
+        store = {"records": lattice_match_records([], "", [], "", [numpy.zeros(0)]*3), "critical": numpy.zeros(0),
+                 "substrate_hash": numpy.zeros(0, dtype="S20"), "film_hash": numpy.zeros(0, dtype="S20"),
+                 "rank": numpy.zeros(0, dtype=numpy.intp), "film_digests": numpy.zeros(0, dtype="S20"),
+                 "substrate_digests": numpy.zeros(0, dtype="S20")}
+    known_films = numpy.isin(film_digests, store["film_digests"])
+    known_subs = numpy.isin(sub_digests, store["substrate_digests"])
+    keep = numpy.isin(store["film_hash"], film_digests) & numpy.isin(store["substrate_hash"], sub_digests)
+    parts = [(store["records"][keep], store["critical"][keep], store["substrate_hash"][keep], store["film_hash"][keep], store["rank"][keep])]
+    # new films against all substrates, stored films against new substrates
+    for films, subs in ((film_first[~known_films], sub_first), (film_first[known_films], sub_first[~known_subs])):
+        if len(films) == 0 or len(subs) == 0:
+            continue
+        for records, critical, sub_rows, film_rows in parallel_match_blocks(film_database[films], substrate_database[subs], tolerance,
+                                                                            chunk_pairs, jobs, engine, stats, pair_rows=True):
+            # blocks hold whole substrates, so the matches of a pair are consecutive
+            rank = within_group_rank(sub_rows*len(films) + film_rows)
+            parts.append((records, critical, sub_hashes[subs[sub_rows]], film_hashes[films[film_rows]], rank))
+    records = concatenate_records([part[0] for part in parts])
+    critical, sub_hash, film_hash, rank = [numpy.concatenate([part[k] for part in parts]) for k in range(1, 5)]
+    save_store(store_file_name, settings, {"records": records, "critical": critical, "substrate_hash": sub_hash, "film_hash": film_hash,
+                                           "rank": rank, "film_digests": film_digests, "substrate_digests": sub_digests})
+    # one copy of every match for each pair of rows with its content, in output order
+    matches, sub_rows = expand_to_rows(digest_numbers(sub_digests, sub_hash), sub_numbers)
+    copies, film_rows = expand_to_rows(digest_numbers(film_digests, film_hash)[matches], film_numbers)
+    matches, sub_rows = matches[copies], sub_rows[copies]
+    order = numpy.lexsort((rank[matches], film_rows, sub_rows))
+    return records[matches[order]], critical[matches[order]]
@@ -0,0 +1,579 @@
+#!/usr/bin/env python
+###############################################################################
+##                              Match Output                                 ##
+###############################################################################
+"""Bulk output of lattice_matcher.py and composition_calculator.py matches.
+
+Matches are collected as numpy structured arrays and written a batch at a
+time, either as the tab delimited text both tools have always written or as
+structured arrays in .npy/.npz files that can be loaded without parsing.
+
+Text is produced column by column: every distinct value of a column is
+formatted once and the columns are joined with numpy.char, instead of one
+str.format call per match. Text files are written with large buffers and can
+be compressed with gzip or xz. BackgroundMatchWriter formats and writes the
+batches on a thread of its own, so the matching does not wait for the output.
+"""
+import gzip
+import io
+import lzma
+import os
+import queue
+import shutil
+import threading
+import zipfile
+import numpy
+
+
+LATTICE_HEADER = "#Film\tSymmetry\tSubstrate\tSymmetry\tMismatch\tRounded Ratio\tOriginal Ratio\tC Mismatch\tC Rounded Ratio\tC Original Ratio\n"
+SUPERCELL_HEADER = "#Film\tSymmetry\tSubstrate\tSymmetry\tMismatch\tFilm Cells\tSubstrate Cells\tOriginal Ratio\tC Mismatch\tC Film Cells\tC Substrate Cells\tC Original Ratio\n"
+COMPOSITION_HEADER = "#Film Composition\tFilm Symmetry\tFlim a\tSubstrate\tSymmetry\n"
+PAIR_HEADER = "#Tensile Composition\tTensile a\tCompressive Composition\tCompressive a\tFilm Symmetry\tAverage a\tMismatch\tSubstrate\tSymmetry\n"
+
+#composition columns of composition_calculator.py results and their labels
+COMPOSITION_FIELDS = [("x_Al", "Al"), ("x_Ga", "Ga"), ("x_In", "In"), ("y_P", "P"), ("y_As", "As"), ("y_Sb", "Sb")]
+
+OUTPUT_FORMATS = ("tsv", "npy", "npz")
+
+#compressions of text output and the suffixes they add to the file name
+COMPRESSIONS = {"none": "", "gzip": ".gz", "xz": ".xz"}
+
+#compression levels of text output, xz preset 1 compresses match text as fast
+#as gzip level 6 and to about half the size, the default preset 6 is 40 times slower
+COMPRESSION_LEVELS = {"gzip": 6, "xz": 1}
+
+#buffer size of text output files in bytes
+WRITE_BUFFER = 2**22
+
+#batches of match records that may wait for the writer thread
+WRITE_QUEUE = 8
+
+def string_dtype(values):
+    """Smallest unicode dtype holding all values (at least one character)."""
+    values = numpy.asarray(values, dtype=str)
+    return numpy.dtype("U{}".format(max(1, values.dtype.itemsize // 4)))
+
+def lattice_match_records(film, film_symmetry, substrate, substrate_symmetry, columns):
+    """Builds the structured array of lattice_matcher.py matches.
+
+    Args:
+        film, substrate: composition arrays of the matched pairs
+        film_symmetry, substrate_symmetry: symmetry labels, arrays or strings
+        columns: (mismatch, ratio, original ratio[, c mismatch, c ratio,
+                 c original ratio]) arrays
+    Returns:
+        A structured array with the fields film, film_symmetry, substrate,
+        substrate_symmetry, mismatch, ratio, original_ratio, c_mismatch,
+        c_ratio, c_original_ratio and has_c. The c fields are NaN and has_c
+        is False for rules without a c-axis comparison.
+    """
+    count = len(columns[0])
+    film_symmetry = numpy.broadcast_to(film_symmetry, (count,))
+    substrate_symmetry = numpy.broadcast_to(substrate_symmetry, (count,))
+    dtype = numpy.dtype([("film", string_dtype(film)), ("film_symmetry", string_dtype(film_symmetry)),
+                         ("substrate", string_dtype(substrate)), ("substrate_symmetry", string_dtype(substrate_symmetry)),
+                         ("mismatch", "f8"), ("ratio", "f8"), ("original_ratio", "f8"),
+                         ("c_mismatch", "f8"), ("c_ratio", "f8"), ("c_original_ratio", "f8"), ("has_c", "?")])
+    records = numpy.empty(count, dtype=dtype)
+    records["film"] = film
+    records["film_symmetry"] = film_symmetry
+    records["substrate"] = substrate
+    records["substrate_symmetry"] = substrate_symmetry
+    for name, column in zip(["mismatch", "ratio", "original_ratio", "c_mismatch", "c_ratio", "c_original_ratio"], columns):
+        records[name] = column
+    if len(columns) < 6:
+        for name in ["c_mismatch", "c_ratio", "c_original_ratio"]:
+            records[name] = numpy.nan
+    records["has_c"] = len(columns) == 6
+    return records
+
+def supercell_match_records(film, film_symmetry, substrate, substrate_symmetry, columns):
+    """Builds the structured array of lattice_matcher.py --supercell matches.
+
+    Args:
+        film, substrate: composition arrays of the matched pairs
+        film_symmetry, substrate_symmetry: symmetry labels, arrays or strings
+        columns: (mismatch, film cells, substrate cells, original ratio[,
+                 c mismatch, c film cells, c substrate cells, c original
+                 ratio]) arrays
+    Returns:
+        A structured array with the fields film, film_symmetry, substrate,
+        substrate_symmetry, mismatch, film_cells, substrate_cells,
+        original_ratio, the same four fields prefixed with c_ and has_c. The
+        c fields are NaN or 0 and has_c is False for orientations with one
+        interface direction.
+    """
+    count = len(columns[0])
+    film_symmetry = numpy.broadcast_to(film_symmetry, (count,))
+    substrate_symmetry = numpy.broadcast_to(substrate_symmetry, (count,))
+    dtype = numpy.dtype([("film", string_dtype(film)), ("film_symmetry", string_dtype(film_symmetry)),
+                         ("substrate", string_dtype(substrate)), ("substrate_symmetry", string_dtype(substrate_symmetry)),
+                         ("mismatch", "f8"), ("film_cells", "i8"), ("substrate_cells", "i8"), ("original_ratio", "f8"),
+                         ("c_mismatch", "f8"), ("c_film_cells", "i8"), ("c_substrate_cells", "i8"), ("c_original_ratio", "f8"), ("has_c", "?")])
+    records = numpy.zeros(count, dtype=dtype)
+    records["film"] = film
+    records["film_symmetry"] = film_symmetry
+    records["substrate"] = substrate
+    records["substrate_symmetry"] = substrate_symmetry
+    names = ["mismatch", "film_cells", "substrate_cells", "original_ratio", "c_mismatch", "c_film_cells", "c_substrate_cells", "c_original_ratio"]
+    for name, column in zip(names, columns):
+        records[name] = column
+    if len(columns) < 8:
+        records["c_mismatch"] = numpy.nan
+        records["c_original_ratio"] = numpy.nan
+    records["has_c"] = len(columns) == 8
+    return records
+
+def composition_match_records(rows, film_symmetry, substrate, substrate_symmetry, fields=None):
+    """Builds the structured array of composition_calculator.py matches.
+
+    Args:
+        rows: (n, len(fields) + 1) array of composition columns and a, e.g.
+              x_Al, x_Ga, x_In, y_P, y_As, y_Sb, a
+        film_symmetry: film symmetry label of the orientation, e.g. "C (45deg)"
+        substrate, substrate_symmetry: substrate composition and symmetry
+        fields: field names of the composition columns, <prefix>_<species>,
+                the III-V fields of COMPOSITION_FIELDS if not given
+    Returns:
+        A structured array with one float32 field per composition column, a
+        float32 field a and the string fields film_symmetry, substrate and
+        substrate_symmetry.
+    """
+    if fields is None:
+        fields = [name for name, label in COMPOSITION_FIELDS]
+    rows = numpy.asarray(rows)
+    count = len(rows)
+    film_symmetry = numpy.broadcast_to(film_symmetry, (count,))
+    substrate = numpy.broadcast_to(substrate, (count,))
+    substrate_symmetry = numpy.broadcast_to(substrate_symmetry, (count,))
+    dtype = numpy.dtype([(name, "f4") for name in fields] + [("a", "f4"),
+                        ("film_symmetry", string_dtype(film_symmetry)), ("substrate", string_dtype(substrate)),
+                        ("substrate_symmetry", string_dtype(substrate_symmetry))])
+    records = numpy.empty(count, dtype=dtype)
+    for k, name in enumerate(fields):
+        records[name] = rows[:, k]
+    records["a"] = rows[:, len(fields)]
+    records["film_symmetry"] = film_symmetry
+    records["substrate"] = substrate
+    records["substrate_symmetry"] = substrate_symmetry
+    return records
+
+def pair_match_records(tensile, compressive, film_symmetry, substrate, substrate_symmetry, average, mismatch, fields=None):
+    """Builds the structured array of composition_calculator.py --pairs
+    matches.
+
+    Args:
+        tensile, compressive: (n, len(fields) + 1) arrays of the composition
+                              columns and a of the two layers of every pair
+        film_symmetry, substrate, substrate_symmetry, fields: as for
+                                                        composition_match_records()
+        average: thickness weighted average lattice constant of every pair
+        mismatch: average/a_substrate - 1 of every pair, a_substrate times
+                  the factor of the orientation
+    Returns:
+        A structured array with the fields of composition_match_records() for
+        the tensile and the compressive layer, prefixed with tensile_ and
+        compressive_, followed by film_symmetry, float64 average_a and
+        mismatch, substrate and substrate_symmetry.
+    """
+    if fields is None:
+        fields = [name for name, label in COMPOSITION_FIELDS]
+    count = len(average)
+    film_symmetry = numpy.broadcast_to(film_symmetry, (count,))
+    substrate = numpy.broadcast_to(substrate, (count,))
+    substrate_symmetry = numpy.broadcast_to(substrate_symmetry, (count,))
+    layers = [("tensile_", numpy.asarray(tensile)), ("compressive_", numpy.asarray(compressive))]
+    dtype = numpy.dtype([(prefix + name, "f4") for prefix, rows in layers for name in list(fields) + ["a"]]
+                        + [("film_symmetry", string_dtype(film_symmetry)), ("average_a", "f8"), ("mismatch", "f8"),
+                           ("substrate", string_dtype(substrate)), ("substrate_symmetry", string_dtype(substrate_symmetry))])
+    records = numpy.empty(count, dtype=dtype)
+    for prefix, rows in layers:
+        for k, name in enumerate(list(fields) + ["a"]):
+            records[prefix + name] = rows[:, k]
+    records["film_symmetry"] = film_symmetry
+    records["average_a"] = average
+    records["mismatch"] = mismatch
+    records["substrate"] = substrate
+    records["substrate_symmetry"] = substrate_symmetry
+    return records
+
+def concatenate_records(batches):
+    """Concatenates structured arrays whose string fields differ in width."""
+    batches = [batch for batch in batches if batch is not None]
+    if not batches:
+        return None
+    fields = []
+    for name in batches[0].dtype.names:
+        dtypes = [batch.dtype[name] for batch in batches]
+        if dtypes[0].kind == "U":
+            fields.append((name, max(dtypes, key=lambda dtype: dtype.itemsize)))
+        else:
+            fields.append((name, dtypes[0]))
+    dtype = numpy.dtype(fields)
+    return numpy.concatenate([batch.astype(dtype) for batch in batches])
+
+def format_unique(values, formatter):
+    """Formats every distinct value once and returns a string per value."""
+    values = numpy.asarray(values)
+    if len(values) == 0:
+        return numpy.zeros(0, dtype="U1")
+    unique, inverse = numpy.unique(values, return_inverse=True)
+    return numpy.array([formatter(value) for value in unique.tolist()])[inverse.ravel()]
+
+def format_floats(values):
+    """Strings of float64 values as "{}".format() writes them."""
+    return numpy.array(list(map(repr, numpy.asarray(values, dtype=numpy.float64).tolist())), dtype=str)
+
+def format_ratios(ratio, original_ratio):
+    """Strings of rounded ratios as orientation_rules.round_ratio() values print:
+    integers for ratios of at least one and fractions 1/n otherwise."""
+    fraction = numpy.asarray(original_ratio) < 1
+    keys = numpy.where(fraction, -numpy.asarray(ratio), ratio) # fractions are positive, so the sign tags them
+    def formatter(key):
+        if not numpy.isfinite(key):
+            return repr(abs(key))
+        return repr(-key) if key < 0 or (key == 0 and numpy.signbit(key)) else "{}".format(int(key))
+    return format_unique(keys, formatter)
+
+def join_columns(columns):
+    """Joins string columns with tabs, one line per row without newline."""
+    lines = columns[0]
+    for column in columns[1:]:
+        lines = numpy.char.add(numpy.char.add(lines, "\t"), column)
+    return lines
+
+def join_lines(lines):
+    """Text of an array of lines."""
+    return "".join(numpy.char.add(lines, "\n").tolist())
+
+def format_lattice_matches(records):
+    """Tab delimited lines of lattice matches, identical to the lines of the
+    per-pair functions of lattice_matcher.py."""
+    if len(records) == 0:
+        return ""
+    lines = join_columns([records["film"], records["film_symmetry"], records["substrate"], records["substrate_symmetry"],
+                          format_floats(records["mismatch"]), format_ratios(records["ratio"], records["original_ratio"]),
+                          format_floats(records["original_ratio"])])
+    has_c = numpy.flatnonzero(records["has_c"])
+    if len(has_c):
+        part = records[has_c]
+        c_columns = numpy.char.add("\t", join_columns([format_floats(part["c_mismatch"]),
+                                                        format_ratios(part["c_ratio"], part["c_original_ratio"]),
+                                                        format_floats(part["c_original_ratio"])]))
+        c_text = numpy.zeros(len(records), dtype=c_columns.dtype)
+        c_text[has_c] = c_columns
+        lines = numpy.char.add(lines, c_text)
+    return join_lines(lines)
+
+def format_supercell_matches(records):
+    """Tab delimited lines of lattice_matcher.py --supercell matches."""
+    if len(records) == 0:
+        return ""
+    lines = join_columns([records["film"], records["film_symmetry"], records["substrate"], records["substrate_symmetry"],
+                          format_floats(records["mismatch"]), records["film_cells"].astype(str),
+                          records["substrate_cells"].astype(str), format_floats(records["original_ratio"])])
+    has_c = numpy.flatnonzero(records["has_c"])
+    if len(has_c):
+        part = records[has_c]
+        c_columns = numpy.char.add("\t", join_columns([format_floats(part["c_mismatch"]), part["c_film_cells"].astype(str),
+                                                        part["c_substrate_cells"].astype(str), format_floats(part["c_original_ratio"])]))
+        c_text = numpy.zeros(len(records), dtype=c_columns.dtype)
+        c_text[has_c] = c_columns
+        lines = numpy.char.add(lines, c_text)
+    return join_lines(lines)
+
+def format_compositions(records, decimals=2, prefix=""):
+    """Composition strings such as Al0.00Ga0.50In0.50P0.00As1.00Sb0.00, the
+    species of every composition field before a followed by its amount.
+    With a prefix only the fields starting with it are used, e.g. tensile_ for
+    the tensile layers of pair_match_records()."""
+    names = [name[len(prefix):] for name in records.dtype.names if name.startswith(prefix)]
+    composition = None
+    for name in names[:names.index("a")]:
+        label = name.split("_", 1)[-1]
+        column = numpy.char.add(label, format_unique(records[prefix + name], lambda value: "{0:.{1}f}".format(value, decimals)))
+        composition = column if composition is None else numpy.char.add(composition, column)
+    return composition
+
+def format_lattice_constants(values):
+    """Strings of float32 lattice constants as composition_calculator.py
+    writes them, rounded to 4 decimals."""
+    return format_unique(numpy.round(values, 4), lambda value: repr(value))
+
+def format_composition_matches(records, decimals=2):
+    """Tab delimited lines of composition matches, identical to the lines of
+    composition_calculator.py."""
+    if len(records) == 0:
+        return ""
+    return join_lines(join_columns([format_compositions(records, decimals), records["film_symmetry"], format_lattice_constants(records["a"]),
+                                    records["substrate"], records["substrate_symmetry"]]))
+
+def format_pair_matches(records, decimals=2):
+    """Tab delimited lines of composition_calculator.py --pairs matches."""
+    if len(records) == 0:
+        return ""
+    return join_lines(join_columns([format_compositions(records, decimals, "tensile_"), format_lattice_constants(records["tensile_a"]),
+                                    format_compositions(records, decimals, "compressive_"), format_lattice_constants(records["compressive_a"]),
+                                    records["film_symmetry"], format_floats(records["average_a"]), format_floats(records["mismatch"]),
+                                    records["substrate"], records["substrate_symmetry"]]))
+
+class TextMatchWriter(object):
+    """Writes batches of match records as tab delimited text.
+
+    Args:
+        output_file: open text file, the header is written immediately
+        header: header line of the file
+        formatter: function turning a record array into text
+    """
+
+    def __init__(self, output_file, header, formatter):
+        self.output_file = output_file
+        self.formatter = formatter
+        output_file.write(header)
+
+    def write(self, records):
+        """Writes a batch and returns the written text."""
+        if records is not None and len(records):
+            text = self.formatter(records)
+            self.output_file.write(text)
+            return text
+        return ""
+
+    def close(self):
+        self.output_file.close()
+
+def ascii_records(records):
+    """Stores the unicode fields of a record array as one byte per character
+    when they are plain ASCII."""
+    fields = []
+    for name in records.dtype.names:
+        dtype = records.dtype[name]
+        if dtype.kind == "U":
+            try:
+                records[name].astype("S{}".format(dtype.itemsize // 4))
+                dtype = numpy.dtype("S{}".format(dtype.itemsize // 4))
+            except UnicodeEncodeError:
+                pass
+        fields.append((name, dtype))
+    return records.astype(fields)
+
+class BackgroundMatchWriter(object):
+    """Match writer passing the batches of records to another writer on a
+    thread of its own, so the matching goes on while earlier batches are
+    formatted, compressed and written. The batches are written in the order
+    they arrive. write() blocks while queue_size batches are waiting, which
+    bounds the memory they take.
+
+    Args:
+        writer: match writer the thread writes to
+        queue_size: batches that may wait, at least 1
+    """
+
+    def __init__(self, writer, queue_size=WRITE_QUEUE):
+        self.writer = writer
+        self.queue = queue.Queue(max(1, queue_size))
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name="match writer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        """Writes the queued batches until close(). After an error the
+        batches are dropped so write() does not block."""
+        while True:
+            records = self.queue.get()
+            if records is None:
+                return
+            if self.error is None:
+                try:
+                    self.writer.write(records)
+                except Exception as error:
+                    self.error = error
+
+    def raise_error(self):
+        """Raises the error of the thread, if there was one."""
+        if self.error is not None:
+            raise self.error
+
+    def write(self, records):
+        """Queues a batch, raises an earlier error of the thread."""
+        self.raise_error()
+        if records is not None and len(records):
+            self.queue.put(records)
+
+    def close(self):
+        """Waits for the queued batches to be written and closes the writer."""
+        self.queue.put(None)
+        self.thread.join()
+        self.writer.close()
+        self.raise_error()
+
+class RecordCollector(object):
+    """Writer that keeps the batches of match records in memory."""
+
+    def __init__(self):
+        self.batches = []
+
+    def write(self, records):
+        if records is not None and len(records):
+            self.batches.append(records)
+
+    def records(self):
+        """All collected records as one array, None if there are none."""
+        return concatenate_records(self.batches)
+
+    def close(self):
+        pass
+
+class BinaryMatchWriter(object):
+    """Writes batches of match records as one structured array to a .npy
+    file, or to the member "matches" of a compressed .npz file, as they
+    arrive, so the records are never all held in memory. ASCII text fields
+    are saved as bytes.
+
+    The rows go straight to the file and the shape in its header is filled in
+    on close. A batch with longer or non ASCII text rewrites the rows written
+    before it with the wider field, so the file holds the same array as if
+    all batches had been concatenated. An .npz member is compressed from a
+    temporary .npy file WRITE_BUFFER bytes at a time.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.npy_name = file_name + ".tmp.npy" if file_name.endswith(".npz") else file_name
+        self.output_file = open(self.npy_name, "wb")
+        self.dtype = None
+        self.header_size = 0
+        self.rows = 0
+
+    def merged_dtype(self, records):
+        """dtype of the file after writing records, the unicode fields as
+        wide as the widest value so far and as bytes while all are ASCII."""
+        fields = []
+        for name in (records.dtype.names if self.dtype is None else self.dtype.names):
+            dtype = records.dtype[name]
+            current = None if self.dtype is None else self.dtype[name]
+            if dtype.kind == "U":
+                width = dtype.itemsize // 4
+                try:
+                    records[name].astype("S{}".format(width))
+                    ascii = True
+                except UnicodeEncodeError:
+                    ascii = False
+                if current is not None:
+                    width = max(width, current.itemsize // (1 if current.kind == "S" else 4))
+                    ascii = ascii and current.kind == "S"
+                dtype = numpy.dtype("{}{}".format("S" if ascii else "U", width))
+            elif current is not None:
+                dtype = current
+            fields.append((name, dtype))
+        return numpy.dtype(fields)
+
+    def write_header(self, output_file, dtype, rows):
+        """Writes the .npy header numpy.save() writes for rows records."""
+        header = {"descr": numpy.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": (rows,)}
+        try:
+            numpy.lib.format.write_array_header_1_0(output_file, header)
+        except ValueError:
+            numpy.lib.format.write_array_header_2_0(output_file, header)
+
+    def rewrite(self, dtype):
+        """Copies the rows written so far to a new file with dtype and a
+        header holding their number."""
+        self.output_file.close()
+        old_rows = numpy.memmap(self.npy_name, dtype=self.dtype, mode="r", offset=self.header_size, shape=(self.rows,))
+        temporary_name = self.npy_name + ".tmp"
+        with open(temporary_name, "wb") as output_file:
+            self.write_header(output_file, dtype, self.rows)
+            header_size = output_file.tell()
+            step = max(1, WRITE_BUFFER // self.dtype.itemsize)
+            for start in range(0, self.rows, step):
+                output_file.write(old_rows[start:start + step].astype(dtype).tobytes())
+        del old_rows
+        os.replace(temporary_name, self.npy_name)
+        self.output_file = open(self.npy_name, "r+b")
+        self.output_file.seek(0, os.SEEK_END)
+        self.dtype = dtype
+        self.header_size = header_size
+
+    def write(self, records):
+        if records is None or not len(records):
+            return
+        dtype = self.merged_dtype(records)
+        if self.dtype is None:
+            self.write_header(self.output_file, dtype, 0)
+            self.dtype = dtype
+            self.header_size = self.output_file.tell()
+        elif dtype != self.dtype:
+            self.rewrite(dtype)
+        self.output_file.write(records.astype(dtype).tobytes())
+        self.rows += len(records)
+
+    def close(self):
+        self.output_file.close()
+        if self.dtype is None:
+            if self.npy_name != self.file_name:
+                os.remove(self.npy_name)
+                numpy.savez_compressed(self.file_name, matches=numpy.zeros(0))
+            else:
+                numpy.save(self.file_name, numpy.zeros(0))
+            return
+        header = io.BytesIO()
+        self.write_header(header, self.dtype, self.rows)
+        if header.tell() == self.header_size:
+            with open(self.npy_name, "r+b") as output_file:
+                output_file.write(header.getvalue())
+        else:
+            self.output_file = open(self.npy_name, "r+b")
+            self.rewrite(self.dtype)
+            self.output_file.close()
+        if self.npy_name != self.file_name:
+            with zipfile.ZipFile(self.file_name, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+                with archive.open("matches.npy", "w", force_zip64=True) as member, open(self.npy_name, "rb") as input_file:
+                    shutil.copyfileobj(input_file, member, WRITE_BUFFER)
+            os.remove(self.npy_name)
+
+def lattice_text_writer(output_file):
+    """TextMatchWriter for lattice_matcher.py results."""
+    return TextMatchWriter(output_file, LATTICE_HEADER, format_lattice_matches)
+
+def supercell_text_writer(output_file):
+    """TextMatchWriter for lattice_matcher.py --supercell results."""
+    return TextMatchWriter(output_file, SUPERCELL_HEADER, format_supercell_matches)
+
+def composition_text_writer(output_file, decimals=2):
+    """TextMatchWriter for composition_calculator.py results."""
+    return TextMatchWriter(output_file, COMPOSITION_HEADER, lambda records: format_composition_matches(records, decimals))
+
+def pair_text_writer(output_file, decimals=2):
+    """TextMatchWriter for composition_calculator.py --pairs results."""
+    return TextMatchWriter(output_file, PAIR_HEADER, lambda records: format_pair_matches(records, decimals))
+
+def output_file_name(label, output_format, compression="none"):
+    """Result file name for a label without extension, text compressed
+    with one of COMPRESSIONS gets its suffix."""
+    return label + (".txt" + COMPRESSIONS[compression] if output_format == "tsv" else "." + output_format)
+
+def open_text_output(file_name, compression="none"):
+    """Opens a text file for writing with a WRITE_BUFFER buffer, compressed
+    with one of COMPRESSIONS at its COMPRESSION_LEVELS. gzip files have no
+    time stamp, so the same matches give the same file."""
+    if compression == "gzip":
+        return io.TextIOWrapper(io.BufferedWriter(gzip.GzipFile(file_name, "wb", compresslevel=COMPRESSION_LEVELS["gzip"], mtime=0), WRITE_BUFFER))
+    if compression == "xz":
+        return io.TextIOWrapper(io.BufferedWriter(lzma.LZMAFile(file_name, "wb", preset=COMPRESSION_LEVELS["xz"]), WRITE_BUFFER))
+    return open(file_name, "w", buffering=WRITE_BUFFER)
+
+def open_match_writer(file_name, output_format, kind, decimals=2, compression="none"):
+    """Opens a writer for lattice ("lattice"), supercell ("supercell"),
+    composition ("composition") or composition pair ("pair") matches in one
+    of OUTPUT_FORMATS, tsv compressed with one of COMPRESSIONS."""
+    if output_format in ("npy", "npz"):
+        return BinaryMatchWriter(file_name)
+    if kind == "lattice":
+        return lattice_text_writer(open_text_output(file_name, compression))
+    if kind == "supercell":
+        return supercell_text_writer(open_text_output(file_name, compression))
+    if kind == "pair":
+        return pair_text_writer(open_text_output(file_name, compression), decimals)
+    return composition_text_writer(open_text_output(file_name, compression), decimals)
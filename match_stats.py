@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+###############################################################################
+##                               Match Statistics                            ##
+###############################################################################
+"""Opt-in counters of lattice_matcher.py and composition_calculator.py runs,
+written as a JSON file with --stats.
+
+The engines take an optional MatchStats and only count when they get one, so
+a run without --stats does the same work as before. The matches and written
+bytes are counted by StatsWriter, a wrapper of the match_output writers.
+"""
+import json
+import threading
+import time
+import numpy
+
+
+class MatchStats(object):
+    """Counters of a run, summed by table and key.
+
+    Attributes:
+        tables: dict of table name to a dict of key to a dict of counter name
+                to value. A key is a tuple of (field, value) pairs that
+                becomes the identifying fields of its report entry.
+        start: time.perf_counter() when the run started
+    """
+
+    def __init__(self):
+        self.tables = {}
+        self.start = time.perf_counter()
+        # a StatsWriter behind a match_output.BackgroundMatchWriter counts on the writer thread
+        self.lock = threading.Lock()
+
+    def add(self, table, key, **counters):
+        """Adds counters to the entry of key in table."""
+        with self.lock:
+            entry = self.tables.setdefault(table, {}).setdefault(key, {})
+            for name, value in counters.items():
+                if isinstance(value, numpy.generic):
+                    value = value.item()
+                entry[name] = entry.get(name, 0) + value
+
+    def merge(self, tables):
+        """Adds the tables of a MatchStats of a worker process."""
+        for table, entries in tables.items():
+            for key, counters in entries.items():
+                self.add(table, key, **counters)
+
+    def report(self, **settings):
+        """The settings, the total run time and one list of entries per table.
+        Counters an entry never got, e.g. the matches of a rule without any,
+        are reported as 0."""
+        report = dict(settings)
+        report["seconds"] = time.perf_counter() - self.start
+        for table, entries in sorted(self.tables.items()):
+            names = sorted(set(name for counters in entries.values() for name in counters))
+            report[table] = [dict(list(key) + [(name, counters.get(name, 0)) for name in names])
+                             for key, counters in sorted(entries.items())]
+        return report
+
+    def save(self, file_name, **settings):
+        """Writes report(**settings) as JSON."""
+        with open(file_name, "w") as stats_file:
+            json.dump(self.report(**settings), stats_file, indent=1)
+
+class StatsWriter(object):
+    """Match writer that counts the matches and written bytes of each
+    distinct combination of some record fields.
+
+    The bytes of text writers are the bytes of the written lines, for the
+    binary writers they are the in-memory size of the records.
+
+    Args:
+        writer: match_output writer receiving the records
+        stats: MatchStats to count into
+        table: table of the counters
+        fields: names of the record fields forming the key
+    """
+
+    def __init__(self, writer, stats, table, fields):
+        self.writer = writer
+        self.stats = stats
+        self.table = table
+        self.fields = list(fields)
+
+    def write(self, records):
+        if records is None or len(records) == 0:
+            return
+        start = time.perf_counter()
+        text = self.writer.write(records)
+        if isinstance(text, str):
+            # one line per record, the line ends give the bytes of each
+            ends = numpy.flatnonzero(numpy.frombuffer(text.encode("utf-8"), dtype=numpy.uint8) == ord("\n"))
+            sizes = numpy.diff(ends, prepend=-1)
+        else:
+            sizes = numpy.full(len(records), records.dtype.itemsize)
+        keys, inverse = numpy.unique(records[self.fields], return_inverse=True)
+        inverse = inverse.ravel()
+        matches = numpy.bincount(inverse, minlength=len(keys))
+        written = numpy.bincount(inverse, weights=sizes, minlength=len(keys))
+        for key, count, size in zip(keys.tolist(), matches.tolist(), written.tolist()):
+            self.stats.add(self.table, tuple(zip(self.fields, key)), matches=count, bytes_written=int(size))
+        self.stats.add("output", (), matches=len(records), bytes_written=int(sizes.sum()), seconds=time.perf_counter() - start)
+
+    def close(self):
+        self.writer.close()
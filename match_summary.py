@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+###############################################################################
+##                         Composition Match Summaries                       ##
+###############################################################################
+"""Aggregated output of composition_calculator.py --summary.
+
+At wide tolerances a substrate matches millions of nearly identical
+compositions. CompositionSummary is a match writer that folds each batch of
+records into fixed size statistics per substrate and orientation instead of
+writing them:
+    matches           number of matching compositions
+    mismatch_counts   histogram of a/a_substrate - 1 in equal bins from
+                      -tolerance to +tolerance
+    a                 smallest and largest matching lattice constant
+    fractions         smallest and largest fraction of every species
+    families          matches per family, the species present in a
+                      composition (e.g. GaInAs, AlGaInPAs), most common first
+    representatives   per bin the compositions closest to the bin center,
+                      ties broken by composition
+The summary does not depend on the order the records arrive in, so every
+mode of composition_calculator.py gives the same file, and its size does not
+depend on the number of matches.
+"""
+import json
+import numpy
+from match_output import concatenate_records, format_compositions
+
+
+class SummaryGroup(object):
+    """Running statistics of the matches of one substrate and orientation.
+
+    Attributes:
+        target: lattice constant the orientation matches, a_substrate*factor
+        matches: number of matches
+        counts: int64 matches per mismatch bin
+        low, high: smallest and largest value of every composition field and a
+        families: dict of species bit mask to matches
+        representatives: records of the representative candidates or None
+    """
+
+    def __init__(self, target, bins):
+        self.target = target
+        self.matches = 0
+        self.counts = numpy.zeros(bins, dtype=numpy.int64)
+        self.low = self.high = None
+        self.families = {}
+        self.representatives = None
+
+class CompositionSummary(object):
+    """Match writer summarizing composition matches, see the module
+    documentation.
+
+    Args:
+        file_name: JSON file written when the summary is closed
+        targets: dict of (substrate, substrate symmetry, film symmetry) to the
+                 lattice constant that orientation matches, the order of the
+                 summary entries
+        tolerance: tolerance of the run, the range of the histogram
+        bins: number of mismatch bins
+        representatives: compositions kept per bin
+        decimals: decimals of the composition strings
+    """
+
+    def __init__(self, file_name, targets, tolerance, bins=20, representatives=3, decimals=2):
+        self.file_name = file_name
+        self.tolerance = tolerance
+        self.edges = numpy.linspace(-tolerance, tolerance, bins + 1)
+        self.representatives = representatives
+        self.decimals = decimals
+        self.fields = None
+        self.groups = dict((key, SummaryGroup(target, bins)) for key, target in targets.items())
+
+    def write(self, records):
+        """Adds a batch of match records to the statistics of their groups."""
+        if records is None or len(records) == 0:
+            return
+        if self.fields is None:
+            names = records.dtype.names
+            self.fields = names[:names.index("a")]
+        key_fields = ["substrate", "substrate_symmetry", "film_symmetry"]
+        if all((records[name] == records[name][0]).all() for name in key_fields):
+            # the batches of check_substrate_file() hold one orientation of one substrate
+            self.add_group(self.groups[tuple(str(records[name][0]) for name in key_fields)], records)
+            return
+        keys, inverse = numpy.unique(records[key_fields], return_inverse=True)
+        inverse = inverse.ravel()
+        order = numpy.argsort(inverse, kind="stable")
+        ends = numpy.cumsum(numpy.bincount(inverse, minlength=len(keys)))
+        for key, start, end in zip(keys.tolist(), ends - numpy.bincount(inverse, minlength=len(keys)), ends):
+            self.add_group(self.groups[tuple(key)], records[order[start:end]])
+
+    def add_group(self, group, records):
+        """Folds the records of one group into its statistics."""
+        bins, distance = self.bin_distance(group, records)
+        group.matches += len(records)
+        group.counts += numpy.bincount(bins, minlength=len(group.counts))
+        low = numpy.array([records[name].min() for name in self.fields + ("a",)])
+        high = numpy.array([records[name].max() for name in self.fields + ("a",)])
+        group.low = low if group.low is None else numpy.minimum(group.low, low)
+        group.high = high if group.high is None else numpy.maximum(group.high, high)
+        # bit k of the family mask is set if species k is present
+        masks = numpy.zeros(len(records), dtype=numpy.int64)
+        for k, name in enumerate(self.fields):
+            masks |= (records[name] > 0).astype(numpy.int64) << k
+        if len(self.fields) <= 16:
+            counts = numpy.bincount(masks)
+            present = numpy.flatnonzero(counts)
+            counts = counts[present]
+        else:
+            present, counts = numpy.unique(masks, return_counts=True)
+        for mask, count in zip(present.tolist(), counts.tolist()):
+            group.families[mask] = group.families.get(mask, 0) + count
+        if self.representatives:
+            candidates = records[self.candidates(bins, distance)]
+            group.representatives = self.closest(group, concatenate_records([group.representatives, candidates]))
+
+    def bin_distance(self, group, records):
+        """(bin, distance of the mismatch to the bin center) of records, the
+        mismatch computed as composition_calculator.top_k_sub() does."""
+        mismatch = records["a"].astype(numpy.float64)/group.target - 1
+        bins = numpy.clip(numpy.searchsorted(self.edges, mismatch, side="right") - 1, 0, len(self.edges) - 2)
+        return bins, abs(mismatch - (self.edges[bins] + self.edges[bins + 1])/2)
+
+    def candidates(self, bins, distance):
+        """Mask of the records that may be among the representatives of their
+        bin: those no farther from the bin center than the representatives-th
+        closest of the batch."""
+        order = numpy.argsort(bins, kind="stable")
+        counts = numpy.bincount(bins, minlength=len(self.edges) - 1)
+        ends = numpy.cumsum(counts)
+        # distance of the last representative of every bin, ties are kept
+        limit = numpy.full(len(counts), numpy.inf)
+        for b in numpy.flatnonzero(counts > self.representatives):
+            segment = distance[order[ends[b] - counts[b]:ends[b]]]
+            limit[b] = numpy.partition(segment, self.representatives - 1)[self.representatives - 1]
+        return distance <= limit[bins]
+
+    def closest(self, group, records):
+        """The representatives of every bin among records, closest to the bin
+        center first, ties in composition order."""
+        bins, distance = self.bin_distance(group, records)
+        order = numpy.lexsort(tuple(records[name] for name in reversed(self.fields)) + (distance, bins))
+        starts = numpy.searchsorted(bins[order], bins[order], side="left")
+        return records[order[numpy.arange(len(order)) - starts < self.representatives]]
+
+    def report(self):
+        """The summary as a JSON serializable dict."""
+        labels = [name.split("_", 1)[-1] for name in self.fields or ()]
+        entries = []
+        for (substrate, substrate_symmetry, film_symmetry), group in self.groups.items():
+            entry = {"substrate": substrate, "substrate_symmetry": substrate_symmetry, "film_symmetry": film_symmetry,
+                     "target_a": float(group.target), "matches": group.matches, "mismatch_counts": group.counts.tolist()}
+            if group.matches:
+                entry["a"] = [float(group.low[-1]), float(group.high[-1])]
+                entry["fractions"] = dict((label, [round(float(low), self.decimals), round(float(high), self.decimals)])
+                                          for label, low, high in zip(labels, group.low, group.high))
+                families = sorted(group.families.items(), key=lambda item: (-item[1], item[0]))
+                entry["families"] = [{"family": "".join(label for k, label in enumerate(labels) if mask >> k & 1), "matches": count}
+                                     for mask, count in families]
+                entry["representatives"] = [[] for b in range(len(self.edges) - 1)]
+                if group.representatives is not None:
+                    bins, distance = self.bin_distance(group, group.representatives)
+                    compositions = format_compositions(group.representatives, self.decimals)
+                    for k, a in enumerate(group.representatives["a"].tolist()):
+                        entry["representatives"][bins[k]].append({"composition": str(compositions[k]), "a": a, "mismatch": a/group.target - 1})
+            entries.append(entry)
+        return {"tolerance": self.tolerance, "bin_edges": self.edges.tolist(), "substrates": entries}
+
+    def close(self):
+        """Writes report() as JSON."""
+        with open(self.file_name, "w") as summary_file:
+            json.dump(self.report(), summary_file, indent=1)
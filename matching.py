@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+###############################################################################
+##                                Matching API                               ##
+###############################################################################
+"""Library interface of lattice_matcher.py and composition_calculator.py for
+use from a long running Python process, a notebook or a test.
+
+    import matching
+    matches = matching.match("cubic.txt", "hexagonal.txt", 0.05)
+    compositions = matching.compositions_for(("GaAs", "C", 5.6533, 0.0), "iii_v.npz")
+
+Material files and composition databases are read once and reused by later
+calls until the file changes on disk, so repeated queries only pay for the
+matching. Results are the structured arrays of match_output.py, with the same
+rows in the same order as the files the command line tools write.
+
+The caches may be used from several threads (see matching_server.py). The
+matching modules are imported on first use, importing this module only loads
+numpy.
+"""
+import os
+import threading
+import numpy
+
+
+#loaded files by absolute path: (size, mtime, contents)
+_materials = {}
+_databases = {}
+#held to look up and store cache entries, never while loading
+_cache_lock = threading.Lock()
+#lock of every cache entry, held while it is loaded so it is loaded once
+_entry_locks = {}
+
+def file_stamp(file_name):
+    """(size, modification time) of a file, used to notice changes."""
+    stat = os.stat(file_name)
+    return stat.st_size, stat.st_mtime_ns
+
+def cached_value(cache, key, stamp, loader):
+    """The value cached under key, calling loader() for it when it is
+    missing or was stored with another stamp.
+
+    Only the entry being loaded is locked: queries of other entries, loaded
+    or not, go on while it loads, and concurrent queries of it wait for the
+    one load.
+    """
+    with _cache_lock:
+        entry = cache.get(key)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+        entry_lock = _entry_locks.setdefault((id(cache), key), threading.Lock())
+    with entry_lock:
+        with _cache_lock:
+            entry = cache.get(key)
+        if entry is None or entry[0] != stamp:
+            entry = (stamp, loader())
+            with _cache_lock:
+                cache[key] = entry
+        return entry[1]
+
+def cached_load(cache, file_name, loader):
+    """Returns loader(file_name), loading again only if the file changed."""
+    path = os.path.abspath(file_name)
+    return cached_value(cache, path, file_stamp(path), lambda: loader(path))
+
+def clear_cache():
+    """Forgets all loaded material files and databases."""
+    with _cache_lock:
+        _materials.clear()
+        _databases.clear()
+
+def loaded_files():
+    """Paths of the loaded material files and databases as a dict."""
+    with _cache_lock:
+        return {"materials": sorted(_materials), "databases": sorted(key for key in _databases if isinstance(key, str))}
+
+def read_materials(file_name):
+    """Reads a tab delimited material file as the command line tools do."""
+    from material_catalog import load_catalog
+    return load_catalog(file_name)
+
+def load_materials(materials):
+    """Structured array of materials.
+
+    Args:
+        materials: name of a tab delimited material file, a structured array
+                   with composition, symmetry, a and c fields, or a single
+                   (composition, symmetry, a, c) tuple
+    Returns:
+        A one dimensional structured array.
+    """
+    if isinstance(materials, str):
+        return cached_load(_materials, materials, read_materials)
+    if isinstance(materials, tuple):
+        from material_catalog import catalog_dtype
+        composition, symmetry, a, c = materials
+        return numpy.array([(composition, symmetry, a, c)], dtype=catalog_dtype(len(composition), len(symmetry)))
+    return numpy.atleast_1d(materials)
+
+def read_composition_database(file_name):
+    """(lattice constants, LatticeIndex) of a composition database file."""
+    import composition_calculator
+    from composition_database import load_database
+    lattice_consts = load_database(file_name)
+    return lattice_consts, composition_calculator.load_lattice_index(file_name, lattice_consts)
+
+def load_composition_database(database):
+    """Composition database, its index and the decimals of its compositions.
+
+    Args:
+        database: a .npz or compact database file name, an array of rows
+                  x_Al, x_Ga, x_In, y_P, y_As, y_Sb, a, a
+                  composition_database.NamedDatabase, or a composition
+                  step in percent, which uses an IsoLatticeSolver instead of
+                  a database
+    Returns:
+        (lattice_consts, index, decimals) for check_substrate_file().
+    """
+    import composition_calculator
+    if isinstance(database, str):
+        lattice_consts, index = cached_load(_databases, database, read_composition_database)
+        return lattice_consts, index, getattr(lattice_consts, "decimals", 2)
+    if isinstance(database, (int, float)):
+        solver = cached_value(_databases, ("resolution", database), None, lambda: composition_calculator.IsoLatticeSolver(database))
+        return solver, None, solver.decimals
+    return database, composition_calculator.LatticeIndex.build(database), getattr(database, "decimals", 2)
+
+def match(films, substrates, tolerance, engine="indexed", jobs=1, chunk_pairs=2**20, top_k=None):
+    """Lattice matches of films on substrates.
+
+    Args:
+        films, substrates: materials as accepted by load_materials()
+        tolerance: tolerance level for mismatch as a decimal
+        engine: "indexed" or "vectorized", see lattice_matcher.py
+        jobs: number of worker processes
+        chunk_pairs: block size of the engine
+        top_k: only the top_k best matches of every film, see
+               top_k_matches.TopKMatches
+    Returns:
+        A structured array of match_output.lattice_match_records().
+    """
+    from match_output import concatenate_records, lattice_match_records
+    from parallel_engines import parallel_match_blocks
+    from top_k_matches import top_k_match_blocks
+    if top_k is not None:
+        return top_k_match_blocks(load_materials(films), load_materials(substrates), tolerance, top_k, chunk_pairs, jobs, engine)[0]
+    blocks = parallel_match_blocks(load_materials(films), load_materials(substrates), tolerance, chunk_pairs, jobs, engine)
+    records = concatenate_records([records for records, critical in blocks])
+    if records is None:
+        records = lattice_match_records([], "", [], "", [numpy.zeros(0)]*3)
+    return records
+
+def compositions_for(substrates, database, tolerance=0.005, jobs=1, top_k=None):
+    """Compositions of a III-V or alloy_generator.py database that match
+    substrates.
+
+    Args:
+        substrates: materials as accepted by load_materials()
+        database: composition database as accepted by
+                  load_composition_database()
+        tolerance: tolerance level for mismatch as a decimal
+        jobs: number of worker processes
+        top_k: only the top_k best compositions of every substrate, see
+               composition_calculator.top_k_sub()
+    Returns:
+        A structured array of match_output.composition_match_records().
+        match_output.format_compositions(records, decimals) with the decimals
+        of load_composition_database() gives the composition strings.
+    """
+    import composition_calculator
+    from match_output import RecordCollector, composition_match_records
+    lattice_consts, index, decimals = load_composition_database(database)
+    collector = RecordCollector()
+    composition_calculator.parallel_check_substrate_file(load_materials(substrates), lattice_consts, tolerance, collector, index, jobs, top_k=top_k)
+    records = collector.records()
+    if records is None:
+        fields = composition_calculator.composition_fields(lattice_consts)
+        records = composition_match_records(numpy.zeros((0, len(fields) + 1), dtype=numpy.float32), "", "", "", fields)
+    return records
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+###############################################################################
+##                              Matching Server                              ##
+###############################################################################
+"""Resident server answering lattice match and composition queries over
+localhost HTTP, so a front end does not start a process, import numpy and
+read the catalogs and databases for every query.
+
+Material files and databases are loaded once through matching.py and
+reloaded when they change on disk. Queries run concurrently on the threads
+of the server, at most --workers at a time, and recent responses are kept in
+a least recently used cache of at most --cache-mb megabytes. The cache key
+holds the size and modification time of every file a query names, so a
+changed file is never answered from the cache.
+
+Queries are POSTed as JSON objects:
+    /match          films, substrates: material file name (relative to
+                    --data-dir) or list of [composition, symmetry, a, c]
+                    tolerance: mismatch tolerance as a decimal
+                    top_k, engine: optional, see matching.match()
+    /compositions   substrates: as for /match
+                    database: composition database file name or composition
+                    step in percent dividing 100, at least MIN_RESOLUTION
+                    tolerance: optional, 0.005 by default
+                    top_k: optional, see matching.compositions_for()
+Both take an optional format: "tsv" (the default) answers the text the
+command line tools write, "json" an object with the record field names
+(columns) and the records (rows). GET /status reports the cache counters.
+
+    python matching_server.py --port 8765 --preload cubic.txt iii_v.npz
+    curl -d '{"films": "cubic.txt", "substrates": "hexagonal.txt", "tolerance": 0.05}' localhost:8765/match
+"""
+import argparse
+import collections
+import json
+import math
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy
+import matching
+from composition_calculator import resolution_steps
+from match_output import COMPOSITION_HEADER, LATTICE_HEADER, format_composition_matches, format_lattice_matches
+from material_catalog import catalog_dtype
+
+
+parser = argparse.ArgumentParser(description="Answers lattice match and composition queries over localhost HTTP with the material files and databases kept in memory.")
+parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on (default %(default)s).")
+parser.add_argument("--port", type=int, default=8765, help="Port to listen on (default %(default)s).")
+parser.add_argument("--data-dir", type=str, default=".", help="Directory the file names of queries are relative to, files outside it are refused (default the working directory).")
+parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Queries computed at the same time (default the number of processors).")
+parser.add_argument("--cache-mb", type=float, default=256, help="Size of the response cache in megabytes, 0 disables it (default %(default)s).")
+parser.add_argument("--preload", type=str, nargs="*", default=[], help="Material files and databases (.npz, .cdb) loaded before the first query.")
+
+#file extensions of composition databases for --preload
+DATABASE_EXTENSIONS = (".npz", ".cdb")
+#finest composition step in percent a query may solve for, the tables of the
+#solver grow with the square of the number of steps
+MIN_RESOLUTION = 0.1
+
+class QueryError(ValueError):
+    """A query that cannot be answered, reported with status 400."""
+
+class ResultCache(object):
+    """Thread safe least recently used cache of responses.
+
+    Args:
+        max_bytes: largest total size of the cached responses, larger single
+                   responses are not cached
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = self.misses = 0
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """The cached response of key or None."""
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """Caches a response, evicting the least recently used ones."""
+        size = len(value[1])
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key)[1])
+            self.entries[key] = value
+            self.size += size
+            while self.size > self.max_bytes:
+                self.size -= len(self.entries.popitem(last=False)[1][1])
+
+    def status(self):
+        """Counters of the cache as a dict."""
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.size, "hits": self.hits, "misses": self.misses}
+
+class MatchingService(object):
+    """Answers queries with matching.py, see the module documentation.
+
+    Args:
+        data_dir: directory the file names of queries are relative to
+        workers: queries computed at the same time
+        cache_bytes: size of the response cache
+    """
+
+    def __init__(self, data_dir=".", workers=1, cache_bytes=256*2**20):
+        self.data_dir = os.path.realpath(data_dir)
+        self.slots = threading.BoundedSemaphore(max(1, workers))
+        self.cache = ResultCache(cache_bytes)
+
+    def path(self, file_name):
+        """Absolute path of a file name of a query inside data_dir."""
+        path = os.path.realpath(os.path.join(self.data_dir, file_name))
+        if os.path.commonpath([path, self.data_dir]) != self.data_dir:
+            raise QueryError("{} is outside the data directory".format(file_name))
+        if not os.path.isfile(path):
+            raise QueryError("no file {}".format(file_name))
+        return path
+
+    def materials(self, value, name):
+        """Materials argument of matching.py for a query value: a file path or
+        a catalog array of inline [composition, symmetry, a, c] rows."""
+        if isinstance(value, str):
+            return self.path(value)
+        try:
+            rows = [(str(composition), str(symmetry), float(a), float(c)) for composition, symmetry, a, c in value]
+        except (TypeError, ValueError):
+            raise QueryError("{} must be a file name or a list of [composition, symmetry, a, c]".format(name))
+        return numpy.array(rows, dtype=catalog_dtype(max([len(row[0]) for row in rows] + [1]), max([len(row[1]) for row in rows] + [1])))
+
+    def resolution(self, value):
+        """Composition step in percent of a numeric database value."""
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise QueryError("database must be a file name or a composition step in percent")
+        try:
+            resolution_steps(value)
+        except ValueError as error:
+            raise QueryError(str(error))
+        if value < MIN_RESOLUTION:
+            raise QueryError("database step must be at least {} percent".format(MIN_RESOLUTION))
+        return float(value)
+
+    def stamps(self, values):
+        """(path, size, mtime) of the file paths among values."""
+        return tuple((value,) + matching.file_stamp(value) for value in values if isinstance(value, str))
+
+    def answer(self, kind, query):
+        """Response of a query.
+
+        Args:
+            kind: "match" or "compositions"
+            query: dict decoded from the JSON body
+        Returns:
+            (content type, body bytes)
+        Raises:
+            QueryError: if the query is malformed or names a missing file
+        """
+        if not isinstance(query, dict):
+            raise QueryError("the query must be a JSON object")
+        output_format = query.get("format", "tsv")
+        if output_format not in ("tsv", "json"):
+            raise QueryError("format must be tsv or json")
+        try:
+            top_k = None if query.get("top_k") is None else int(query["top_k"])
+            if kind == "match":
+                arguments = (self.materials(query["films"], "films"), self.materials(query["substrates"], "substrates"),
+                             float(query["tolerance"]), str(query.get("engine", "indexed")), top_k)
+            else:
+                database = query["database"]
+                database = self.path(database) if isinstance(database, str) else self.resolution(database)
+                arguments = (self.materials(query["substrates"], "substrates"), database, float(query.get("tolerance", 0.005)), top_k)
+        except KeyError as error:
+            raise QueryError("missing {}".format(error.args[0]))
+        except (TypeError, ValueError) as error:
+            if isinstance(error, QueryError):
+                raise
+            raise QueryError(str(error))
+        if top_k is not None and top_k < 1:
+            raise QueryError("top_k must be at least 1")
+        if kind == "match" and arguments[3] not in ("indexed", "vectorized"):
+            raise QueryError("engine must be indexed or vectorized")
+        # inline materials are part of the key through their bytes
+        key = (kind, output_format, json.dumps(query, sort_keys=True), self.stamps(arguments[:2]))
+        response = self.cache.get(key)
+        if response is None:
+            with self.slots:
+                response = self.compute(kind, arguments, output_format)
+            self.cache.put(key, response)
+        return response
+
+    def compute(self, kind, arguments, output_format):
+        """Runs a query on matching.py and encodes the records."""
+        if kind == "match":
+            films, substrates, tolerance, engine, top_k = arguments
+            records = matching.match(films, substrates, tolerance, engine=engine, top_k=top_k)
+            text = lambda: LATTICE_HEADER + format_lattice_matches(records)
+        else:
+            substrates, database, tolerance, top_k = arguments
+            decimals = matching.load_composition_database(database)[2]
+            records = matching.compositions_for(substrates, database, tolerance, top_k=top_k)
+            text = lambda: COMPOSITION_HEADER + format_composition_matches(records, decimals)
+        if output_format == "tsv":
+            return "text/tab-separated-values; charset=utf-8", text().encode("utf-8")
+        # JSON has no NaN or infinity, missing values such as c_* of cubic rows become null
+        rows = [[None if isinstance(value, float) and not math.isfinite(value) else value for value in row]
+                for row in records.tolist()]
+        body = {"columns": list(records.dtype.names), "rows": rows}
+        return "application/json", json.dumps(body, allow_nan=False).encode("utf-8")
+
+    def preload(self, file_names):
+        """Loads material files and databases ahead of the first query."""
+        for file_name in file_names:
+            path = self.path(file_name)
+            if path.endswith(DATABASE_EXTENSIONS):
+                matching.load_composition_database(path)
+            else:
+                matching.load_materials(path)
+
+    def status(self):
+        """Cache counters and the loaded files as a dict."""
+        status = {"cache": self.cache.status()}
+        status.update(matching.loaded_files())
+        return status
+
+class MatchingHandler(BaseHTTPRequestHandler):
+    """HTTP front of the MatchingService of the server."""
+
+    def send_body(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_body(self, status, message):
+        self.send_body(status, "application/json", json.dumps({"error": message}).encode("utf-8"))
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/status":
+            return self.send_error_body(404, "unknown path {}".format(self.path))
+        self.send_body(200, "application/json", json.dumps(self.server.service.status()).encode("utf-8"))
+
+    def do_POST(self):
+        kind = self.path.strip("/")
+        if kind not in ("match", "compositions"):
+            return self.send_error_body(404, "unknown path {}".format(self.path))
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            text = self.rfile.read(length).decode("utf-8")
+        except ValueError:
+            return self.send_error_body(400, "the body must be UTF-8 text of the given Content-Length")
+        try:
+            content_type, body = self.server.service.answer(kind, json.loads(text))
+        except (QueryError, json.JSONDecodeError) as error:
+            return self.send_error_body(400, str(error))
+        except Exception as error:
+            return self.send_error_body(500, "{}: {}".format(type(error).__name__, error))
+        self.send_body(200, content_type, body)
+
+def make_server(service, host="127.0.0.1", port=8765):
+    """ThreadingHTTPServer answering queries with service."""
+    server = ThreadingHTTPServer((host, port), MatchingHandler)
+    server.service = service
+    return server
+
+def main(argv=None):
+    """Command line interface, see parser."""
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.cache_mb < 0:
+        parser.error("--cache-mb must not be negative")
+    service = MatchingService(args.data_dir, args.workers, int(args.cache_mb*2**20))
+    try:
+        service.preload(args.preload)
+    except QueryError as error:
+        parser.error(str(error))
+    server = make_server(service, args.host, args.port)
+    print("Serving on {}:{}".format(*server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
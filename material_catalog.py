@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+###############################################################################
+##                             Material Catalogs                             ##
+###############################################################################
+"""Typed loading of the tab delimited material files (cubic.txt,
+tetragonal.txt, hexagonal.txt, ...) read by lattice_matcher.py and
+composition_calculator.py.
+
+A file is parsed with numpy.genfromtxt() once and stored next to it in a
+binary sidecar, <file>.catalog.npz:
+    compositions      the distinct composition strings
+    composition_codes uint32 position of the composition of every row
+    symmetries        symmetry labels, SYMMETRIES first
+    symmetry_codes    uint8 position of the symmetry of every row
+    a, c              float64 lattice constants
+Later reads load the sidecar instead of parsing the text. The sidecar is
+used while the size and modification time of the file are unchanged; when
+they changed but the SHA-1 of its content did not (a copy or a touch) the
+stored stamp is updated and the sidecar is still used.
+
+The symmetry codes only compress the sidecar: load_catalog() returns the
+labels as strings, because files may hold labels besides SYMMETRIES and the
+labels are what the matchers compare and write.
+"""
+import hashlib
+import os
+import zipfile
+import numpy
+
+
+#symmetries with matching rules, in the order of their uint8 codes
+SYMMETRIES = ("C", "T", "H")
+
+#layout version of the sidecar, older sidecars are rebuilt
+CATALOG_VERSION = 1
+
+#arrays of a sidecar besides its stamp
+SIDECAR_ARRAYS = ("compositions", "composition_codes", "symmetries", "symmetry_codes", "a", "c")
+
+def catalog_dtype(composition_width=1, symmetry_width=1):
+    """Structured dtype of a catalog: composition and symmetry strings of the
+    given widths and float64 a and c."""
+    return numpy.dtype([("composition", "U{}".format(max(1, composition_width))),
+                        ("symmetry", "U{}".format(max(1, symmetry_width))),
+                        ("a", "f8"), ("c", "f8")])
+
+def catalog_array(materials):
+    """Converts materials to a catalog array.
+
+    Args:
+        materials: structured array with composition, symmetry, a and
+                   optionally c fields, e.g. as read by numpy.genfromtxt().
+                   A missing c is 0.
+    Returns:
+        A one dimensional structured array of catalog_dtype().
+    """
+    materials = numpy.atleast_1d(materials)
+    names = materials.dtype.names
+    if names is None:
+        # numpy.genfromtxt() of a file without rows
+        return numpy.zeros(0, dtype=catalog_dtype())
+    composition = materials[names[0]].astype(str)
+    symmetry = materials[names[1]].astype(str)
+    catalog = numpy.empty(len(materials), dtype=catalog_dtype(composition.dtype.itemsize // 4, symmetry.dtype.itemsize // 4))
+    catalog["composition"] = composition
+    catalog["symmetry"] = symmetry
+    catalog["a"] = materials[names[2]]
+    catalog["c"] = materials[names[3]] if len(names) > 3 else 0.0
+    return catalog
+
+def parse_catalog(file_name):
+    """Parses a tab delimited material file as the command line tools always
+    have and returns its catalog array."""
+    return catalog_array(numpy.genfromtxt(file_name, comments="#", delimiter="\t", dtype=None))
+
+def encode_catalog(catalog):
+    """Arrays of the sidecar of a catalog, see the module documentation."""
+    compositions, composition_codes = numpy.unique(catalog["composition"], return_inverse=True)
+    labels, label_codes = numpy.unique(catalog["symmetry"], return_inverse=True)
+    symmetries = list(SYMMETRIES) + [label for label in labels.tolist() if label not in SYMMETRIES]
+    if len(symmetries) > 256:
+        raise ValueError("more than 256 symmetry labels")
+    codes = numpy.array([symmetries.index(label) for label in labels.tolist()], dtype=numpy.uint8)
+    return {"compositions": compositions, "composition_codes": composition_codes.ravel().astype(numpy.uint32),
+            "symmetries": numpy.array(symmetries), "symmetry_codes": codes[label_codes.ravel()],
+            "a": catalog["a"], "c": catalog["c"]}
+
+def decode_catalog(arrays):
+    """Catalog array of the arrays of a sidecar."""
+    compositions = arrays["compositions"][arrays["composition_codes"]]
+    symmetries = arrays["symmetries"][arrays["symmetry_codes"]]
+    catalog = numpy.empty(len(arrays["a"]), dtype=catalog_dtype(arrays["compositions"].dtype.itemsize // 4,
+                                                                 max(len(label) for label in arrays["symmetries"].tolist())))
+    catalog["composition"] = compositions
+    catalog["symmetry"] = symmetries
+    catalog["a"] = arrays["a"]
+    catalog["c"] = arrays["c"]
+    return catalog
+
+def catalog_file_name(file_name):
+    """Name of the sidecar stored next to a material file. The whole file
+    name is kept, so cubic.txt and cubic.tsv have sidecars of their own."""
+    return file_name + ".catalog.npz"
+
+def file_sha1(file_name):
+    """SHA-1 digest of the content of a file."""
+    digest = hashlib.sha1()
+    with open(file_name, "rb") as material_file:
+        for block in iter(lambda: material_file.read(2**20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def save_sidecar(sidecar_name, arrays, stat, sha1):
+    """Writes a sidecar with the stamp of its source file."""
+    try:
+        with open(sidecar_name, "wb") as sidecar:
+            numpy.savez(sidecar, version=CATALOG_VERSION, source_size=stat.st_size,
+                        source_mtime=stat.st_mtime_ns, source_sha1=sha1, **arrays)
+    except IOError:
+        pass # a read-only directory only costs parsing the file next time
+
+def load_catalog(file_name, use_sidecar=True):
+    """Loads a material file, from its sidecar when it is up to date.
+
+    Args:
+        file_name: tab delimited material file
+        use_sidecar: read and write the sidecar, False always parses the file
+    Returns:
+        A one dimensional structured array of catalog_dtype().
+    """
+    if not use_sidecar:
+        return parse_catalog(file_name)
+    sidecar_name = catalog_file_name(file_name)
+    stat = os.stat(file_name)
+    arrays = sha1 = None
+    if os.path.exists(sidecar_name):
+        try:
+            with numpy.load(sidecar_name) as stored:
+                if int(stored["version"]) == CATALOG_VERSION:
+                    current = int(stored["source_size"]) == stat.st_size and int(stored["source_mtime"]) == stat.st_mtime_ns
+                    if not current:
+                        sha1 = file_sha1(file_name)
+                    if current or str(stored["source_sha1"]) == sha1:
+                        arrays = dict((name, stored[name]) for name in SIDECAR_ARRAYS)
+        except (IOError, KeyError, ValueError, zipfile.BadZipFile):
+            pass # unreadable sidecars are rebuilt
+    if arrays is not None:
+        if sha1 is not None:
+            # same content with a new stamp
+            save_sidecar(sidecar_name, arrays, stat, sha1)
+        return decode_catalog(arrays)
+    catalog = parse_catalog(file_name)
+    save_sidecar(sidecar_name, encode_catalog(catalog), stat, sha1 or file_sha1(file_name))
+    return catalog
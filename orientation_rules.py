@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+###############################################################################
+##                             Orientation Rules                             ##
+###############################################################################
+"""Orientation rules of lattice_matcher.py evaluated for whole blocks of
+film/substrate pairs with numpy broadcasting.
+
+Every rule of cubic_film(), tetragonal_film() and hexagonal_film() is an
+array expression over substrates and films. match_blocks() evaluates all of
+them for blocks of substrates against all films (the vectorized engine) and
+yields the matches as match_output.lattice_match_records() in the order of the
+per-pair loops, with the critical value of every match: the largest
+absolute term of its rule, below which a tolerance accepts it.
+"""
+import collections
+import time
+import numpy
+from match_output import concatenate_records, lattice_match_records
+from material_catalog import SYMMETRIES
+
+# An orientation rule evaluated for a whole block of film/substrate pairs at once.
+#   film_tag, sub_tag: text appended to the film and substrate symmetry labels
+#   terms: arrays whose absolute values must all be below the tolerance
+#   condition: tolerance independent boolean array (or None) that must also hold
+#   columns: (mismatch, ratio, original ratio[, c mismatch, c ratio, c original ratio])
+Rule = collections.namedtuple("Rule", ["film_tag", "sub_tag", "terms", "condition", "columns"])
+
+def round_ratio(original_ratio):
+    """Rounds a ratio to an integer value.
+
+    Args:
+        original_ratio: the ratio value to be rounded.
+    Returns:
+        ratio: the rounded value of original_ratio.
+    """
+    if original_ratio < 1:
+        ratio = 1.0 / round(1.0/original_ratio)
+    else:
+        ratio = round(original_ratio)
+    return ratio
+
+def ratio_check(c_value, a_value):
+    """Checks to see if the ratio of lattice constants (a,c) is close to c = sqrt(2)*a.
+
+    Args:
+        a_value: value of lattice constant 'a'
+        c_value: value of lattice constant 'c'
+    Returns:
+        abs(percent_off): the absolute value of the percent (as a decimal) of 
+                          how far off the ratio is
+    """
+    percent_off = ((c_value/(numpy.sqrt(2.0)*a_value)) - 1)
+    return abs(percent_off) #returns a percentage of how far off the ratio is
+
+def round_ratio_array(original_ratio):
+    """Vectorized version of round_ratio().
+
+    Args:
+        original_ratio: array of ratio values to be rounded.
+    Returns:
+        ratio: array of rounded values. numpy.rint rounds half to even exactly
+               like the built-in round() used by round_ratio().
+    """
+    with numpy.errstate(divide="ignore"):
+        return numpy.where(original_ratio < 1, 1.0 / numpy.rint(1.0 / original_ratio), numpy.rint(original_ratio))
+
+def cubic_film_rules(sub_sym, sub_a, sub_c, film_a, film_c):
+    """Orientation rules of cubic_film() for arrays of substrates and films.
+
+    Args:
+        sub_sym: substrate symmetry shared by all substrates in sub_a/sub_c
+        sub_a, sub_c: substrate lattice constants, shape (substrates, 1)
+        film_a, film_c: film lattice constants, shape (1, films)
+    Returns:
+        A list of Rule tuples in the order cubic_film() writes them.
+    """
+    if sub_sym == "C":
+        original_ratio_a = sub_a/film_a
+        original_ratio_45 = (numpy.sqrt(2.0)*sub_a)/film_a
+        ratio_a = round_ratio_array(original_ratio_a)
+        ratio_45 = round_ratio_array(original_ratio_45)
+        mismatch_a = ((sub_a - (ratio_a*film_a)) / sub_a)
+        mismatch_45 = (((numpy.sqrt(2.0)*sub_a) - (ratio_45*film_a)) / (numpy.sqrt(2.0)*sub_a))
+        return [Rule("", "", [mismatch_a], None, (mismatch_a, ratio_a, original_ratio_a)),
+                Rule(" (45 deg)", "", [mismatch_45], None, (mismatch_45, ratio_45, original_ratio_45))]
+    elif sub_sym == "T":
+        original_ratio_a = sub_a/film_a
+        original_ratio_45 = (numpy.sqrt(2.0)*sub_a)/film_a
+        original_ratio_c = sub_c/(numpy.sqrt(2.0)*film_a)
+        ratio_a = round_ratio_array(original_ratio_a)
+        ratio_45 = round_ratio_array(original_ratio_45)
+        ratio_c = round_ratio_array(original_ratio_c)
+        mismatch_a = ((sub_a - (ratio_a*film_a)) / sub_a)
+        mismatch_45 = (((numpy.sqrt(2.0)*sub_a) - (ratio_45*film_a)) / (numpy.sqrt(2.0)*sub_a))
+        mismatch_c = ((sub_c - (ratio_c*numpy.sqrt(2.0)*film_a)) / sub_c)
+        return [Rule("", "", [mismatch_a], None, (mismatch_a, ratio_a, original_ratio_a)),
+                Rule(" (45 deg)", "", [mismatch_45], None, (mismatch_45, ratio_45, original_ratio_45)),
+                Rule(" (110)", " (a-plane)", [ratio_check(sub_c, sub_a), mismatch_c, mismatch_a], None,
+                     (mismatch_a, ratio_a, original_ratio_a, mismatch_c, ratio_c, original_ratio_c))]
+    elif sub_sym == "H":
+        r_plane_c = numpy.sqrt((sub_c**2)+(3*(sub_a**2)))
+        original_ratio_a_111 = sub_a/(numpy.sqrt(2.0)*film_a)
+        original_ratio_a_a = (numpy.sqrt(3.0)*sub_a)/film_a
+        original_ratio_a = sub_a/film_a
+        original_ratio_c = sub_c/(numpy.sqrt(2.0)*film_a)
+        original_ratio_c_r = r_plane_c/(numpy.sqrt(2.0)*film_a)
+        ratio_a_111 = round_ratio_array(original_ratio_a_111)
+        ratio_a = round_ratio_array(original_ratio_a)
+        ratio_a_a = round_ratio_array(original_ratio_a_a)
+        ratio_c = round_ratio_array(original_ratio_c)
+        ratio_c_r = round_ratio_array(original_ratio_c_r)
+        mismatch_a_111 = ((sub_a - (ratio_a_111*film_a*numpy.sqrt(2.0))) / sub_a)
+        mismatch_a = ((sub_a - (ratio_a*film_a)) / sub_a)
+        mismatch_a_a = ((numpy.sqrt(3.0)*sub_a - (ratio_a_a*film_a)) / numpy.sqrt(3.0)*sub_a)
+        mismatch_c = ((sub_c - (ratio_c*film_a*numpy.sqrt(2.0))) / sub_c)
+        mismatch_c_r = ((r_plane_c - (ratio_c_r*film_a*numpy.sqrt(2.0))) / r_plane_c)
+        # cubic_film() only tests the c mismatches for being non-zero here
+        return [Rule(" (111)", "", [mismatch_a_111], None, (mismatch_a_111, ratio_a_111, original_ratio_a_111)),
+                Rule(" (110)", " (a-plane)", [ratio_check(sub_c, sub_a), mismatch_a_a], mismatch_c != 0,
+                     (mismatch_a, ratio_a, original_ratio_a, mismatch_c, ratio_c, original_ratio_c)),
+                Rule(" (110)", " (r-plane)", [ratio_check(r_plane_c, sub_a), mismatch_a], mismatch_c_r != 0,
+                     (mismatch_a, ratio_a, original_ratio_a, mismatch_c_r, ratio_c_r, original_ratio_c_r))]
+    return []
+
+def tetragonal_film_rules(sub_sym, sub_a, sub_c, film_a, film_c):
+    """Orientation rules of tetragonal_film() for arrays of substrates and films.
+
+    Args:
+        sub_sym: substrate symmetry shared by all substrates in sub_a/sub_c
+        sub_a, sub_c: substrate lattice constants, shape (substrates, 1)
+        film_a, film_c: film lattice constants, shape (1, films)
+    Returns:
+        A list of Rule tuples in the order tetragonal_film() writes them.
+    """
+    if sub_sym == "C":
+        original_ratio_a = sub_a/film_a
+        original_ratio_45 = (numpy.sqrt(2.0)*sub_a)/film_a
+        original_ratio_c = (numpy.sqrt(2.0)*sub_a)/film_c
+        ratio_a = round_ratio_array(original_ratio_a)
+        ratio_45 = round_ratio_array(original_ratio_45)
+        ratio_c = round_ratio_array(original_ratio_c)
+        mismatch_a = ((sub_a - (ratio_a*film_a)) / sub_a)
+        mismatch_45 = (((numpy.sqrt(2.0)*sub_a) - (ratio_45*film_a)) / (numpy.sqrt(2.0)*sub_a))
+        mismatch_c = (((numpy.sqrt(2.0)*sub_a) - (ratio_c*film_a)) / (numpy.sqrt(2.0)*sub_a))
+        return [Rule("", "", [mismatch_a], None, (mismatch_a, ratio_a, original_ratio_a)),
+                Rule(" (45 deg)", "", [mismatch_45], None, (mismatch_45, ratio_45, original_ratio_45)),
+                Rule(" (a-plane)", " (110)", [ratio_check(film_c, film_a), mismatch_c, mismatch_a], None,
+                     (mismatch_a, ratio_a, original_ratio_a, mismatch_c, ratio_c, original_ratio_c))]
+    elif sub_sym == "T":
+        original_ratio = sub_a/film_a
+        original_ratio_45 = (numpy.sqrt(2.0)*sub_a)/film_a
+        ratio = round_ratio_array(original_ratio)
+        ratio_45 = round_ratio_array(original_ratio_45)
+        mismatch = ((sub_a - (ratio*film_a)) / sub_a)
+        mismatch_45 = (((numpy.sqrt(2.0)*sub_a) - (ratio_45*film_a)) / (numpy.sqrt(2.0)*sub_a))
+        mismatch_c = (((sub_c - (ratio*film_c)) / sub_c))
+        return [Rule("", "", [mismatch], None, (mismatch, ratio, original_ratio)),
+                Rule(" (45 deg)", "", [mismatch_45], None, (mismatch_45, ratio_45, original_ratio_45)),
+                Rule(" (a-plane)", " (a-plane)", [mismatch, mismatch_c], None, (mismatch_45, ratio_45, original_ratio_45))]
+    elif sub_sym == "H":
+        r_plane_c = numpy.sqrt((sub_c**2)+(3*(sub_a**2)))
+        original_ratio_a = sub_a/film_a
+        original_ratio_a_a = numpy.sqrt(3.0)*sub_a/film_a
+        original_ratio_c = sub_c/film_c
+        original_ratio_c_r = r_plane_c/film_c
+        ratio_a = round_ratio_array(original_ratio_a)
+        ratio_a_a = round_ratio_array(original_ratio_a_a)
+        ratio_c = round_ratio_array(original_ratio_c)
+        ratio_c_r = round_ratio_array(original_ratio_c_r)
+        mismatch_a = ((sub_a - ratio_a*film_a) / sub_a)
+        mismatch_a_a = ((numpy.sqrt(3.0)*sub_a - ratio_a_a*film_a) / numpy.sqrt(3.0)*sub_a)
+        mismatch_c = ((sub_c - ratio_c*film_c) / sub_c)
+        mismatch_c_r = ((r_plane_c - ratio_c_r*film_c) / r_plane_c)
+        return [Rule(" (a-plane)", " (a-plane)", [mismatch_a_a, mismatch_c], None,
+                     (mismatch_a, ratio_a, original_ratio_a, mismatch_c, ratio_c, original_ratio_c)),
+                Rule(" (a-plane)", " (r-plane)", [mismatch_a, mismatch_c_r], None,
+                     (mismatch_a, ratio_a, original_ratio_a, mismatch_c_r, ratio_c_r, original_ratio_c_r))]
+    return []
+
+def hexagonal_film_rules(sub_sym, sub_a, sub_c, film_a, film_c):
+    """Orientation rules of hexagonal_film() for arrays of substrates and films.
+
+    Args:
+        sub_sym: substrate symmetry shared by all substrates in sub_a/sub_c
+        sub_a, sub_c: substrate lattice constants, shape (substrates, 1)
+        film_a, film_c: film lattice constants, shape (1, films)
+    Returns:
+        A list of Rule tuples in the order hexagonal_film() writes them.
+    """
+    if sub_sym == "C":
+        r_plane_c = numpy.sqrt((sub_c**2)+(3*(sub_a**2)))
+        original_ratio_a_111 = (numpy.sqrt(2.0)*sub_a)/film_a
+        original_ratio_a = sub_a/film_a
+        original_ratio_a_a = sub_a/(numpy.sqrt(3.0)*film_a)
+        original_ratio_c = (numpy.sqrt(2.0)*sub_a)/film_a
+        original_ratio_c_r = (numpy.sqrt(2.0)*sub_a)/r_plane_c
+        ratio_a_111 = round_ratio_array(original_ratio_a_111)
+        ratio_a = round_ratio_array(original_ratio_a)
+        ratio_a_a = round_ratio_array(original_ratio_a_a)
+        ratio_c = round_ratio_array(original_ratio_c)
+        ratio_c_r = round_ratio_array(original_ratio_c_r)
+        mismatch_a_111 = ((numpy.sqrt(2.0)*sub_a - ratio_a_111*film_a) / numpy.sqrt(2.0)*sub_a)
+        mismatch_a = ((sub_a - ratio_a*film_a) / sub_a)
+        mismatch_a_a = ((sub_a - ratio_a_a*numpy.sqrt(3.0)*film_a) / sub_a)
+        mismatch_c = ((numpy.sqrt(2.0)*sub_a - ratio_c*film_c) / numpy.sqrt(2.0)*sub_a)
+        mismatch_c_r = ((numpy.sqrt(2.0)*sub_a - ratio_c_r*r_plane_c) / numpy.sqrt(2.0)*sub_a)
+        return [Rule("", " (111)", [mismatch_a_111], None, (mismatch_a_111, ratio_a_111, original_ratio_a_111)),
+                Rule(" (a-plane)", " (110)", [ratio_check(film_c, film_a), mismatch_c, mismatch_a_a], None,
+                     (mismatch_a, ratio_a, original_ratio_a, mismatch_c, ratio_c, original_ratio_c)),
+                Rule(" (r-plane)", " (110)", [ratio_check(r_plane_c, film_a), mismatch_c_r, mismatch_a], None,
+                     (mismatch_a, ratio_a, original_ratio_a, mismatch_c_r, ratio_c_r, original_ratio_c_r))]
+    elif sub_sym == "T":
+        r_plane_c = numpy.sqrt((film_c**2)+(3*(film_a**2)))
+        original_ratio_a = sub_a/film_a
+        original_ratio_a_a = sub_a/(numpy.sqrt(3.0)*film_a)
+        original_ratio_c = sub_c/film_c
+        original_ratio_c_r = sub_c/r_plane_c
+        ratio_a = round_ratio_array(original_ratio_a)
+        ratio_a_a = round_ratio_array(original_ratio_a_a)
+        ratio_c = round_ratio_array(original_ratio_c)
+        ratio_c_r = round_ratio_array(original_ratio_c_r)
+        mismatch_a = ((sub_a - ratio_a*film_a) / sub_a)
+        mismatch_a_a = ((sub_a - ratio_a_a*numpy.sqrt(3.0)*film_a) / sub_a)
+        mismatch_c = ((sub_c - ratio_c*film_c) / sub_c)
+        mismatch_c_r = ((sub_c - ratio_c_r*r_plane_c) / sub_c)
+        return [Rule(" (a-plane)", " (a-plane)", [mismatch_a_a, mismatch_c], None,
+                     (mismatch_a, ratio_a, original_ratio_a, mismatch_c, ratio_c, original_ratio_c)),
+                Rule(" (r-plane)", " (a-plane)", [mismatch_a, mismatch_c_r], None,
+                     (mismatch_a, ratio_a, original_ratio_a, mismatch_c_r, ratio_c_r, original_ratio_c_r))]
+    elif sub_sym == "H":
+        film_r_plane_c = numpy.sqrt((film_c**2)+(3*(film_a**2)))
+        sub_r_plane_c = numpy.sqrt((sub_c**2)+(3*(sub_a**2)))
+        original_ratio_a = sub_a/film_a
+        original_ratio_a_a_r = original_ratio_a*numpy.sqrt(3.0)
+        original_ratio_a_r_a = original_ratio_a/numpy.sqrt(3.0)
+        original_ratio_c_a_r = sub_c/film_r_plane_c
+        original_ratio_c_r_a = sub_r_plane_c/film_c
+        ratio_a = round_ratio_array(original_ratio_a)
+        ratio_a_a_r = round_ratio_array(original_ratio_a_a_r)
+        ratio_c_a_r = round_ratio_array(original_ratio_c_a_r)
+        ratio_a_r_a = round_ratio_array(original_ratio_a_r_a)
+        ratio_c_r_a = round_ratio_array(original_ratio_c_r_a)
+        mismatch_a = ((sub_a - ratio_a*film_a) / sub_a)
+        mismatch_c = ((sub_c - ratio_a*film_c) / sub_c)
+        mismatch_c_r = ((sub_r_plane_c - ratio_a*film_r_plane_c) / sub_r_plane_c)
+        mismatch_a_a_r = ((numpy.sqrt(3.0)*sub_a - ratio_a_a_r*film_a) / numpy.sqrt(3.0)*sub_a)
+        mismatch_a_r_a = ((sub_a - numpy.sqrt(3.0)*ratio_a_r_a*film_a) / sub_a)
+        mismatch_c_a_r = ((sub_c - ratio_c_a_r*film_r_plane_c) / sub_c)
+        mismatch_c_r_a = ((sub_r_plane_c - ratio_c_r_a*film_c) / sub_r_plane_c)
+        columns = (mismatch_a, ratio_a, original_ratio_a)
+        return [Rule("", "", [mismatch_a], None, columns),
+                Rule(" (a-plane)", " (a-plane)", [mismatch_a, mismatch_c], None, columns),
+                Rule(" (r-plane)", " (r-plane)", [mismatch_a, mismatch_c_r], None, columns),
+                Rule(" (r-plane)", " (a-plane)", [mismatch_a_a_r, mismatch_c_a_r], None, columns),
+                Rule(" (a-plane)", " (r-plane)", [mismatch_a_r_a, mismatch_c_r_a], None, columns)]
+    return []
+
+FILM_RULES = {"C": cubic_film_rules, "T": tetragonal_film_rules, "H": hexagonal_film_rules}
+
+def database_columns(database):
+    """Splits a material catalog (material_catalog.load_catalog()) into
+    column arrays.
+
+    Args:
+        database: structured array with composition, symmetry, a and c fields
+    Returns:
+        (composition, symmetry, a, c) where composition and symmetry are string
+        arrays and a, c are float64 arrays.
+    """
+    database = numpy.atleast_1d(database)
+    names = database.dtype.names
+    return (database[names[0]].astype(str), database[names[1]].astype(str),
+            database[names[2]].astype(numpy.float64), database[names[3]].astype(numpy.float64))
+
+def rule_records(rule, mask, shape, film_comp, film_sym, sub_comp, sub_sym):
+    """Match records of one orientation rule for the selected pairs.
+
+    Args:
+        rule: the Rule that was evaluated
+        mask: boolean array of pairs that passed the rule
+        shape: (substrates, films) shape of the evaluated block
+        film_comp, sub_comp: compositions of the selected pairs
+        film_sym, sub_sym: film and substrate symmetry of the block
+    Returns:
+        A structured array of match_output.lattice_match_records().
+    """
+    columns = [numpy.broadcast_to(column, shape)[mask] for column in rule.columns]
+    return lattice_match_records(film_comp, film_sym + rule.film_tag, sub_comp, sub_sym + rule.sub_tag, columns)
+
+def rule_criticals(rule, skip):
+    """Largest absolute value among the terms of a rule for every pair.
+
+    A pair passes the rule at a tolerance exactly when its critical value is
+    below it. Pairs that can never pass (identical materials or a failed
+    tolerance independent condition) get infinity.
+    """
+    critical = abs(rule.terms[0])
+    for term in rule.terms[1:]:
+        critical = numpy.maximum(critical, abs(term))
+    critical = numpy.where(skip, numpy.inf, critical)
+    if rule.condition is not None:
+        critical = numpy.where(rule.condition, critical, numpy.inf)
+    return critical
+
+# rules whose first term is ratio_check(), by (film symmetry, substrate symmetry)
+RATIO_CHECK_RULES = {("C", "T"): (2,), ("C", "H"): (1, 2), ("T", "C"): (2,), ("H", "C"): (1, 2)}
+
+def symmetry_stats(stats, f_sym, s_sym, skip, started):
+    """Counts the pairs of a block of one film and substrate symmetry and the
+    time spent computing their rule terms into a match_stats.MatchStats."""
+    seconds = time.perf_counter() - started
+    stats.add("symmetry_pairs", (("film_symmetry", f_sym), ("substrate_symmetry", s_sym)),
+              pairs_evaluated=skip.size - numpy.count_nonzero(skip), seconds=seconds)
+
+def rule_stats(stats, f_sym, s_sym, r, rule, skip, tolerance, started):
+    """Counts the pairs one rule was evaluated for, the pairs passing its
+    ratio_check() term (all of them for rules without one) and the time spent
+    selecting and recording its matches into a match_stats.MatchStats. Rules
+    are keyed by their output labels."""
+    seconds = time.perf_counter() - started
+    evaluated = skip.size - numpy.count_nonzero(skip)
+    passed = evaluated
+    if r in RATIO_CHECK_RULES.get((f_sym, s_sym), ()):
+        passed = numpy.count_nonzero(numpy.broadcast_to(rule.terms[0] < tolerance, skip.shape) & ~skip)
+    counters = {"pairs_evaluated": evaluated, "ratio_check_passed": passed, "seconds": seconds}
+    stats.add("rules", (("film_symmetry", f_sym + rule.film_tag), ("substrate_symmetry", s_sym + rule.sub_tag)), **counters)
+
+def match_blocks(film_database, substrate_database, tolerance, chunk_pairs=2**20, stats=None, pair_rows=False, film_bounds=None):
+    """Evaluates every orientation rule for blocks of substrates against all
+    films with numpy broadcasting.
+
+    Args:
+        film_database: structured array of film materials (material_catalog.py)
+        substrate_database: structured array of substrate materials
+        tolerance: tolerance level for mismatch as a decimal
+        chunk_pairs: maximum number of film/substrate pairs per block
+        stats: optional match_stats.MatchStats counting the evaluated pairs
+        pair_rows: also yield the substrate and film row of every match
+        film_bounds: optional bound of every film row, matches of a film whose
+                     absolute mismatch is not below its bound are left out
+    Yields:
+        (records, critical) for each block of substrates with matches: the
+        match_output.lattice_match_records() of the matches in the substrate,
+        film, rule order of the per-pair loops and the critical value (see
+        rule_criticals()) of each match. With pair_rows the block is
+        (records, critical, substrate rows, film rows).
+    """
+    film_comp, film_sym, film_a, film_c = database_columns(film_database)
+    sub_comp, sub_sym, sub_a, sub_c = database_columns(substrate_database)
+    films = dict((sym, numpy.flatnonzero(film_sym == sym)) for sym in SYMMETRIES)
+    chunk_rows = max(1, chunk_pairs // max(1, len(film_comp)))
+    for start in range(0, len(sub_comp), chunk_rows):
+        chunk = numpy.arange(start, min(start + chunk_rows, len(sub_comp)))
+        sub_index, film_index, rule_index, records, criticals = [], [], [], [], []
+        for s_sym in SYMMETRIES:
+            subs = chunk[sub_sym[chunk] == s_sym]
+            if len(subs) == 0:
+                continue
+            for f_sym in SYMMETRIES:
+                fims = films[f_sym]
+                if len(fims) == 0:
+                    continue
+                shape = (len(subs), len(fims))
+                started = time.perf_counter() if stats is not None else None
+                with numpy.errstate(divide="ignore", invalid="ignore"):
+                    rules = FILM_RULES[f_sym](s_sym, sub_a[subs, None], sub_c[subs, None], film_a[None, fims], film_c[None, fims])
+                if not rules:
+                    continue
+                # identical materials are never compared against each other
+                skip = (sub_comp[subs, None] == film_comp[None, fims]) if s_sym == f_sym else numpy.zeros(shape, dtype=bool)
+                if stats is not None:
+                    symmetry_stats(stats, f_sym, s_sym, skip, started)
+                with numpy.errstate(divide="ignore", invalid="ignore"):
+                    for r, rule in enumerate(rules):
+                        started = time.perf_counter() if stats is not None else None
+                        critical = numpy.broadcast_to(rule_criticals(rule, skip), shape)
+                        mask = critical < tolerance
+                        if film_bounds is not None:
+                            mask &= bounded_matches(rule, shape, film_bounds[None, fims])
+                        s, f = numpy.nonzero(mask)
+                        if len(s):
+                            sub_index.append(subs[s])
+                            film_index.append(fims[f])
+                            rule_index.append(numpy.full(len(s), r))
+                            records.append(rule_records(rule, mask, shape, film_comp[fims[f]], f_sym, sub_comp[subs[s]], s_sym))
+                            criticals.append(critical[mask])
+                        if stats is not None:
+                            rule_stats(stats, f_sym, s_sym, r, rule, skip, tolerance, started)
+        if not records:
+            continue
+        # restore the substrate, film, rule order of the per-pair loops
+        order = numpy.lexsort((numpy.concatenate(rule_index), numpy.concatenate(film_index), numpy.concatenate(sub_index)))
+        yield match_block(records, criticals, sub_index, film_index, order, pair_rows)
+
+def bounded_matches(rule, shape, bounds):
+    """Pairs of a rule whose absolute mismatch is below their bound, a NaN
+    mismatch is only compared against an infinite bound."""
+    return ~(abs(numpy.broadcast_to(rule.columns[0], shape)) >= bounds)
+
+def match_block(records, criticals, sub_index, film_index, order, pair_rows=False):
+    """The block yielded by match_blocks() from per-rule lists in output order."""
+    block = (concatenate_records(records)[order], numpy.concatenate(criticals)[order])
+    if pair_rows:
+        block += (numpy.concatenate(sub_index)[order], numpy.concatenate(film_index)[order])
+    return block
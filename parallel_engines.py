@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+###############################################################################
+##                              Parallel Engines                             ##
+###############################################################################
+"""The numpy engines of lattice_matcher.py on shards of the substrates in a
+process pool (see parallel_shards.py), yielding the same blocks in the same
+order as one process.
+"""
+import numpy
+from match_stats import MatchStats
+from orientation_rules import match_blocks
+from parallel_shards import map_shards, shard_bounds, worker_arrays, worker_state
+from substrate_index import indexed_match_blocks
+
+# block generators of the numpy engines by --engine name
+ENGINES = {"indexed": indexed_match_blocks, "vectorized": match_blocks}
+
+def match_shard(bounds):
+    """Worker of parallel_match_blocks(): all (records, critical) blocks of
+    the substrates bounds[0]:bounds[1] and the MatchStats.tables of the shard,
+    None without stats."""
+    arrays, state = worker_arrays(), worker_state()
+    substrates = arrays["substrates"][bounds[0]:bounds[1]]
+    stats = MatchStats() if state["stats"] else None
+    blocks = list(ENGINES[state["engine"]](arrays["films"], substrates, state["tolerance"], state["chunk_pairs"], stats, state["pair_rows"],
+                                           arrays.get("film_bounds")))
+    if state["pair_rows"]:
+        blocks = [(records, critical, sub_rows + bounds[0], film_rows) for records, critical, sub_rows, film_rows in blocks]
+    return blocks, stats.tables if stats is not None else None
+
+def parallel_match_blocks(film_database, substrate_database, tolerance, chunk_pairs=2**20, jobs=1, engine="indexed", stats=None, pair_rows=False,
+                          film_bounds=None):
+    """Runs a numpy engine on shards of the substrates in a process pool.
+
+    The databases are shared with the workers as memory mapped files. The
+    output order only depends on the substrate order, so the shard results
+    are simply yielded in shard order.
+
+    Args:
+        film_database: structured array of film materials (material_catalog.py)
+        substrate_database: structured array of substrate materials
+        tolerance: tolerance level for mismatch as a decimal
+        chunk_pairs: block size of the engine
+        jobs: number of worker processes, 1 runs the engine in this process
+        engine: "indexed" or "vectorized", see ENGINES
+        stats: optional match_stats.MatchStats, the counters of the workers
+               are added to it
+        pair_rows: also yield the substrate and film row of every match
+        film_bounds: optional bound of the absolute mismatch of every film
+                     row, see match_blocks()
+    Yields:
+        (records, critical) blocks as match_blocks() does.
+    """
+    if jobs <= 1:
+        for block in ENGINES[engine](film_database, substrate_database, tolerance, chunk_pairs, stats, pair_rows, film_bounds):
+            yield block
+        return
+    substrate_database = numpy.atleast_1d(substrate_database)
+    arrays = {"films": numpy.atleast_1d(film_database), "substrates": substrate_database}
+    if film_bounds is not None:
+        arrays["film_bounds"] = film_bounds
+    state = {"engine": engine, "tolerance": tolerance, "chunk_pairs": chunk_pairs, "stats": stats is not None, "pair_rows": pair_rows}
+    for blocks, tables in map_shards(match_shard, shard_bounds(len(substrate_database), jobs), jobs, arrays, state):
+        if tables:
+            stats.merge(tables)
+        for block in blocks:
+            yield block
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+###############################################################################
+##                          Parallel Substrate Shards                        ##
+###############################################################################
+"""Process pool execution of lattice_matcher.py and composition_calculator.py
+over contiguous shards of substrates.
+
+Large read-only arrays are saved once to a temporary directory and memory
+mapped by every worker, so they are neither pickled per task nor copied per
+process. Shard results are returned in shard order, so the merged output is
+the same for any number of jobs.
+"""
+import collections
+import mmap
+import os
+import shutil
+import tempfile
+import numpy
+
+
+#shards per job, smaller shards even out substrates of different cost
+SHARDS_PER_JOB = 4
+
+#arrays and settings of the current worker process, see initialize_worker()
+_worker_arrays = {}
+_worker_state = {}
+
+def shard_bounds(count, jobs):
+    """Splits count substrates into contiguous (start, stop) shards.
+
+    Args:
+        count: number of substrates
+        jobs: number of worker processes
+    Returns:
+        A list of at most SHARDS_PER_JOB*jobs non-empty (start, stop) pairs in
+        substrate order.
+    """
+    edges = numpy.linspace(0, count, min(count, SHARDS_PER_JOB*jobs) + 1).astype(int)
+    return [(int(start), int(stop)) for start, stop in zip(edges[:-1], edges[1:]) if stop > start]
+
+class SharedArrays(object):
+    """Read-only arrays saved as .npy files in a temporary directory, removed
+    again when closed. Arrays that already are memory maps of a whole file
+    region are not copied, the workers map the same region.
+
+    Args:
+        arrays: dict of name to numpy array
+    Attributes:
+        paths: dict of name to the .npy file of the array, or to a
+               (file name, dtype, offset, shape, order) tuple of a memory map
+    """
+
+    def __init__(self, arrays):
+        self.directory = tempfile.mkdtemp(prefix="lattice_matcher_")
+        self.paths = {}
+        for name, array in arrays.items():
+            if isinstance(array, numpy.memmap) and isinstance(array.base, mmap.mmap) and array.filename:
+                order = "F" if array.flags.f_contiguous and not array.flags.c_contiguous else "C"
+                self.paths[name] = (array.filename, array.dtype, array.offset, array.shape, order)
+                continue
+            self.paths[name] = os.path.join(self.directory, name + ".npy")
+            numpy.save(self.paths[name], numpy.asarray(array))
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def load_shared(path):
+    """Memory maps a shared array, empty arrays are read instead."""
+    if isinstance(path, tuple):
+        file_name, dtype, offset, shape, order = path
+        return numpy.memmap(file_name, dtype=dtype, mode="r", offset=offset, shape=shape, order=order)
+    try:
+        return numpy.load(path, mmap_mode="r")
+    except ValueError:
+        return numpy.load(path)
+
+def initialize_worker(paths, state):
+    """Process pool initializer: maps the shared arrays of a worker."""
+    _worker_arrays.clear()
+    _worker_state.clear()
+    for name, path in paths.items():
+        _worker_arrays[name] = load_shared(path)
+    _worker_state.update(state)
+
+def worker_arrays():
+    """Shared arrays of the current worker by name."""
+    return _worker_arrays
+
+def worker_state():
+    """Settings passed to the current worker."""
+    return _worker_state
+
+def map_shards(function, shards, jobs, arrays, state=None):
+    """Runs function(shard) for every shard in a pool of worker processes.
+
+    Args:
+        function: module level function of one shard, it reads its inputs
+                  with worker_arrays() and worker_state()
+        shards: list of picklable shard descriptions, e.g. shard_bounds()
+        jobs: number of worker processes
+        arrays: dict of large read-only arrays shared with all workers
+        state: dict of small picklable settings, passed once per worker
+    Yields:
+        The results of the shards in shard order. At most 2*jobs shards are
+        queued ahead of the one being yielded, which bounds the memory of
+        finished but not yet consumed results.
+    """
+    # imported here, the process pool machinery is only needed with --jobs
+    from concurrent.futures import ProcessPoolExecutor
+    with SharedArrays(arrays) as shared:
+        with ProcessPoolExecutor(jobs, initializer=initialize_worker, initargs=(shared.paths, state or {})) as executor:
+            pending = collections.deque()
+            for shard in shards:
+                pending.append(executor.submit(function, shard))
+                if len(pending) > 2*jobs:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
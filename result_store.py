@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+###############################################################################
+##                               Result Store                                ##
+###############################################################################
+"""Persistent match results keyed by the content of the input rows, used by
+the --incremental modes of lattice_matcher.py and composition_calculator.py.
+
+Every material row is identified by a SHA-1 digest of its composition,
+symmetry, a and c, so rows can be added, removed or reordered between runs.
+A store is a .npz file holding the match records, the row digests each
+record belongs to and the settings (e.g. the tolerance) it was computed
+with. Only matches of rows whose digest is not in the store are computed,
+matches of rows that are gone are dropped, and the stored records are
+expanded to the current rows and put into output order again.
+"""
+import hashlib
+import os
+import numpy
+
+
+def row_hashes(composition, symmetry, a, c):
+    """20 byte SHA-1 digests of the content of material rows.
+
+    Args:
+        composition, symmetry, a, c: columns of orientation_rules.database_columns()
+    Returns:
+        An "S20" array with one digest per row.
+    """
+    rows = zip(composition.tolist(), symmetry.tolist(), a.tolist(), c.tolist())
+    return numpy.array([hashlib.sha1("{}\t{}\t{!r}\t{!r}".format(*row).encode("utf-8")).digest() for row in rows],
+                       dtype="S20").reshape(-1)
+
+def load_store(file_name, settings):
+    """Arrays of a result store, None if there is no store or it was saved
+    with other settings.
+
+    Args:
+        file_name: name of the .npz store
+        settings: dict of setting name to value, compared as strings
+    Returns:
+        A dict of array name to array.
+    """
+    if not os.path.exists(file_name):
+        return None
+    with numpy.load(file_name) as store:
+        for name, value in settings.items():
+            if name not in store.files or str(store[name]) != str(value):
+                return None
+        return dict((name, store[name]) for name in store.files if name not in settings)
+
+def save_store(file_name, settings, arrays):
+    """Saves the arrays of a result store together with its settings."""
+    stored = dict((name, str(value)) for name, value in settings.items())
+    stored.update(arrays)
+    numpy.savez(file_name, **stored)
+
+def unique_rows(hashes):
+    """(digests, first row of each digest, digest number of every row) of the
+    distinct digests of some rows."""
+    digests, first, inverse = numpy.unique(hashes, return_index=True, return_inverse=True)
+    return digests, first, inverse.ravel()
+
+def digest_numbers(digests, hashes):
+    """Positions of hashes in the sorted digests, -1 where a hash is missing."""
+    if len(digests) == 0:
+        return numpy.full(len(hashes), -1, dtype=numpy.intp)
+    positions = numpy.minimum(numpy.searchsorted(digests, hashes), len(digests) - 1)
+    return numpy.where(digests[positions] == hashes, positions, -1)
+
+def within_group_rank(groups):
+    """Position of every element within its run of equal consecutive groups."""
+    if len(groups) == 0:
+        return numpy.zeros(0, dtype=numpy.intp)
+    starts = numpy.flatnonzero(numpy.concatenate([[True], groups[1:] != groups[:-1]]))
+    return numpy.arange(len(groups)) - numpy.repeat(starts, numpy.diff(numpy.append(starts, len(groups))))
+
+def expand_to_rows(numbers, row_numbers):
+    """Copies of every record for each current row with its content.
+
+    Args:
+        numbers: digest number of the row of every record
+        row_numbers: digest number of every current row (unique_rows())
+    Returns:
+        (records, rows): for every copy the position of its record and its
+        row, records in increasing order.
+    """
+    order = numpy.argsort(row_numbers, kind="stable")
+    counts = numpy.bincount(row_numbers)
+    starts = numpy.cumsum(counts) - counts
+    copies = counts[numbers]
+    records = numpy.repeat(numpy.arange(len(numbers)), copies)
+    offsets = numpy.repeat(starts[numbers] - (numpy.cumsum(copies) - copies), copies)
+    return records, order[offsets + numpy.arange(copies.sum())]
@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+###############################################################################
+##                           Substrate Length Index                          ##
+###############################################################################
+"""Indexed engine of lattice_matcher.py: only the film/substrate pairs that can
+pass an orientation rule are evaluated.
+
+The characteristic interface lengths of all substrates are sorted once
+(SubstrateLengthIndex) and the substrates a film can match are found with
+binary searches around the integer and 1/n multiples of its lengths. The
+candidate pairs are evaluated with the rules of orientation_rules.py and
+yield the same blocks as orientation_rules.match_blocks().
+"""
+import collections
+import time
+import numpy
+from material_catalog import SYMMETRIES
+from orientation_rules import (FILM_RULES, bounded_matches, database_columns, match_block, match_blocks,
+                               rule_criticals, rule_records, rule_stats, symmetry_stats)
+
+# Every rule needs at least one "anchor" term of the form
+#     (L_s - r*L_f)/L_s = 1 - r/(L_s/L_f),  r = n or 1/n for an integer n >= 1,
+# (times sub_a for the "scaled" terms whose parentheses differ from the rest)
+# where L_s is a characteristic length of the substrate and L_f one of the film.
+# |1 - r/rho| < t holds only for rho = L_s/L_f inside r/(1 + t) .. r/(1 - t), so
+# the substrates a film can match are found by binary searches of the sorted
+# substrate lengths around r*L_f for every possible r.
+
+# characteristic interface lengths of a material from its a and c
+INTERFACE_LENGTHS = {"a": lambda a, c: a,
+                     "a2": lambda a, c: numpy.sqrt(2.0)*a, # square face diagonal, 45 deg and (110)
+                     "a3": lambda a, c: numpy.sqrt(3.0)*a, # hexagonal a-plane side
+                     "c": lambda a, c: c,
+                     "r": lambda a, c: numpy.sqrt((c**2)+(3*(a**2)))} # hexagonal r-plane side
+
+# sub_length, film_length: INTERFACE_LENGTHS kinds of the anchor term
+# scaled: the term is multiplied by sub_a instead of divided by it
+Anchor = collections.namedtuple("Anchor", ["sub_length", "film_length", "scaled"])
+
+# anchor term of every rule of FILM_RULES, by (film symmetry, substrate symmetry)
+RULE_ANCHORS = {("C", "C"): [Anchor("a", "a", False), Anchor("a2", "a", False)],
+                ("C", "T"): [Anchor("a", "a", False), Anchor("a2", "a", False), Anchor("a", "a", False)],
+                ("C", "H"): [Anchor("a", "a2", False), Anchor("a3", "a", True), Anchor("a", "a", False)],
+                ("T", "C"): [Anchor("a", "a", False), Anchor("a2", "a", False), Anchor("a", "a", False)],
+                ("T", "T"): [Anchor("a", "a", False), Anchor("a2", "a", False), Anchor("a", "a", False)],
+                ("T", "H"): [Anchor("c", "c", False), Anchor("a", "a", False)],
+                ("H", "C"): [Anchor("a2", "a", True), Anchor("a", "a3", False), Anchor("a", "a", False)],
+                ("H", "T"): [Anchor("a", "a3", False), Anchor("a", "a", False)],
+                ("H", "H"): [Anchor("a", "a", False), Anchor("a", "a", False), Anchor("a", "a", False),
+                             Anchor("c", "r", False), Anchor("a", "a3", False)]}
+
+# relative widening of the ratio windows against rounding errors of the terms
+WINDOW_SLACK = 1e-9
+# the index falls back to the full scan above this effective tolerance ...
+MAX_INDEX_TOLERANCE = 0.5
+# ... or when a film would need more than this many ratio windows
+MAX_RATIO_WINDOWS = 2**16
+# candidates generated at once, in units of chunk_pairs
+INDEX_BLOCK_PAIRS = 8
+
+class SubstrateLengthIndex(object):
+    """Characteristic interface lengths of all substrates, sorted once.
+
+    The lengths of every (substrate symmetry, INTERFACE_LENGTHS kind) tag are
+    stored as one sorted segment of a single array. Lengths that are not
+    finite and positive are left out, anchor terms are NaN for them.
+
+    Args:
+        sub_sym, sub_a, sub_c: substrate columns of database_columns()
+        subs: row numbers of the substrates to index, all if not given
+    Attributes:
+        lengths: float64 lengths, sorted within each segment
+        rows: substrate row of each length
+        segments: dict of (symmetry, kind) to the (start, stop) of its segment
+        zeros: dict of (symmetry, kind) to the substrates with a zero length
+        negative: True if any length is negative, which the ratio windows
+                  cannot handle
+    """
+
+    def __init__(self, sub_sym, sub_a, sub_c, subs=None):
+        if subs is None:
+            subs = numpy.arange(len(sub_sym))
+        lengths, rows, self.segments, self.zeros = [], [], {}, {}
+        self.negative = False
+        start = 0
+        tags = sorted(set((sub, anchor.sub_length) for (film, sub), anchors in RULE_ANCHORS.items() for anchor in anchors))
+        for sym, kind in tags:
+            tagged = subs[sub_sym[subs] == sym]
+            values = INTERFACE_LENGTHS[kind](sub_a[tagged], sub_c[tagged])
+            self.negative = self.negative or bool(numpy.any(values < 0))
+            valid = numpy.isfinite(values) & (values > 0)
+            order = numpy.argsort(values[valid], kind="stable")
+            lengths.append(values[valid][order])
+            rows.append(tagged[valid][order])
+            self.segments[(sym, kind)] = (start, start + len(order))
+            self.zeros[(sym, kind)] = tagged[values == 0]
+            start += len(order)
+        self.lengths = numpy.concatenate(lengths)
+        self.rows = numpy.concatenate(rows)
+
+    def segment(self, sym, kind):
+        """(lengths, rows) of one tag."""
+        start, stop = self.segments[(sym, kind)]
+        return self.lengths[start:stop], self.rows[start:stop]
+
+def ratio_windows(lengths, film_lengths, tolerance):
+    """Windows of the ratio of a substrate length to a film length that
+    contain every ratio with |1 - r/rho| < t.
+
+    The windows r/(1 + t) .. r/(1 - t) of large integers r = n and of small
+    fractions r = 1/n overlap, so from the first overlapping one on (or the
+    end of the range of ratios) they are merged into one open window.
+
+    Args:
+        lengths: sorted substrate lengths
+        film_lengths: film lengths
+        tolerance: effective tolerance t, 0 < t < 1
+    Returns:
+        (low, high): float64 arrays of window bounds as ratios.
+    """
+    rho_min = lengths[0]/film_lengths.max()
+    rho_max = lengths[-1]/film_lengths.min()
+    last_integer = min(int(rho_max*(1 + tolerance)) + 2, int(numpy.ceil((1.0/tolerance - 1)/2)) + 1)
+    last_fraction = min(int(1.0/(rho_min*(1 - tolerance))) + 2, int(numpy.ceil((1 - tolerance)/(2*tolerance))) + 1)
+    ratios = numpy.concatenate([numpy.arange(1, last_integer, dtype=numpy.float64),
+                                1.0/numpy.arange(2, last_fraction, dtype=numpy.float64)])
+    low = numpy.concatenate([ratios/(1 + tolerance), [last_integer/(1 + tolerance), 0.0]])
+    high = numpy.concatenate([ratios/(1 - tolerance), [numpy.inf, 1.0/(last_fraction*(1 - tolerance))]])
+    return low, high
+
+def anchor_pairs(lengths, rows, film_lengths, films, tolerance, count_only=False):
+    """Substrate/film pairs whose length ratio lies in a ratio window.
+
+    Args:
+        lengths, rows: a SubstrateLengthIndex segment
+        film_lengths: lengths of the films, finite and positive
+        films: row numbers of the films
+        tolerance: effective tolerance t, 0 < t < MAX_INDEX_TOLERANCE
+        count_only: only count the pairs
+    Returns:
+        (sub_rows, film_rows) arrays of the candidate pairs (with duplicates
+        where windows overlap) or their number, None if there are too many
+        windows.
+    """
+    if len(lengths) == 0 or len(films) == 0:
+        return 0 if count_only else (numpy.zeros(0, dtype=numpy.intp), numpy.zeros(0, dtype=numpy.intp))
+    low, high = ratio_windows(lengths, film_lengths, tolerance)
+    if len(low) > MAX_RATIO_WINDOWS:
+        return None
+    sub_rows, film_rows, count = [], [], 0
+    films_per_query = max(1, 2**22 // len(low))
+    for first in range(0, len(films), films_per_query):
+        targets = film_lengths[first:first + films_per_query, None]
+        start = numpy.searchsorted(lengths, targets*low[None, :]*(1 - WINDOW_SLACK), side="left")
+        stop = numpy.searchsorted(lengths, targets*high[None, :]*(1 + WINDOW_SLACK), side="right")
+        counts = numpy.maximum(stop - start, 0).ravel()
+        total = counts.sum()
+        count += int(total)
+        if count_only:
+            continue
+        # positions start .. stop - 1 of every window, concatenated
+        offsets = numpy.repeat(start.ravel() - (numpy.cumsum(counts) - counts), counts)
+        sub_rows.append(rows[offsets + numpy.arange(total)])
+        film_rows.append(numpy.repeat(numpy.repeat(films[first:first + films_per_query], len(low)), counts))
+    if count_only:
+        return count
+    return numpy.concatenate(sub_rows), numpy.concatenate(film_rows)
+
+def candidate_codes(index, sub_a, film_sym, film_a, film_c, tolerance, count_only=False):
+    """Sorted codes sub_row*len(films) + film_row of every pair that can pass
+    an orientation rule at the tolerance.
+
+    Returns:
+        An int64 array, or with count_only an upper bound of its length. None
+        if the index cannot bound the candidates and the full scan has to be
+        used.
+    """
+    if index.negative:
+        return None
+    codes, count = [], 0
+    for (f_sym, s_sym), anchors in sorted(RULE_ANCHORS.items()):
+        fims = numpy.flatnonzero(film_sym == f_sym)
+        for anchor in set(anchors):
+            lengths, rows = index.segment(s_sym, anchor.sub_length)
+            film_lengths = INTERFACE_LENGTHS[anchor.film_length](film_a[fims], film_c[fims])
+            if numpy.any(film_lengths < 0):
+                return None
+            valid = numpy.isfinite(film_lengths) & (film_lengths > 0)
+            effective = tolerance
+            if anchor.scaled and len(rows):
+                # |1 - r/rho|*sub_a < tolerance needs |1 - r/rho| < tolerance/sub_a
+                effective = tolerance/sub_a[rows].min()
+            if not effective > 0:
+                continue # nothing passes a tolerance of zero or less
+            if effective >= MAX_INDEX_TOLERANCE:
+                return None
+            pairs = anchor_pairs(lengths, rows, film_lengths[valid], fims[valid], effective, count_only)
+            if pairs is None:
+                return None
+            # r = 0 and sub_a = 0 make a scaled term exactly zero
+            zeros = index.zeros[(s_sym, anchor.sub_length)] if anchor.scaled else numpy.zeros(0, dtype=numpy.intp)
+            if count_only:
+                count += pairs + len(zeros)*len(fims)
+                continue
+            codes.append(pairs[0].astype(numpy.int64)*len(film_a) + pairs[1])
+            codes.append((zeros.astype(numpy.int64)[:, None]*len(film_a) + fims[None, :]).ravel())
+    if count_only:
+        return count
+    if not codes:
+        return numpy.zeros(0, dtype=numpy.int64)
+    codes = numpy.concatenate(codes)
+    codes.sort()
+    # drop the pairs found by more than one window or anchor
+    first = numpy.ones(len(codes), dtype=bool)
+    first[1:] = codes[1:] != codes[:-1]
+    return codes[first]
+
+def indexed_match_blocks(film_database, substrate_database, tolerance, chunk_pairs=2**20, stats=None, pair_rows=False, film_bounds=None):
+    """Same as match_blocks(), but only the candidate pairs found with a
+    SubstrateLengthIndex are evaluated. Falls back to match_blocks() when the
+    index cannot bound the candidates (negative lengths or a very large
+    tolerance).
+
+    Args:
+        film_database: structured array of film materials (material_catalog.py)
+        substrate_database: structured array of substrate materials
+        tolerance: tolerance level for mismatch as a decimal
+        chunk_pairs: maximum number of candidate pairs evaluated at once,
+                     candidates are generated for blocks of substrates with
+                     at most INDEX_BLOCK_PAIRS*chunk_pairs candidates
+        stats: optional match_stats.MatchStats counting the evaluated pairs
+        pair_rows: also yield the substrate and film row of every match
+        film_bounds: optional bound of the absolute mismatch of every film
+                     row, see match_blocks()
+    Yields:
+        (records, critical) blocks as match_blocks() does.
+    """
+    film_comp, film_sym, film_a, film_c = database_columns(film_database)
+    sub_comp, sub_sym, sub_a, sub_c = database_columns(substrate_database)
+    index = SubstrateLengthIndex(sub_sym, sub_a, sub_c)
+    count = candidate_codes(index, sub_a, film_sym, film_a, film_c, tolerance, count_only=True)
+    if count is None:
+        for block in match_blocks(film_database, substrate_database, tolerance, chunk_pairs, stats, pair_rows, film_bounds):
+            yield block
+        return
+    blocks = max(1, -(-count // (INDEX_BLOCK_PAIRS*chunk_pairs)))
+    for subs_block in numpy.array_split(numpy.arange(len(sub_comp)), blocks):
+        started = time.perf_counter() if stats is not None else None
+        if blocks > 1:
+            # a block index never needs more windows or a larger tolerance than the full one
+            index = SubstrateLengthIndex(sub_sym, sub_a, sub_c, subs_block)
+        codes = candidate_codes(index, sub_a, film_sym, film_a, film_c, tolerance)
+        if stats is not None:
+            stats.add("index", (), candidates=len(codes), seconds=time.perf_counter() - started)
+        for block in evaluate_candidates(codes, film_comp, film_sym, film_a, film_c, sub_comp, sub_sym, sub_a, sub_c, tolerance, chunk_pairs,
+                                         stats, pair_rows, film_bounds):
+            yield block
+
+def symmetry_codes(symmetry):
+    """Position of each symmetry label in SYMMETRIES. Unknown labels get
+    -len(SYMMETRIES)**2, which keeps sub*len(SYMMETRIES) + film negative."""
+    codes = numpy.full(len(symmetry), -len(SYMMETRIES)**2, dtype=numpy.int64)
+    for k, sym in enumerate(SYMMETRIES):
+        codes[symmetry == sym] = k
+    return codes
+
+def evaluate_candidates(codes, film_comp, film_sym, film_a, film_c, sub_comp, sub_sym, sub_a, sub_c, tolerance, chunk_pairs, stats=None, pair_rows=False,
+                        film_bounds=None):
+    """Evaluates the orientation rules for sorted candidate codes of
+    candidate_codes() and yields (records, critical) blocks of the matches
+    in the order of match_blocks(), counting into stats if given, with the
+    pair rows if pair_rows is set and below the film_bounds if given."""
+    sub_code, film_code = symmetry_codes(sub_sym), symmetry_codes(film_sym)
+    for start in range(0, len(codes), chunk_pairs):
+        subs_all, fims_all = numpy.divmod(codes[start:start + chunk_pairs], len(film_comp))
+        groups = sub_code[subs_all]*len(SYMMETRIES) + film_code[fims_all]
+        sub_index, film_index, rule_index, records, criticals = [], [], [], [], []
+        for s, s_sym in enumerate(SYMMETRIES):
+            for f, f_sym in enumerate(SYMMETRIES):
+                group = numpy.flatnonzero(groups == s*len(SYMMETRIES) + f)
+                if len(group) == 0:
+                    continue
+                subs, fims = subs_all[group], fims_all[group]
+                shape = (len(group),)
+                started = time.perf_counter() if stats is not None else None
+                skip = (sub_comp[subs] == film_comp[fims]) if s_sym == f_sym else numpy.zeros(shape, dtype=bool)
+                with numpy.errstate(divide="ignore", invalid="ignore"):
+                    rules = FILM_RULES[f_sym](s_sym, sub_a[subs], sub_c[subs], film_a[fims], film_c[fims])
+                    if stats is not None:
+                        symmetry_stats(stats, f_sym, s_sym, skip, started)
+                    for r, rule in enumerate(rules):
+                        started = time.perf_counter() if stats is not None else None
+                        critical = numpy.broadcast_to(rule_criticals(rule, skip), shape)
+                        mask = critical < tolerance
+                        if film_bounds is not None:
+                            mask &= bounded_matches(rule, shape, film_bounds[fims])
+                        if mask.any():
+                            sub_index.append(subs[mask])
+                            film_index.append(fims[mask])
+                            rule_index.append(numpy.full(mask.sum(), r))
+                            records.append(rule_records(rule, mask, shape, film_comp[fims[mask]], f_sym, sub_comp[subs[mask]], s_sym))
+                            criticals.append(critical[mask])
+                        if stats is not None:
+                            rule_stats(stats, f_sym, s_sym, r, rule, skip, tolerance, started)
+        if not records:
+            continue
+        # the codes are sorted by substrate and film, restore the rule order within each pair
+        order = numpy.lexsort((numpy.concatenate(rule_index), numpy.concatenate(film_index), numpy.concatenate(sub_index)))
+        yield match_block(records, criticals, sub_index, film_index, order, pair_rows)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+###############################################################################
+##                              Supercell Search                             ##
+###############################################################################
+"""Domain matches of m film cells on n substrate cells, the --supercell search
+of lattice_matcher.py.
+"""
+import collections
+import time
+import numpy
+from match_output import concatenate_records, supercell_match_records
+from match_stats import MatchStats
+from material_catalog import SYMMETRIES
+from orientation_rules import database_columns
+from parallel_shards import map_shards, shard_bounds, worker_arrays, worker_state
+from substrate_index import INTERFACE_LENGTHS, WINDOW_SLACK
+
+# m film cells on n substrate cells along an interface direction leave the
+# mismatch (n*L_s - m*L_f)/(n*L_s) = 1 - q/rho with q = m/n and rho = L_s/L_f,
+# the form of the rule terms above with q = round_ratio(rho). Every reduced q
+# with m, n up to the largest supercell is kept in one sorted table, so the
+# q with |1 - q/rho| < t, i.e. rho*(1 - t) < q < rho*(1 + t), are found with
+# two binary searches per pair and direction.
+
+SupercellRule = collections.namedtuple("SupercellRule", ["film_tag", "sub_tag", "directions"])
+
+# orientations of FILM_RULES by (film symmetry, substrate symmetry) with the
+# INTERFACE_LENGTHS kinds (substrate, film) of each interface direction
+SUPERCELL_RULES = {("C", "C"): [SupercellRule("", "", [("a", "a")]),
+                                SupercellRule(" (45 deg)", "", [("a2", "a")])],
+                   ("C", "T"): [SupercellRule("", "", [("a", "a")]),
+                                SupercellRule(" (45 deg)", "", [("a2", "a")]),
+                                SupercellRule(" (110)", " (a-plane)", [("a", "a"), ("c", "a2")])],
+                   ("C", "H"): [SupercellRule(" (111)", "", [("a", "a2")]),
+                                SupercellRule(" (110)", " (a-plane)", [("a3", "a"), ("c", "a2")]),
+                                SupercellRule(" (110)", " (r-plane)", [("a", "a"), ("r", "a2")])],
+                   ("T", "C"): [SupercellRule("", "", [("a", "a")]),
+                                SupercellRule(" (45 deg)", "", [("a2", "a")]),
+                                SupercellRule(" (a-plane)", " (110)", [("a", "a"), ("a2", "c")])],
+                   ("T", "T"): [SupercellRule("", "", [("a", "a")]),
+                                SupercellRule(" (45 deg)", "", [("a2", "a")]),
+                                SupercellRule(" (a-plane)", " (a-plane)", [("a", "a"), ("c", "c")])],
+                   ("T", "H"): [SupercellRule(" (a-plane)", " (a-plane)", [("a3", "a"), ("c", "c")]),
+                                SupercellRule(" (a-plane)", " (r-plane)", [("a", "a"), ("r", "c")])],
+                   ("H", "C"): [SupercellRule("", " (111)", [("a2", "a")]),
+                                SupercellRule(" (a-plane)", " (110)", [("a", "a3"), ("a2", "c")]),
+                                SupercellRule(" (r-plane)", " (110)", [("a", "a"), ("a2", "r")])],
+                   ("H", "T"): [SupercellRule(" (a-plane)", " (a-plane)", [("a", "a3"), ("c", "c")]),
+                                SupercellRule(" (r-plane)", " (a-plane)", [("a", "a"), ("c", "r")])],
+                   ("H", "H"): [SupercellRule("", "", [("a", "a")]),
+                                SupercellRule(" (a-plane)", " (a-plane)", [("a", "a"), ("c", "c")]),
+                                SupercellRule(" (r-plane)", " (r-plane)", [("a", "a"), ("r", "r")]),
+                                SupercellRule(" (r-plane)", " (a-plane)", [("a3", "a"), ("c", "r")]),
+                                SupercellRule(" (a-plane)", " (r-plane)", [("a", "a3"), ("r", "c")])]}
+
+def farey_ratios(max_cells):
+    """Reduced fractions m/n with 1 <= m, n <= max_cells in increasing order.
+
+    The fractions up to 1 are the Farey sequence of order max_cells, each
+    found from its two predecessors; the ones above 1 are their reciprocals.
+
+    Returns:
+        (ratios, film_cells, substrate_cells): float64 values m/n and int64
+        numerators m and denominators n.
+    """
+    numerators, denominators = [], []
+    a, b, c, d = 0, 1, 1, max_cells
+    while c <= d:
+        numerators.append(c)
+        denominators.append(d)
+        k = (max_cells + b) // d
+        a, b, c, d = c, d, k*c - a, k*d - b
+    film_cells = numpy.array(numerators + denominators[-2::-1], dtype=numpy.int64)
+    substrate_cells = numpy.array(denominators + numerators[-2::-1], dtype=numpy.int64)
+    return film_cells/substrate_cells.astype(numpy.float64), film_cells, substrate_cells
+
+def direction_supercells(sub_lengths, film_lengths, tolerance, ratios, film_cells, substrate_cells):
+    """Supercells of one interface direction with a mismatch below the
+    tolerance for arrays of pairs.
+
+    Args:
+        sub_lengths, film_lengths: float64 lengths of the pairs
+        tolerance: tolerance level for mismatch as a decimal
+        ratios, film_cells, substrate_cells: the table of farey_ratios()
+    Returns:
+        (pairs, positions, mismatch): pair and ratio table position of every
+        supercell, ordered by pair and ratio, and its mismatch.
+    """
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        rho = sub_lengths/film_lengths
+    valid = numpy.isfinite(rho) & (rho > 0)
+    rho = numpy.where(valid, rho, 1.0)
+    start = numpy.searchsorted(ratios, rho*(1 - tolerance)*(1 - WINDOW_SLACK), side="left")
+    stop = numpy.searchsorted(ratios, rho*(1 + tolerance)*(1 + WINDOW_SLACK), side="right")
+    counts = numpy.where(valid, numpy.maximum(stop - start, 0), 0)
+    total = counts.sum()
+    pairs = numpy.repeat(numpy.arange(len(rho)), counts)
+    positions = numpy.repeat(start - (numpy.cumsum(counts) - counts), counts) + numpy.arange(total)
+    # the windows are widened against rounding, the exact mismatch decides
+    cells = substrate_cells[positions]*sub_lengths[pairs]
+    mismatch = (cells - film_cells[positions]*film_lengths[pairs])/cells
+    keep = abs(mismatch) < tolerance
+    return pairs[keep], positions[keep], mismatch[keep]
+
+def rule_supercells(rule, sub_a, sub_c, film_a, film_c, tolerance, table):
+    """Supercells of an orientation for arrays of pairs, every combination of
+    the supercells of its interface directions.
+
+    Returns:
+        (pairs, columns): the pair of every match, ordered by pair and the
+        ratios of its directions, and the columns of
+        match_output.supercell_match_records().
+    """
+    ratios, film_cells, substrate_cells = table
+    pairs, columns = None, []
+    for sub_kind, film_kind in rule.directions:
+        sub_lengths = INTERFACE_LENGTHS[sub_kind](sub_a, sub_c)
+        film_lengths = INTERFACE_LENGTHS[film_kind](film_a, film_c)
+        found, positions, mismatch = direction_supercells(sub_lengths, film_lengths, tolerance, ratios, film_cells, substrate_cells)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            direction = [mismatch, film_cells[positions], substrate_cells[positions], sub_lengths[found]/film_lengths[found]]
+        if pairs is None:
+            pairs, columns = found, direction
+            continue
+        # each earlier combination of a pair with each supercell of this direction
+        counts = numpy.bincount(found, minlength=len(sub_a))
+        starts = numpy.cumsum(counts) - counts
+        copies = counts[pairs]
+        earlier = numpy.repeat(numpy.arange(len(pairs)), copies)
+        later = numpy.repeat(starts[pairs] - (numpy.cumsum(copies) - copies), copies) + numpy.arange(copies.sum())
+        pairs = pairs[earlier]
+        columns = [column[earlier] for column in columns] + [column[later] for column in direction]
+    return pairs, columns
+
+def supercell_blocks(film_database, substrate_database, tolerance, max_cells, chunk_pairs=2**20, stats=None):
+    """Finds the supercells of every orientation for blocks of substrates
+    against all films.
+
+    Args:
+        film_database: structured array of film materials (material_catalog.py)
+        substrate_database: structured array of substrate materials
+        tolerance: tolerance level for mismatch as a decimal
+        max_cells: largest number of film or substrate cells along an
+                   interface direction
+        chunk_pairs: maximum number of film/substrate pairs per block
+        stats: optional match_stats.MatchStats counting the evaluated pairs
+    Yields:
+        match_output.supercell_match_records() of each block of substrates
+        with matches, in substrate, film, orientation, ratio order.
+    """
+    film_comp, film_sym, film_a, film_c = database_columns(film_database)
+    sub_comp, sub_sym, sub_a, sub_c = database_columns(substrate_database)
+    table = farey_ratios(max_cells)
+    films = dict((sym, numpy.flatnonzero(film_sym == sym)) for sym in SYMMETRIES)
+    chunk_rows = max(1, chunk_pairs // max(1, len(film_comp)))
+    for start in range(0, len(sub_comp), chunk_rows):
+        chunk = numpy.arange(start, min(start + chunk_rows, len(sub_comp)))
+        sub_index, film_index, rule_index, records = [], [], [], []
+        for s_sym in SYMMETRIES:
+            subs = chunk[sub_sym[chunk] == s_sym]
+            for f_sym in SYMMETRIES:
+                fims = films[f_sym]
+                rules = SUPERCELL_RULES.get((f_sym, s_sym), [])
+                if len(subs) == 0 or len(fims) == 0 or not rules:
+                    continue
+                s = numpy.repeat(subs, len(fims))
+                f = numpy.tile(fims, len(subs))
+                if s_sym == f_sym:
+                    # identical materials are never compared against each other
+                    different = sub_comp[s] != film_comp[f]
+                    s, f = s[different], f[different]
+                for r, rule in enumerate(rules):
+                    started = time.perf_counter() if stats is not None else None
+                    pairs, columns = rule_supercells(rule, sub_a[s], sub_c[s], film_a[f], film_c[f], tolerance, table)
+                    if len(pairs):
+                        sub_index.append(s[pairs])
+                        film_index.append(f[pairs])
+                        rule_index.append(numpy.full(len(pairs), r))
+                        records.append(supercell_match_records(film_comp[f[pairs]], f_sym + rule.film_tag, sub_comp[s[pairs]], s_sym + rule.sub_tag, columns))
+                    if stats is not None:
+                        stats.add("rules", (("film_symmetry", f_sym + rule.film_tag), ("substrate_symmetry", s_sym + rule.sub_tag)),
+                                  pairs_evaluated=len(s), seconds=time.perf_counter() - started)
+        if not records:
+            continue
+        # substrate, film, orientation order; the stable sort keeps the ratio order
+        order = numpy.lexsort((numpy.concatenate(rule_index), numpy.concatenate(film_index), numpy.concatenate(sub_index)))
+        yield concatenate_records(records)[order]
+
+def supercell_shard(bounds):
+    """Worker of parallel_supercell_blocks(): the record blocks of the
+    substrates bounds[0]:bounds[1] and the MatchStats.tables of the shard,
+    None without stats."""
+    arrays, state = worker_arrays(), worker_state()
+    stats = MatchStats() if state["stats"] else None
+    blocks = list(supercell_blocks(arrays["films"], arrays["substrates"][bounds[0]:bounds[1]], state["tolerance"],
+                                   state["max_cells"], state["chunk_pairs"], stats))
+    return blocks, stats.tables if stats is not None else None
+
+def parallel_supercell_blocks(film_database, substrate_database, tolerance, max_cells, chunk_pairs=2**20, jobs=1, stats=None):
+    """supercell_blocks() on shards of the substrates in a process pool, see
+    parallel_match_blocks()."""
+    if jobs <= 1:
+        for block in supercell_blocks(film_database, substrate_database, tolerance, max_cells, chunk_pairs, stats):
+            yield block
+        return
+    substrate_database = numpy.atleast_1d(substrate_database)
+    arrays = {"films": numpy.atleast_1d(film_database), "substrates": substrate_database}
+    state = {"tolerance": tolerance, "max_cells": max_cells, "chunk_pairs": chunk_pairs, "stats": stats is not None}
+    for blocks, tables in map_shards(supercell_shard, shard_bounds(len(substrate_database), jobs), jobs, arrays, state):
+        if tables:
+            stats.merge(tables)
+        for block in blocks:
+            yield block
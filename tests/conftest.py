@@ -0,0 +1,33 @@
+"""Fixtures of the tests: a working directory with the bundled material files
+and a small III-V database, since the command line tools write their results
+next to their inputs."""
+import os
+import shutil
+import pytest
+import composition_database
+import iii_v_generator
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#material files of the repository used by the tests
+CATALOGS = ("cubic", "tetragonal", "hexagonal")
+
+@pytest.fixture(scope="session")
+def database_dir(tmp_path_factory):
+    """Directory with a 10 percent III-V database as db.npz and as compact
+    databases with (db.cdb) and without (db_no_a.cdb) lattice constants."""
+    directory = tmp_path_factory.mktemp("databases")
+    iii_v_generator.main(["10", str(directory / "db.npz")])
+    composition_database.npz_to_compact(str(directory / "db.npz"), str(directory / "db.cdb"))
+    composition_database.npz_to_compact(str(directory / "db.npz"), str(directory / "db_no_a.cdb"), store_a=False)
+    return directory
+
+@pytest.fixture
+def work_dir(tmp_path, monkeypatch, database_dir):
+    """Working directory holding copies of the material files and databases."""
+    for name in CATALOGS:
+        shutil.copy(os.path.join(REPOSITORY, name + ".txt"), str(tmp_path))
+    for name in os.listdir(str(database_dir)):
+        shutil.copy(str(database_dir / name), str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
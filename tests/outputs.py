@@ -0,0 +1,21 @@
+"""Output files of the command line tools read back for comparison, shared by
+the tests of every engine and option."""
+import composition_calculator
+import lattice_matcher
+
+#film and substrate material files matched by the lattice engine tests
+LATTICE_PAIRS = [("cubic", "hexagonal"), ("cubic", "cubic"), ("tetragonal", "cubic"),
+                 ("hexagonal", "cubic"), ("hexagonal", "tetragonal"), ("tetragonal", "hexagonal")]
+
+def lattice_output(film, substrate, *options, tolerance="0.05"):
+    """Bytes of the tsv file lattice_matcher.py writes for two material files."""
+    lattice_matcher.main([film + ".txt", substrate + ".txt", tolerance] + list(options))
+    with open("{}_on_{}.txt".format(film, substrate), "rb") as output_file:
+        return output_file.read()
+
+def composition_output(substrate, *arguments):
+    """Bytes of the tsv file composition_calculator.py writes for a material
+    file."""
+    composition_calculator.main([substrate + ".txt"] + list(arguments) + ["--tolerance", "0.02"])
+    with open("composition_matches_for_{}.txt".format(substrate), "rb") as output_file:
+        return output_file.read()
@@ -0,0 +1,71 @@
+"""alloy_generator.py: the databases of JSON alloy specs against Vegard's law
+evaluated composition by composition, and read by composition_calculator.py."""
+import itertools
+import json
+import os
+import numpy
+import pytest
+import alloy_generator
+from tests.outputs import composition_output
+
+SPEC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "iii_v.json")
+
+#a II-VI alloy with a bowing term, from the constants of ZnS, ZnSe, ZnTe, CdS, CdSe and CdTe
+II_VI = {"sublattices": [["Zn", "Cd"], ["S", "Se", "Te"]],
+         "lattice_constants": [[5.4102, 5.6676, 6.1037], [5.8320, 6.0520, 6.4810]],
+         "bowing": [{"species": ["Zn", "Cd"], "with": ["Te"], "value": 0.1}]}
+
+def vegard(spec, fractions):
+    """Lattice constant of one composition given as one list of decimal
+    fractions per sublattice."""
+    a = 0.0
+    for species in itertools.product(*[range(len(sublattice)) for sublattice in spec["sublattices"]]):
+        term = numpy.prod([fractions[k][i] for k, i in enumerate(species)])
+        a += term*numpy.array(spec["lattice_constants"])[species]
+    positions = dict((name, (k, i)) for k, sublattice in enumerate(spec["sublattices"]) for i, name in enumerate(sublattice))
+    for term in spec.get("bowing", []):
+        a -= term["value"]*numpy.prod([fractions[positions[name][0]][positions[name][1]] for name in term["species"] + term.get("with", [])])
+    return a
+
+def write_spec(file_name, spec):
+    with open(file_name, "w") as spec_file:
+        json.dump(spec, spec_file)
+
+def test_iii_v_spec_reproduces_iii_v_generator(work_dir):
+    alloy_generator.main([SPEC, "10", "alloy.npz"])
+    with numpy.load("alloy.npz") as alloy, numpy.load("db.npz") as database:
+        assert alloy["arr_0"].tobytes() == database["arr_0"].tobytes()
+        assert alloy["fields"].tolist() == ["x_Al", "x_Ga", "x_In", "y_P", "y_As", "y_Sb"]
+
+@pytest.mark.parametrize("spec", [II_VI, dict(II_VI, fixed={"Se": 20})])
+def test_database_follows_vegards_law(work_dir, spec):
+    write_spec("alloy.json", spec)
+    alloy_generator.main(["alloy.json", "5", "alloy.npz"])
+    rows = numpy.load("alloy.npz")["arr_0"]
+    fixed = spec.get("fixed", {})
+    # 21 Zn/Cd splits times the S/Se/Te splits in steps of 5 percent, or the S/Te splits of the other 80 percent
+    assert len(rows) == 21*(17 if fixed else 231)
+    assert len(numpy.unique(rows[:, :-1], axis=0)) == len(rows)
+    numpy.testing.assert_allclose(rows[:, 0:2].sum(axis=1), 1, atol=1e-6)
+    numpy.testing.assert_allclose(rows[:, 2:5].sum(axis=1), 1, atol=1e-6)
+    if fixed:
+        numpy.testing.assert_allclose(rows[:, 3], 0.2, atol=1e-6)
+    expected = [vegard(spec, [row[0:2].astype(numpy.float64), row[2:5].astype(numpy.float64)]) for row in rows]
+    numpy.testing.assert_allclose(rows[:, -1], expected, rtol=1e-6)
+
+def test_composition_calculator_reads_alloy_databases(work_dir):
+    write_spec("alloy.json", II_VI)
+    alloy_generator.main(["alloy.json", "5", "alloy.npz"])
+    expected = composition_output("cubic", "alloy.npz", "--no-index")
+    lines = expected.decode().splitlines()[1:]
+    assert lines and all(line.startswith("Zn") and "Cd" in line and "Te" in line for line in lines)
+    for arguments in (["alloy.npz"], ["alloy.npz", "--stream", "--chunk-rows", "1000"], ["alloy.npz", "--jobs", "2"]):
+        assert composition_output("cubic", *arguments) == expected, arguments
+
+@pytest.mark.parametrize("spec", [dict(II_VI, lattice_constants=[[5.4, 5.6], [5.8, 6.0]]),
+                                  dict(II_VI, fixed={"Se": 120}),
+                                  dict(II_VI, bowing=[{"species": ["Zn", "Se"], "value": 0.1}]),
+                                  dict(II_VI, sublattices=[["Zn", "Cd"], ["S", "Zn", "Te"]])])
+def test_inconsistent_specs_are_rejected(spec):
+    with pytest.raises(ValueError):
+        alloy_generator.alloy_database(alloy_generator.parse_spec(spec), 5)
@@ -0,0 +1,97 @@
+"""The writer thread of --write-queue and --compress: the text files are the
+same with any queue and decompress to the uncompressed files."""
+import gzip
+import lzma
+import numpy
+import pytest
+import composition_calculator
+import lattice_matcher
+from match_output import BackgroundMatchWriter, RecordCollector
+from tests.outputs import LATTICE_PAIRS, composition_output, lattice_output
+
+#decompressing readers and suffixes of --compress
+DECOMPRESSORS = {"gzip": (gzip.open, ".gz"), "xz": (lzma.open, ".xz")}
+
+def decompressed(file_name, compression):
+    opener, suffix = DECOMPRESSORS[compression]
+    assert file_name.endswith(".txt" + suffix)
+    with opener(file_name, "rb") as compressed_file:
+        return compressed_file.read()
+
+@pytest.mark.parametrize("film, substrate", LATTICE_PAIRS)
+def test_lattice_write_queues(work_dir, film, substrate):
+    expected = lattice_output(film, substrate, "--engine", "scalar")
+    assert expected.count(b"\n") > 1
+    for options in (["--write-queue", "0"], ["--write-queue", "1"], ["--engine", "vectorized", "--chunk-pairs", "1000", "--write-queue", "1"]):
+        assert lattice_output(film, substrate, *options) == expected, options
+
+@pytest.mark.parametrize("substrate", ["cubic", "tetragonal", "hexagonal"])
+def test_composition_write_queues(work_dir, substrate):
+    expected = composition_output(substrate, "db.npz", "--no-index")
+    assert expected.count(b"\n") > 1
+    for arguments in (["db.npz", "--write-queue", "0"], ["db.npz", "--write-queue", "1"], ["db.npz", "--stream", "--chunk-rows", "1000", "--write-queue", "1"]):
+        assert composition_output(substrate, *arguments) == expected, arguments
+
+def test_batches_written_in_order():
+    collector = RecordCollector()
+    writer = BackgroundMatchWriter(collector, 1)
+    batches = [numpy.arange(k, k + 3) for k in range(0, 300, 3)]
+    for batch in batches:
+        writer.write(batch)
+    writer.write(numpy.zeros(0))
+    writer.close()
+    numpy.testing.assert_array_equal(numpy.concatenate(collector.batches), numpy.arange(300))
+
+def test_writer_errors_raised():
+    class FailingWriter(object):
+        def write(self, records):
+            raise IOError("disk full")
+
+        def close(self):
+            pass
+
+    writer = BackgroundMatchWriter(FailingWriter(), 1)
+    writer.write(numpy.arange(3))
+    with pytest.raises(IOError):
+        writer.close()
+
+@pytest.mark.parametrize("compression", sorted(DECOMPRESSORS))
+def test_compressed_lattice_output(work_dir, compression):
+    expected = lattice_output("cubic", "hexagonal")
+    lattice_matcher.main(["cubic.txt", "hexagonal.txt", "0.05", "--compress", compression])
+    file_name = "cubic_on_hexagonal.txt" + DECOMPRESSORS[compression][1]
+    assert decompressed(file_name, compression) == expected
+    with open(file_name, "rb") as compressed_file:
+        first = compressed_file.read()
+    # the same matches give the same file
+    lattice_matcher.main(["cubic.txt", "hexagonal.txt", "0.05", "--compress", compression, "--write-queue", "0"])
+    with open(file_name, "rb") as compressed_file:
+        assert compressed_file.read() == first
+    lattice_matcher.main(["cubic.txt", "hexagonal.txt", "0.02", "--supercell", "2", "--compress", compression])
+    supercells = decompressed("cubic_on_hexagonal_supercells.txt" + DECOMPRESSORS[compression][1], compression)
+    lattice_matcher.main(["cubic.txt", "hexagonal.txt", "0.02", "--supercell", "2"])
+    with open("cubic_on_hexagonal_supercells.txt", "rb") as text_file:
+        assert supercells == text_file.read()
+
+@pytest.mark.parametrize("compression", sorted(DECOMPRESSORS))
+def test_compressed_composition_output(work_dir, compression):
+    suffix = DECOMPRESSORS[compression][1]
+    for arguments in (["db.npz"], ["db.npz", "--stream", "--chunk-rows", "1000"], ["db.npz", "--top-k", "3"]):
+        expected = composition_output("cubic", *arguments)
+        composition_output("cubic", *(arguments + ["--compress", compression]))
+        assert decompressed("composition_matches_for_cubic.txt" + suffix, compression) == expected, arguments
+    pairs = ["cubic.txt", "db.npz", "--tolerance", "0.0002", "--pairs", "1.5", "--tensile-mismatch", "0.005", "--compressive-mismatch", "0.005"]
+    composition_calculator.main(pairs)
+    with open("composition_pairs_for_cubic.txt", "rb") as text_file:
+        expected = text_file.read()
+    composition_calculator.main(pairs + ["--compress", compression])
+    assert decompressed("composition_pairs_for_cubic.txt" + suffix, compression) == expected
+
+def test_compress_only_text(work_dir):
+    with pytest.raises(SystemExit):
+        lattice_matcher.main(["cubic.txt", "hexagonal.txt", "0.05", "--compress", "gzip", "--output-format", "npy"])
+    for options in (["--output-format", "npz"], ["--summary", "10"]):
+        with pytest.raises(SystemExit):
+            composition_calculator.main(["cubic.txt", "db.npz", "--compress", "xz"] + options)
+    with pytest.raises(SystemExit):
+        lattice_matcher.main(["cubic.txt", "hexagonal.txt", "0.05", "--write-queue", "-1"])
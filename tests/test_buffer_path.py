@@ -0,0 +1,93 @@
+"""buffer_path.py: every step of a buffer within --step-mismatch, the fewest
+layers against a breadth first search of the database and the smoothest
+buffer against all buffers of two layers."""
+import contextlib
+import io
+import os
+import numpy
+import pytest
+import buffer_path
+from composition_calculator import composition_fields, load_lattice_index
+from composition_database import load_database
+
+#(start, target, step mismatch) of the tested buffers, growing and shrinking
+BUFFERS = [(5.6533, 5.8687, 0.01), (5.8687, 5.6533, 0.01), (5.6533, 6.0583, 0.02), (6.0583, 5.4505, 0.015)]
+
+def load(database):
+    lattice_consts = load_database(database)
+    return lattice_consts, load_lattice_index(database, lattice_consts), buffer_path.load_composition_grid(database, lattice_consts)
+
+def window(a, lower, upper):
+    return (a > lower) & (a < upper)
+
+def fewest_layers(a, start, target, step_mismatch, target_tolerance, max_layers=50):
+    """Breadth first search over the database: layers of the shortest chain of
+    rows from start to the target window."""
+    reached = window(a, (1 - step_mismatch)*start, (1 + step_mismatch)*start)
+    for layers in range(1, max_layers + 1):
+        if window(a[reached], (1 - target_tolerance)*target, (1 + target_tolerance)*target).any():
+            return layers
+        below = a[reached]
+        reached = window(a[:, None], (1 - step_mismatch)*below, (1 + step_mismatch)*below).any(axis=1)
+    return None
+
+def run_cli(*arguments):
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        buffer_path.main(list(arguments))
+    return output.getvalue()
+
+@pytest.mark.parametrize("start, target, step_mismatch", BUFFERS)
+def test_buffer_steps(work_dir, start, target, step_mismatch):
+    lattice_consts, index, grid = load("db.npz")
+    a = lattice_consts[:, -1].astype(numpy.float64)
+    path = buffer_path.buffer_path(lattice_consts, index, grid, start, target, step_mismatch)
+    layers = numpy.concatenate([[start], a[path.rows]])
+    assert (abs(layers[1:]/layers[:-1] - 1) < step_mismatch).all()
+    assert abs(layers[-1]/target - 1) < 0.001
+    assert len(path.rows) == fewest_layers(a, start, target, step_mismatch, 0.001)
+    numpy.testing.assert_array_equal(path.layers, lattice_consts[path.rows])
+    fractions = lattice_consts[path.rows, :len(composition_fields(lattice_consts))].astype(numpy.float64)
+    assert path.cost == pytest.approx(abs(numpy.diff(fractions, axis=0)).sum()/2)
+
+def test_smoothest_buffer_of_two_layers(work_dir):
+    lattice_consts, index, grid = load("db.npz")
+    start, target, step_mismatch = 5.6533, 5.75, 0.01
+    # a beam and branch wider than the database search every buffer
+    path = buffer_path.buffer_path(lattice_consts, index, grid, start, target, step_mismatch, beam=10**6, branch=10**6)
+    assert len(path.rows) == 2
+    a = lattice_consts[:, -1].astype(numpy.float64)
+    fractions = lattice_consts[:, :len(composition_fields(lattice_consts))].astype(numpy.float64)
+    first = numpy.flatnonzero(window(a, (1 - step_mismatch)*start, (1 + step_mismatch)*start))
+    second = numpy.flatnonzero(window(a, 0.999*target, 1.001*target))
+    steps = window(a[second][None, :], (1 - step_mismatch)*a[first][:, None], (1 + step_mismatch)*a[first][:, None])
+    changes = abs(fractions[first][:, None, :] - fractions[second][None, :, :]).sum(axis=2)/2
+    assert steps.any()
+    assert path.cost == pytest.approx(changes[steps].min())
+
+def test_given_number_of_layers(work_dir):
+    lattice_consts, index, grid = load("db.npz")
+    path = buffer_path.buffer_path(lattice_consts, index, grid, 5.6533, 5.8687, 0.01, layers=6)
+    layers = numpy.concatenate([[5.6533], lattice_consts[path.rows, -1].astype(numpy.float64)])
+    assert len(path.rows) == 6
+    assert (abs(layers[1:]/layers[:-1] - 1) < 0.01).all()
+    with pytest.raises(ValueError):
+        buffer_path.buffer_path(lattice_consts, index, grid, 5.6533, 5.8687, 0.01, layers=2)
+    with pytest.raises(ValueError):
+        buffer_path.buffer_path(lattice_consts, index, grid, 5.6533, 5.8687, 0.01, max_layers=3)
+
+def test_command_line(work_dir):
+    output = run_cli("db.npz", "5.6533", "5.8687", "--step-mismatch", "0.01")
+    lines = output.splitlines()
+    assert lines[0] + "\n" == buffer_path.BUFFER_HEADER
+    assert lines[1].split("\t")[:3] == ["0", "substrate", "5.6533"]
+    lattice_consts, index, grid = load("db.npz")
+    path = buffer_path.buffer_path(lattice_consts, index, grid, 5.6533, 5.8687, 0.01)
+    assert [float(line.split("\t")[2]) for line in lines[2:]] == lattice_consts[path.rows, -1].astype(numpy.float64).tolist()
+    assert os.path.exists("db.npz.grid.npz")
+    # the grid is reused, and the compact database gets a grid of its own
+    assert run_cli("db.npz", "5.6533", "5.8687", "--step-mismatch", "0.01") == output
+    assert run_cli("db.cdb", "5.6533", "5.8687", "--step-mismatch", "0.01") == output
+    assert os.path.exists("db.cdb.grid.npz")
+    with pytest.raises(SystemExit):
+        run_cli("db.npz", "5.6533", "5.8687", "--step-mismatch", "0.01", "--layers", "2")
@@ -0,0 +1,31 @@
+"""The compact composition database format: conversion both ways and the
+matches of composition_calculator.py read from it."""
+import numpy
+import pytest
+import composition_database
+from tests.outputs import composition_output
+
+def test_compact_database_round_trip(work_dir):
+    original = numpy.load("db.npz")["arr_0"]
+    for compact_name in ("db.cdb", "db_no_a.cdb"):
+        compact = composition_database.load_database(compact_name)
+        assert isinstance(compact, composition_database.CompactDatabase)
+        assert compact.shape == original.shape
+        # without a stored column the lattice constants are recomputed the same way
+        numpy.testing.assert_array_equal(compact[:], original)
+        composition_database.compact_to_npz(compact_name, "back.npz")
+        numpy.testing.assert_array_equal(numpy.load("back.npz")["arr_0"], original)
+
+def test_compact_database_command_line(work_dir):
+    composition_database.main(["to-compact", "db.npz", "cli.cdb"])
+    composition_database.main(["to-npz", "cli.cdb", "cli.npz"])
+    numpy.testing.assert_array_equal(numpy.load("cli.npz")["arr_0"], numpy.load("db.npz")["arr_0"])
+    with open("cli.cdb", "rb") as cli_file, open("db.cdb", "rb") as compact_file:
+        assert cli_file.read() == compact_file.read()
+
+@pytest.mark.parametrize("substrate", ["cubic", "tetragonal", "hexagonal"])
+def test_compact_database_matches_scan(work_dir, substrate):
+    expected = composition_output(substrate, "db.npz", "--no-index")
+    assert expected.count(b"\n") > 1
+    for database_name in ("db.cdb", "db_no_a.cdb"):
+        assert composition_output(substrate, database_name) == expected, database_name
@@ -0,0 +1,35 @@
+"""--incremental: both tools answer from their result store like a full run,
+also after material rows were added, edited or removed."""
+from tests.outputs import composition_output, lattice_output
+
+def edit_materials(file_name):
+    """Drops every third row of a material file, scales the lattice
+    constants of the first row and appends a copy of the second."""
+    with open(file_name) as material_file:
+        header, *rows = material_file.readlines()
+    fields = rows[0].rstrip("\n").split("\t")
+    fields[2] = str(float(fields[2])*1.01)
+    edited = ["\t".join(fields) + "\n"] + [row for number, row in enumerate(rows[1:]) if number % 3] + [rows[1]]
+    with open(file_name, "w") as material_file:
+        material_file.writelines([header] + edited)
+
+def test_lattice_incremental_matches_scalar(work_dir):
+    expected = lattice_output("cubic", "hexagonal", "--engine", "scalar")
+    assert lattice_output("cubic", "hexagonal", "--incremental") == expected
+    # answered from the store written by the first run
+    assert lattice_output("cubic", "hexagonal", "--incremental") == expected
+    for file_name in ("hexagonal.txt", "cubic.txt"):
+        edit_materials(file_name)
+        assert lattice_output("cubic", "hexagonal", "--incremental") == lattice_output("cubic", "hexagonal", "--engine", "scalar"), file_name
+    # a store of another tolerance is not used
+    expected = lattice_output("cubic", "hexagonal", "--engine", "scalar", tolerance="0.02")
+    assert lattice_output("cubic", "hexagonal", "--incremental", tolerance="0.02") == expected
+
+def test_composition_incremental_matches_scan(work_dir):
+    expected = composition_output("hexagonal", "db.npz", "--no-index")
+    assert composition_output("hexagonal", "db.npz", "--incremental") == expected
+    assert composition_output("hexagonal", "db.npz", "--incremental") == expected
+    edit_materials("hexagonal.txt")
+    assert composition_output("hexagonal", "db.npz", "--incremental") == composition_output("hexagonal", "db.npz", "--no-index")
+    # nor one of another database
+    assert composition_output("hexagonal", "db.cdb", "--incremental") == composition_output("hexagonal", "db.npz", "--no-index")
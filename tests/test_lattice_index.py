@@ -0,0 +1,45 @@
+"""The sorted lattice constant index of composition_calculator.py: its
+windows against a scan of the database and its .index.npz sidecar."""
+import os
+import numpy
+import pytest
+import composition_calculator
+import composition_database
+from tests.outputs import composition_output
+
+@pytest.mark.parametrize("substrate", ["cubic", "tetragonal", "hexagonal"])
+def test_index_matches_scan(work_dir, substrate):
+    expected = composition_output(substrate, "db.npz", "--no-index")
+    assert expected.count(b"\n") > 1
+    assert composition_output(substrate, "db.npz") == expected
+
+@pytest.mark.parametrize("database_name", ["db.npz", "db.cdb"])
+def test_lattice_index_round_trip(work_dir, database_name):
+    lattice_consts = composition_database.load_database(database_name)
+    built = composition_calculator.load_lattice_index(database_name, lattice_consts)
+    index_name = composition_calculator.index_file_name(database_name)
+    assert index_name == database_name + ".index.npz"
+    written = os.stat(index_name).st_mtime_ns
+    loaded = composition_calculator.load_lattice_index(database_name, lattice_consts)
+    assert os.stat(index_name).st_mtime_ns == written
+    numpy.testing.assert_array_equal(loaded.order, built.order)
+    numpy.testing.assert_array_equal(loaded.keys, built.keys)
+    column = lattice_consts[:, -1]
+    for lower, upper in ((5.0, 5.5), (5.65, 5.66), (6.0, 6.5), (0.0, 10.0), (7.0, 8.0)):
+        numpy.testing.assert_array_equal(loaded.window(lower, upper),
+                                         composition_calculator.lattice_window(lattice_consts, lower, upper))
+        numpy.testing.assert_array_equal(loaded.window(lower, upper), numpy.flatnonzero((column > lower) & (column < upper)))
+
+def test_lattice_indexes_of_databases_with_one_stem(work_dir):
+    for database_name in ("db.npz", "db.cdb"):
+        composition_calculator.load_lattice_index(database_name, composition_database.load_database(database_name))
+    assert os.path.exists("db.npz.index.npz") and os.path.exists("db.cdb.index.npz")
+
+def test_lattice_index_rebuilt_for_changed_database(work_dir):
+    lattice_consts = composition_database.load_database("db.npz")
+    composition_calculator.load_lattice_index("db.npz", lattice_consts)
+    shorter = lattice_consts[::2]
+    numpy.savez_compressed("db.npz", shorter)
+    index = composition_calculator.load_lattice_index("db.npz", shorter)
+    assert len(index.order) == len(shorter)
+    numpy.testing.assert_array_equal(index.window(5.5, 6.0), numpy.flatnonzero((shorter[:, -1] > 5.5) & (shorter[:, -1] < 6.0)))
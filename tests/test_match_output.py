@@ -0,0 +1,59 @@
+"""The match_output writers: npy/npz files read back unchanged and the same
+matches as the tab delimited text."""
+import os
+import numpy
+import pytest
+import composition_calculator
+import lattice_matcher
+from match_output import BinaryMatchWriter, ascii_records, concatenate_records
+
+def named_records(names, value):
+    """Record batch with a text field as wide as its longest name."""
+    records = numpy.zeros(len(names), dtype=[("name", "U{}".format(max(len(name) for name in names))), ("value", "f8")])
+    records["name"] = names
+    records["value"] = value
+    return records
+
+@pytest.mark.parametrize("extension", ["npy", "npz"])
+@pytest.mark.parametrize("batches", [
+    [],
+    [["a", "bb"]],
+    [["a", "bb"], ["cccc"], ["dd"]],
+    [["a"], ["été"], ["bbbbbbbbbb"]],
+])
+def test_binary_match_writer_round_trip(work_dir, extension, batches):
+    batches = [named_records(names, number) for number, names in enumerate(batches)]
+    writer = BinaryMatchWriter("matches." + extension)
+    for records in batches:
+        writer.write(records)
+    writer.close()
+    assert os.path.exists("matches." + extension)
+    assert not [name for name in os.listdir(".") if ".tmp" in name]
+    expected = ascii_records(concatenate_records(batches)) if batches else numpy.zeros(0)
+    if extension == "npz":
+        with numpy.load("matches.npz") as archive:
+            assert archive.files == ["matches"]
+            saved = archive["matches"]
+    else:
+        saved = numpy.load("matches.npy")
+        numpy.save("expected.npy", expected)
+        with open("matches.npy", "rb") as saved_file, open("expected.npy", "rb") as expected_file:
+            assert saved_file.read() == expected_file.read()
+    assert saved.dtype == expected.dtype
+    assert saved.tobytes() == expected.tobytes()
+
+def test_binary_output_of_the_command_line(work_dir):
+    lattice_matcher.main(["cubic.txt", "hexagonal.txt", "0.05"])
+    with open("cubic_on_hexagonal.txt") as text_file:
+        rows = len(text_file.readlines()) - 1
+    lattice_matcher.main(["cubic.txt", "hexagonal.txt", "0.05", "--output-format", "npy"])
+    lattice_matcher.main(["cubic.txt", "hexagonal.txt", "0.05", "--output-format", "npz"])
+    saved = numpy.load("cubic_on_hexagonal.npy")
+    assert len(saved) == rows
+    assert saved.dtype["film"].kind == "S"
+    with numpy.load("cubic_on_hexagonal.npz") as archive:
+        assert archive["matches"].tobytes() == saved.tobytes()
+    composition_calculator.main(["hexagonal.txt", "db.npz", "--tolerance", "0.02", "--output-format", "npy"])
+    composition_calculator.main(["hexagonal.txt", "db.npz", "--tolerance", "0.02"])
+    with open("composition_matches_for_hexagonal.txt") as text_file:
+        assert len(numpy.load("composition_matches_for_hexagonal.npy")) == len(text_file.readlines()) - 1
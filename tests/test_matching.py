@@ -0,0 +1,29 @@
+"""The library interface of matching.py against the files of the command
+line tools."""
+import os
+import matching
+from match_output import COMPOSITION_HEADER, LATTICE_HEADER, format_composition_matches, format_lattice_matches
+from tests.outputs import composition_output, lattice_output
+
+def test_match_as_the_command_line(work_dir):
+    expected = lattice_output("cubic", "hexagonal")
+    for engine in ("indexed", "vectorized"):
+        records = matching.match("cubic.txt", "hexagonal.txt", 0.05, engine=engine)
+        assert (LATTICE_HEADER + format_lattice_matches(records)).encode() == expected, engine
+
+def test_compositions_for_as_the_command_line(work_dir):
+    expected = composition_output("hexagonal", "db.npz")
+    for database in ("db.npz", "db.cdb", 10):
+        records = matching.compositions_for("hexagonal.txt", database, 0.02)
+        assert (COMPOSITION_HEADER + format_composition_matches(records)).encode() == expected, database
+
+def test_materials_reloaded_when_changed(work_dir):
+    first = matching.load_materials("cubic.txt")
+    assert matching.load_materials("cubic.txt") is first
+    assert os.path.abspath("cubic.txt") in matching.loaded_files()["materials"]
+    with open("cubic.txt", "a") as material_file:
+        material_file.write("Xx\tC\t9.99\t0\n")
+    changed = matching.load_materials("cubic.txt")
+    assert len(changed) == len(first) + 1
+    matching.clear_cache()
+    assert matching.loaded_files() == {"materials": [], "databases": []}
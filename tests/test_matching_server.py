@@ -0,0 +1,119 @@
+"""matching_server.py: queries over localhost HTTP against the files of the
+command line tools, the response cache, reloading changed files and loads
+that do not hold up other queries."""
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+import pytest
+import matching
+import matching_server
+from tests.outputs import composition_output, lattice_output
+
+@pytest.fixture
+def server(work_dir):
+    """Function POSTing a query to a server on a free port of localhost and
+    returning (status, body), or GETting a path without a query."""
+    matching.clear_cache()
+    service = matching_server.MatchingService(str(work_dir), 2, 2**20)
+    http_server = matching_server.make_server(service, port=0)
+    thread = threading.Thread(target=http_server.serve_forever)
+    thread.start()
+    url = "http://127.0.0.1:{}/".format(http_server.server_address[1])
+
+    def request(path, query=None):
+        data = None if query is None else query if isinstance(query, bytes) else json.dumps(query).encode("utf-8")
+        try:
+            with urllib.request.urlopen(url + path, data) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as error:
+            return error.code, error.read()
+
+    yield request
+    http_server.shutdown()
+    http_server.server_close()
+    thread.join()
+    matching.clear_cache()
+
+def test_queries_answer_the_command_line_files(server):
+    assert server("match", {"films": "cubic.txt", "substrates": "hexagonal.txt", "tolerance": 0.05}) == (200, lattice_output("cubic", "hexagonal"))
+    expected = composition_output("cubic", "db.npz")
+    for database in ("db.npz", "db.cdb", 10):
+        assert server("compositions", {"substrates": "cubic.txt", "database": database, "tolerance": 0.02}) == (200, expected), database
+    status, body = server("match", {"films": [["GaAs", "C", 5.6533, 0]], "substrates": "cubic.txt", "tolerance": 0.05, "format": "json"})
+    assert status == 200
+    answer = json.loads(body.decode("utf-8"))
+    records = matching.match(matching.load_materials(("GaAs", "C", 5.6533, 0.0)), "cubic.txt", 0.05)
+    assert answer["columns"] == list(records.dtype.names)
+    assert len(answer["rows"]) == len(records) > 0
+    assert [row[:2] for row in answer["rows"]] == [list(record)[:2] for record in records.tolist()]
+
+def test_bad_queries(server):
+    assert server("match", b"{bad")[0] == 400
+    assert server("match", {"films": "cubic.txt", "substrates": "hexagonal.txt"})[0] == 400
+    assert server("match", {"films": "../cubic.txt", "substrates": "hexagonal.txt", "tolerance": 0.05})[0] == 400
+    assert server("match", {"films": "missing.txt", "substrates": "hexagonal.txt", "tolerance": 0.05})[0] == 400
+    assert server("compositions", {"substrates": "cubic.txt", "database": 0.01})[0] == 400
+    assert server("compositions", {"substrates": "cubic.txt", "database": 3})[0] == 400
+    assert server("unknown", {})[0] == 404
+
+def test_cached_responses(server):
+    query = {"films": "cubic.txt", "substrates": "hexagonal.txt", "tolerance": 0.05}
+    first = server("match", query)
+    assert server("match", query) == first
+    status, body = server("status")
+    cache = json.loads(body.decode("utf-8"))["cache"]
+    assert (cache["entries"], cache["hits"], cache["misses"]) == (1, 1, 1)
+
+def test_changed_files_are_reloaded(server):
+    query = {"films": "cubic.txt", "substrates": "hexagonal.txt", "tolerance": 0.05}
+    first = server("match", query)
+    with open("hexagonal.txt") as material_file:
+        lines = material_file.readlines()
+    with open("hexagonal.txt", "w") as material_file:
+        material_file.writelines(lines[:len(lines)//2])
+    stat = os.stat("hexagonal.txt")
+    os.utime("hexagonal.txt", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    changed = server("match", query)
+    assert changed == (200, lattice_output("cubic", "hexagonal"))
+    assert changed != first
+
+def test_least_recently_used_responses_evicted():
+    cache = matching_server.ResultCache(10)
+    cache.put("a", ("text/plain", b"aaaa"))
+    cache.put("b", ("text/plain", b"bbbb"))
+    assert cache.get("a") == ("text/plain", b"aaaa")
+    cache.put("c", ("text/plain", b"cccc"))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    cache.put("d", ("text/plain", b"d"*11))
+    assert cache.get("d") is None
+    assert cache.status() == {"entries": 2, "bytes": 8, "hits": 3, "misses": 2}
+
+def test_load_does_not_hold_up_other_files():
+    cache = {}
+    started, release = threading.Event(), threading.Event()
+    loads = []
+
+    def slow_loader():
+        loads.append("a")
+        started.set()
+        release.wait(10)
+        return "a"
+
+    results = {}
+    slow = [threading.Thread(target=lambda k=k: results.setdefault(k, matching.cached_value(cache, "a", 1, slow_loader))) for k in range(2)]
+    slow[0].start()
+    assert started.wait(10)
+    slow[1].start()
+    # another entry is loaded and answered while "a" is still loading
+    other = threading.Thread(target=lambda: results.setdefault("b", matching.cached_value(cache, "b", 1, lambda: "b")))
+    other.start()
+    other.join(10)
+    assert results == {"b": "b"}
+    release.set()
+    for thread in slow:
+        thread.join(10)
+    assert results == {0: "a", 1: "a", "b": "b"}
+    assert loads == ["a"]
@@ -0,0 +1,50 @@
+"""Material files parsed into catalog arrays and read back from their binary
+.catalog.npz sidecars."""
+import os
+import pytest
+from material_catalog import catalog_file_name, load_catalog
+
+@pytest.mark.parametrize("name", ["cubic", "tetragonal", "hexagonal"])
+def test_catalog_sidecar_round_trip(work_dir, name):
+    parsed = load_catalog(name + ".txt", use_sidecar=False)
+    written = load_catalog(name + ".txt")
+    assert os.path.exists(catalog_file_name(name + ".txt"))
+    loaded = load_catalog(name + ".txt")
+    for catalog in (written, loaded):
+        assert catalog.dtype == parsed.dtype
+        assert catalog.tobytes() == parsed.tobytes()
+
+def test_catalog_sidecar_follows_edits(work_dir):
+    load_catalog("cubic.txt")
+    with open("cubic.txt", "a") as catalog_file:
+        catalog_file.write("Xx\tC\t9.99\t0\n")
+    catalog = load_catalog("cubic.txt")
+    assert catalog[-1]["composition"] == "Xx" and catalog[-1]["a"] == 9.99
+    assert catalog.tobytes() == load_catalog("cubic.txt", use_sidecar=False).tobytes()
+
+def test_catalogs_of_files_with_one_stem(work_dir):
+    with open("cubic.txt") as text_file:
+        rows = text_file.readlines()
+    with open("cubic.tsv", "w") as tsv_file:
+        tsv_file.writelines(rows[:5])
+    assert catalog_file_name("cubic.tsv") == "cubic.tsv.catalog.npz"
+    assert len(load_catalog("cubic.txt")) == len(rows) - 1
+    assert len(load_catalog("cubic.tsv")) == 4
+    # the sidecar of cubic.tsv did not replace the one of cubic.txt
+    assert len(load_catalog("cubic.txt")) == len(rows) - 1
+
+def test_unreadable_sidecar_is_rebuilt(work_dir):
+    with open(catalog_file_name("hexagonal.txt"), "wb") as sidecar:
+        sidecar.write(b"not a zip file")
+    catalog = load_catalog("hexagonal.txt")
+    assert catalog.tobytes() == load_catalog("hexagonal.txt", use_sidecar=False).tobytes()
+    assert load_catalog("hexagonal.txt").tobytes() == catalog.tobytes()
+
+def test_symmetry_labels_beyond_the_crystal_systems(work_dir):
+    # labels other than C, T and H are kept, their materials match nothing
+    with open("odd.txt", "w") as odd_file:
+        odd_file.write("#Composition\tSymmetry\ta\tc\nGaAs\tC\t5.6533\t0\nXy\tOrtho\t4.1\t5.2\n")
+    load_catalog("odd.txt")
+    catalog = load_catalog("odd.txt")
+    assert catalog["symmetry"].tolist() == ["C", "Ortho"]
+    assert catalog.tobytes() == load_catalog("odd.txt", use_sidecar=False).tobytes()
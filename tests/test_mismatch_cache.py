@@ -0,0 +1,29 @@
+"""The tolerance independent mismatch cache of lattice_matcher.py --cache."""
+import os
+from tests.outputs import lattice_output
+
+CACHE = "cubic_on_hexagonal.mismatch_cache.npz"
+
+def test_cache_matches_scalar(work_dir):
+    for tolerance in ("0.05", "0.02", "0.001"):
+        expected = lattice_output("cubic", "hexagonal", "--engine", "scalar", tolerance=tolerance)
+        assert lattice_output("cubic", "hexagonal", "--cache", tolerance=tolerance) == expected, tolerance
+    assert os.path.exists(CACHE)
+
+def test_cache_answers_smaller_tolerances_without_rebuild(work_dir):
+    lattice_output("cubic", "hexagonal", "--cache")
+    built = os.stat(CACHE).st_mtime_ns
+    expected = lattice_output("cubic", "hexagonal", "--engine", "scalar", tolerance="0.03")
+    assert lattice_output("cubic", "hexagonal", "--cache", tolerance="0.03") == expected
+    assert os.stat(CACHE).st_mtime_ns == built
+
+def test_cache_rebuilt_for_larger_tolerance_or_changed_file(work_dir):
+    lattice_output("cubic", "hexagonal", "--cache", "--cache-max-tolerance", "0.01", tolerance="0.01")
+    expected = lattice_output("cubic", "hexagonal", "--engine", "scalar")
+    assert lattice_output("cubic", "hexagonal", "--cache", "--cache-max-tolerance", "0.01") == expected
+    with open("hexagonal.txt") as substrate_file:
+        lines = substrate_file.readlines()
+    with open("hexagonal.txt", "w") as substrate_file:
+        substrate_file.writelines(lines[:len(lines)//2])
+    expected = lattice_output("cubic", "hexagonal", "--engine", "scalar")
+    assert lattice_output("cubic", "hexagonal", "--cache") == expected
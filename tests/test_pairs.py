@@ -0,0 +1,66 @@
+"""--pairs: the strain balanced pairs of composition_calculator.py against a
+check of every pair of a tensile and a compressive composition."""
+import numpy
+import pytest
+import composition_calculator
+from composition_calculator import SUBSTRATE_ORIENTATIONS, LatticeIndex
+from composition_database import load_database
+from match_output import PAIR_HEADER
+from material_catalog import load_catalog
+
+#substrates of every symmetry with lattice constants inside the database
+SUBSTRATES = "GaAs\tC\t5.6533\t0\nInP\tC\t5.8687\t0\nXt\tT\t4.15\t5.9\nXh\tH\t4.1\t6.6\n"
+
+def composition(row):
+    return "".join("{}{:.2f}".format(name, fraction) for name, fraction in zip(["Al", "Ga", "In", "P", "As", "Sb"], row[:6]))
+
+def brute_force_pairs(database, ratio, tolerance, tensile_mismatch, compressive_mismatch, top_k=None):
+    """Lines of every pair whose average matches a substrate orientation, the
+    layers in the order of the lattice constant index."""
+    lattice_consts = load_database(database)
+    a = lattice_consts[:, -1].astype(numpy.float64)
+    # the lattice constants of the layers are written rounded to 4 decimals
+    written = numpy.round(lattice_consts[:, -1], 4).astype(numpy.float64)
+    position = numpy.empty(len(a), dtype=numpy.int64)
+    position[LatticeIndex.build(lattice_consts).order] = numpy.arange(len(a))
+    weight = ratio/(1 + ratio)
+    lines = []
+    for substrate in load_catalog("substrates.txt"):
+        rows = []
+        for label, factor in SUBSTRATE_ORIENTATIONS[substrate["symmetry"]]:
+            target = substrate["a"]*factor
+            tensile = numpy.flatnonzero((a > (1 - tensile_mismatch)*target) & (a < target))
+            compressive = numpy.flatnonzero((a > target) & (a < (1 + compressive_mismatch)*target))
+            tensile, compressive = tensile[numpy.argsort(position[tensile])], compressive[numpy.argsort(position[compressive])]
+            average = weight*a[tensile][:, None] + (1 - weight)*a[compressive][None, :]
+            t, c = numpy.nonzero((average > (1 - tolerance)*target) & (average < (1 + tolerance)*target))
+            for x, y, value in zip(tensile[t].tolist(), compressive[c].tolist(), average[t, c].tolist()):
+                rows.append((composition(lattice_consts[x]), written[x], composition(lattice_consts[y]), written[y], label, value, value/target - 1))
+        if top_k is not None:
+            rows = [rows[k] for k in sorted(range(len(rows)), key=lambda k: (abs(rows[k][6]), k))[:top_k]]
+        lines += [row + (str(substrate["composition"]), str(substrate["symmetry"])) for row in rows]
+    return lines
+
+def pair_lines(file_name):
+    with open(file_name) as pair_file:
+        assert pair_file.readline() == PAIR_HEADER
+        return [tuple(float(field) if k in (1, 3, 5, 6) else field for k, field in enumerate(line.rstrip("\n").split("\t"))) for line in pair_file]
+
+@pytest.mark.parametrize("ratio, tolerance, tensile_mismatch, compressive_mismatch, top_k", [
+    (1.5, 0.0002, 0.01, 0.01, None), (1.0, 0.0003, 0.005, 0.02, None), (0.5, 0.0005, 0.02, 0.005, None), (1.5, 0.0005, 0.01, 0.01, 5)])
+def test_pairs_against_brute_force(work_dir, ratio, tolerance, tensile_mismatch, compressive_mismatch, top_k):
+    with open("substrates.txt", "w") as substrate_file:
+        substrate_file.write(SUBSTRATES)
+    options = ["--tolerance", str(tolerance), "--pairs", str(ratio), "--tensile-mismatch", str(tensile_mismatch),
+               "--compressive-mismatch", str(compressive_mismatch)] + ([] if top_k is None else ["--top-k", str(top_k)])
+    expected = brute_force_pairs("db.npz", ratio, tolerance, tensile_mismatch, compressive_mismatch, top_k)
+    assert len(set(line[7] for line in expected)) == 4
+    for database in ("db.npz", "db.cdb"):
+        composition_calculator.main(["substrates.txt", database] + options)
+        assert pair_lines("composition_pairs_for_substrates.txt") == expected, database
+
+def test_pairs_options(work_dir):
+    for options in (["--pairs", "0"], ["--pairs", "1", "--tensile-mismatch", "1"], ["--pairs", "1", "--compressive-mismatch", "0"],
+                    ["--pairs", "1", "--stream"], ["--pairs", "1", "--no-index"], ["--pairs", "1", "--summary", "10"]):
+        with pytest.raises(SystemExit):
+            composition_calculator.main(["cubic.txt", "db.npz"] + options)
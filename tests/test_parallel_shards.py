@@ -0,0 +1,25 @@
+"""--jobs: both tools on a process pool write the same file as one process."""
+import pytest
+from parallel_shards import SHARDS_PER_JOB, shard_bounds
+from tests.outputs import LATTICE_PAIRS, composition_output, lattice_output
+
+@pytest.mark.parametrize("count, jobs", [(1, 4), (7, 2), (67, 3), (1000, 8)])
+def test_shard_bounds_cover_the_substrates_in_order(count, jobs):
+    bounds = shard_bounds(count, jobs)
+    assert len(bounds) <= SHARDS_PER_JOB*jobs
+    assert bounds[0][0] == 0 and bounds[-1][1] == count
+    assert all(stop > start for start, stop in bounds)
+    assert all(bounds[k][1] == bounds[k + 1][0] for k in range(len(bounds) - 1))
+
+@pytest.mark.parametrize("film, substrate", LATTICE_PAIRS)
+def test_lattice_jobs_match_scalar(work_dir, film, substrate):
+    expected = lattice_output(film, substrate, "--engine", "scalar")
+    assert expected.count(b"\n") > 1
+    for options in (["--engine", "indexed", "--jobs", "2"], ["--engine", "vectorized", "--jobs", "3"]):
+        assert lattice_output(film, substrate, *options) == expected, options
+
+@pytest.mark.parametrize("substrate", ["cubic", "tetragonal", "hexagonal"])
+def test_composition_jobs_match_scan(work_dir, substrate):
+    expected = composition_output(substrate, "db.npz", "--no-index")
+    for arguments in (["db.npz", "--jobs", "2"], ["db.cdb", "--jobs", "3"]):
+        assert composition_output(substrate, *arguments) == expected, arguments
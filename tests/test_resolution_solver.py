@@ -0,0 +1,15 @@
+"""The iso-lattice solver of composition_calculator.py --resolution against a
+scan of the database generated at the same resolution."""
+import pytest
+import iii_v_generator
+from tests.outputs import composition_output
+
+@pytest.mark.parametrize("substrate", ["cubic", "tetragonal", "hexagonal"])
+def test_resolution_matches_scan(work_dir, substrate):
+    expected = composition_output(substrate, "db.npz", "--no-index")
+    assert expected.count(b"\n") > 1
+    assert composition_output(substrate, "--resolution", "10") == expected
+
+def test_finer_resolution_matches_scan(work_dir):
+    iii_v_generator.main(["5", "db5.npz"])
+    assert composition_output("cubic", "--resolution", "5") == composition_output("cubic", "db5.npz", "--no-index")
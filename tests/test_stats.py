@@ -0,0 +1,64 @@
+"""--stats: the counters of both tools against the files they write."""
+import collections
+import json
+import pytest
+from material_catalog import load_catalog
+from tests.outputs import composition_output, lattice_output
+
+def load_stats(file_name):
+    with open(file_name) as stats_file:
+        return json.load(stats_file)
+
+def without_seconds(entries):
+    return [dict((name, value) for name, value in entry.items() if name != "seconds") for entry in entries]
+
+def matches_by(text, columns):
+    """Matches of a tsv output counted by the values of some columns."""
+    lines = text.decode().splitlines()[1:]
+    return collections.Counter(tuple(line.split("\t")[k] for k in columns) for line in lines)
+
+@pytest.mark.parametrize("engine", ["indexed", "vectorized"])
+def test_lattice_stats_count_the_output(work_dir, engine):
+    expected = lattice_output("cubic", "hexagonal", "--engine", engine)
+    assert lattice_output("cubic", "hexagonal", "--engine", engine, "--stats", "run.json") == expected
+    stats = load_stats("run.json")
+    assert stats["engine"] == engine and stats["films"] == len(load_catalog("cubic.txt"))
+    header = expected.index(b"\n") + 1
+    assert stats["output"][0]["matches"] == expected.count(b"\n") - 1
+    assert stats["output"][0]["bytes_written"] == len(expected) - header
+    counted = dict(((entry["film_symmetry"], entry["substrate_symmetry"]), entry["matches"]) for entry in stats["rules"] if entry["matches"])
+    assert counted == matches_by(expected, (1, 3))
+    assert sum(entry["bytes_written"] for entry in stats["rules"]) == len(expected) - header
+    for entry in stats["rules"]:
+        assert entry["matches"] <= entry["ratio_check_passed"] <= entry["pairs_evaluated"]
+
+def test_vectorized_stats_count_every_pair(work_dir):
+    films, substrates = load_catalog("cubic.txt"), load_catalog("tetragonal.txt")
+    lattice_output("cubic", "tetragonal", "--engine", "vectorized", "--stats", "run.json")
+    pairs = load_stats("run.json")["symmetry_pairs"]
+    assert [(entry["film_symmetry"], entry["substrate_symmetry"]) for entry in pairs] == [("C", "T")]
+    cubic = films["composition"][films["symmetry"] == "C"]
+    assert pairs[0]["pairs_evaluated"] == len(cubic)*(substrates["symmetry"] == "T").sum()
+    # identical materials are never compared
+    lattice_output("cubic", "cubic", "--engine", "vectorized", "--stats", "run.json")
+    identical = sum(1 for film in cubic for substrate in cubic if film == substrate)
+    assert load_stats("run.json")["symmetry_pairs"][0]["pairs_evaluated"] == len(cubic)**2 - identical
+
+def test_lattice_stats_of_jobs(work_dir):
+    # the candidates of the indexed engine depend on the shards, every pair is evaluated by the vectorized one
+    lattice_output("hexagonal", "cubic", "--engine", "vectorized", "--stats", "one.json")
+    lattice_output("hexagonal", "cubic", "--engine", "vectorized", "--stats", "two.json", "--jobs", "2")
+    one, two = load_stats("one.json"), load_stats("two.json")
+    for table in ("rules", "symmetry_pairs", "output"):
+        assert without_seconds(one[table]) == without_seconds(two[table]), table
+
+def test_composition_stats_count_the_output(work_dir):
+    expected = composition_output("cubic", "db.npz")
+    assert composition_output("cubic", "db.npz", "--stats", "run.json") == expected
+    stats = load_stats("run.json")
+    counted = dict(((entry["substrate"], entry["film_symmetry"]), entry["matches"]) for entry in stats["orientations"])
+    assert counted == matches_by(expected, (3, 1))
+    assert sum(entry["bytes_written"] for entry in stats["orientations"]) == len(expected) - expected.index(b"\n") - 1
+    substrates = load_catalog("cubic.txt")
+    timed = set((entry["substrate"], entry["substrate_symmetry"]) for entry in stats["substrate_timings"])
+    assert timed == set(zip(substrates["composition"].tolist(), substrates["symmetry"].tolist()))
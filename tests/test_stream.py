@@ -0,0 +1,22 @@
+"""--stream: composition_calculator.py reading the database once in blocks
+writes the same file as the full database scan."""
+import numpy
+import pytest
+import composition_database
+from tests.outputs import composition_output
+
+@pytest.mark.parametrize("database_name", ["db.npz", "db.cdb", "db_no_a.cdb"])
+def test_database_chunks_read_the_database(work_dir, database_name):
+    database = composition_database.load_database(database_name)[:]
+    chunks = list(composition_database.database_chunks(database_name, 1000))
+    assert [start for start, rows in chunks] == list(range(0, len(database), 1000))
+    numpy.testing.assert_array_equal(numpy.concatenate([rows for start, rows in chunks]), database)
+
+@pytest.mark.parametrize("substrate", ["cubic", "tetragonal", "hexagonal"])
+def test_stream_matches_scan(work_dir, substrate):
+    expected = composition_output(substrate, "db.npz", "--no-index")
+    assert expected.count(b"\n") > 1
+    assert composition_output(substrate, "db.npz", "--stream") == expected
+    # several blocks are merged back into substrate order
+    for arguments in (["db.npz", "--chunk-rows", "1"], ["db.npz", "--chunk-rows", "1000"], ["db.cdb", "--chunk-rows", "777"]):
+        assert composition_output(substrate, *(arguments + ["--stream"])) == expected, arguments
@@ -0,0 +1,17 @@
+"""The indexed engine of lattice_matcher.py against the scalar one."""
+import pytest
+from tests.outputs import LATTICE_PAIRS, lattice_output
+
+@pytest.mark.parametrize("film, substrate", LATTICE_PAIRS)
+def test_indexed_engine_matches_scalar(work_dir, film, substrate):
+    expected = lattice_output(film, substrate, "--engine", "scalar")
+    assert expected.count(b"\n") > 1
+    assert lattice_output(film, substrate, "--engine", "indexed") == expected
+    # candidates generated for several blocks of substrates
+    assert lattice_output(film, substrate, "--engine", "indexed", "--chunk-pairs", "10") == expected
+
+@pytest.mark.parametrize("tolerance", ["0.0001", "0.3", "0.6"])
+def test_indexed_engine_at_any_tolerance(work_dir, tolerance):
+    # above MAX_INDEX_TOLERANCE the engine falls back to evaluating every pair
+    expected = lattice_output("hexagonal", "cubic", "--engine", "scalar", tolerance=tolerance)
+    assert lattice_output("hexagonal", "cubic", "--engine", "indexed", tolerance=tolerance) == expected
@@ -0,0 +1,63 @@
+"""--summary: the statistics of composition_calculator.py against the full
+list of matches, and the same file in every mode."""
+import json
+import numpy
+import pytest
+import composition_calculator
+import matching
+from composition_calculator import SUBSTRATE_ORIENTATIONS
+from match_output import format_compositions
+from material_catalog import load_catalog
+
+def summary(*arguments):
+    composition_calculator.main(["cubic.txt"] + list(arguments) + ["--tolerance", "0.02", "--summary", "10"])
+    with open("composition_summary_for_cubic.json") as summary_file:
+        return summary_file.read()
+
+def test_summary_of_the_matches(work_dir):
+    report = json.loads(summary("db.npz", "--representatives", "2"))
+    numpy.testing.assert_allclose(report["bin_edges"], numpy.linspace(-0.02, 0.02, 11))
+    matches = matching.compositions_for("cubic.txt", "db.npz", 0.02)
+    fields = list(matches.dtype.names[:matches.dtype.names.index("a")])
+    compositions = format_compositions(matches)
+    substrates = load_catalog("cubic.txt")
+    # lattice constant of the first row of every substrate composition
+    substrate_a = dict(zip(substrates["composition"].tolist()[::-1], substrates["a"].tolist()[::-1]))
+    keys = list(zip(matches["substrate"].tolist(), matches["substrate_symmetry"].tolist(), matches["film_symmetry"].tolist()))
+    assert sum(entry["matches"] for entry in report["substrates"]) == len(matches)
+    checked = 0
+    for entry in report["substrates"]:
+        group = numpy.array([key == (entry["substrate"], entry["substrate_symmetry"], entry["film_symmetry"]) for key in keys], dtype=bool)
+        assert entry["matches"] == group.sum()
+        if not group.any():
+            assert entry["mismatch_counts"] == [0]*10
+            continue
+        checked += 1
+        part = matches[group]
+        factor = dict(SUBSTRATE_ORIENTATIONS[entry["substrate_symmetry"]])[entry["film_symmetry"]]
+        assert entry["target_a"] == pytest.approx(factor*substrate_a[entry["substrate"]])
+        mismatch = part["a"].astype(numpy.float64)/entry["target_a"] - 1
+        assert entry["mismatch_counts"] == numpy.histogram(mismatch, report["bin_edges"])[0].tolist()
+        assert entry["a"] == [float(part["a"].min()), float(part["a"].max())]
+        for name in fields:
+            assert entry["fractions"][name.split("_", 1)[1]] == [round(float(part[name].min()), 2), round(float(part[name].max()), 2)]
+        families = {}
+        for row in part:
+            family = "".join(name.split("_", 1)[1] for name in fields if row[name] > 0)
+            families[family] = families.get(family, 0) + 1
+        assert dict((family["family"], family["matches"]) for family in entry["families"]) == families
+        assert [family["matches"] for family in entry["families"]] == sorted(families.values(), reverse=True)
+        # the two compositions closest to the center of every bin, ties in composition order
+        centers = (numpy.array(report["bin_edges"][:-1]) + numpy.array(report["bin_edges"][1:]))/2
+        bins = numpy.digitize(mismatch, report["bin_edges"]) - 1
+        for b, representatives in enumerate(entry["representatives"]):
+            in_bin = numpy.flatnonzero(bins == b)
+            ranked = sorted(in_bin.tolist(), key=lambda k: (abs(mismatch[k] - centers[b]), tuple(part[name][k] for name in fields)))
+            assert [representative["composition"] for representative in representatives] == [str(compositions[group][k]) for k in ranked[:2]]
+    assert checked > 1
+
+def test_summary_is_the_same_in_every_mode(work_dir):
+    expected = summary("db.npz")
+    for arguments in (["db.npz", "--no-index"], ["db.cdb"], ["db.npz", "--jobs", "2"], ["db.npz", "--stream", "--chunk-rows", "1000"],
+                      ["db.npz", "--incremental"], ["db.npz", "--incremental"], ["--resolution", "10"]):
+        assert summary(*arguments) == expected, arguments
@@ -0,0 +1,64 @@
+"""--supercell: the domain matches of lattice_matcher.py against a brute force
+search of every m film cells on n substrate cells."""
+import itertools
+import math
+import numpy
+import pytest
+import lattice_matcher
+from material_catalog import load_catalog
+from substrate_index import INTERFACE_LENGTHS
+from supercell_search import SUPERCELL_RULES, farey_ratios
+
+def brute_force_supercells(films, substrates, tolerance, max_cells):
+    """(film, film symmetry, substrate, substrate symmetry, cells of every
+    direction) of every supercell match in output order: substrate, film,
+    orientation and m/n of each direction."""
+    cells = sorted(((m, n) for m in range(1, max_cells + 1) for n in range(1, max_cells + 1) if math.gcd(m, n) == 1),
+                   key=lambda cell: cell[0]/cell[1])
+    matches = []
+    for substrate in substrates:
+        for film in films:
+            if film["symmetry"] == substrate["symmetry"] and film["composition"] == substrate["composition"]:
+                continue
+            for rule in SUPERCELL_RULES.get((film["symmetry"], substrate["symmetry"]), []):
+                directions = []
+                for sub_kind, film_kind in rule.directions:
+                    sub_length = INTERFACE_LENGTHS[sub_kind](substrate["a"], substrate["c"])
+                    film_length = INTERFACE_LENGTHS[film_kind](film["a"], film["c"])
+                    directions.append([(m, n) for m, n in cells if abs((n*sub_length - m*film_length)/(n*sub_length)) < tolerance])
+                for combination in itertools.product(*directions):
+                    matches.append((film["composition"], film["symmetry"] + rule.film_tag, substrate["composition"],
+                                    substrate["symmetry"] + rule.sub_tag, combination))
+    return matches
+
+def test_farey_ratios_are_the_sorted_reduced_fractions():
+    ratios, film_cells, substrate_cells = farey_ratios(5)
+    expected = sorted(set((m//math.gcd(m, n), n//math.gcd(m, n)) for m in range(1, 6) for n in range(1, 6)), key=lambda cell: cell[0]/cell[1])
+    assert list(zip(film_cells.tolist(), substrate_cells.tolist())) == expected
+    numpy.testing.assert_array_equal(ratios, film_cells/substrate_cells)
+
+@pytest.mark.parametrize("film, substrate", [("cubic", "tetragonal"), ("hexagonal", "tetragonal"), ("tetragonal", "hexagonal")])
+@pytest.mark.parametrize("max_cells", [2, 4])
+def test_supercells_match_brute_force(work_dir, film, substrate, max_cells):
+    expected = brute_force_supercells(load_catalog(film + ".txt"), load_catalog(substrate + ".txt"), 0.02, max_cells)
+    assert expected
+    for options in ([], ["--jobs", "2"], ["--chunk-pairs", "50"]):
+        lattice_matcher.main([film + ".txt", substrate + ".txt", "0.02", "--supercell", str(max_cells), "--output-format", "npy"] + options)
+        records = numpy.load("{}_on_{}_supercells.npy".format(film, substrate))
+        found = [(match["film"].decode(), match["film_symmetry"].decode(), match["substrate"].decode(), match["substrate_symmetry"].decode(),
+                  ((int(match["film_cells"]), int(match["substrate_cells"])),) +
+                  (((int(match["c_film_cells"]), int(match["c_substrate_cells"])),) if match["has_c"] else ())) for match in records]
+        assert found == expected, options
+        assert (abs(records["mismatch"]) < 0.02).all() and (abs(records["c_mismatch"][records["has_c"]]) < 0.02).all()
+
+def test_supercell_text_output(work_dir):
+    lattice_matcher.main(["cubic.txt", "tetragonal.txt", "0.01", "--supercell", "3", "--output-format", "npy"])
+    lattice_matcher.main(["cubic.txt", "tetragonal.txt", "0.01", "--supercell", "3"])
+    records = numpy.load("cubic_on_tetragonal_supercells.npy")
+    with open("cubic_on_tetragonal_supercells.txt") as text_file:
+        lines = text_file.read().splitlines()
+    assert lines[0].startswith("#Film") and len(lines) == len(records) + 1
+    for line, match in zip(lines[1:], records):
+        fields = line.split("\t")
+        assert fields[:4] == [match[name].decode() for name in ("film", "film_symmetry", "substrate", "substrate_symmetry")]
+        assert float(fields[4]) == match["mismatch"] and (int(fields[5]), int(fields[6])) == (match["film_cells"], match["substrate_cells"])
@@ -0,0 +1,60 @@
+"""--top-k: the output of both tools against the full output, sorted by
+mismatch and truncated to k matches per film or substrate."""
+import numpy
+import pytest
+import matching
+from composition_calculator import SUBSTRATE_ORIENTATIONS
+from match_output import COMPOSITION_HEADER, LATTICE_HEADER, format_composition_matches, format_lattice_matches
+from material_catalog import load_catalog
+from tests.outputs import composition_output, lattice_output
+
+def top_k_lattice_matches(film_file_name, matches, k):
+    """The k matches of every film with the smallest absolute mismatch, by a
+    stable sort of all matches. Films are identified by composition and
+    symmetry and ordered by their first row."""
+    films = load_catalog(film_file_name)
+    first = {}
+    for row, film in enumerate(zip(films["composition"].tolist(), films["symmetry"].tolist())):
+        first.setdefault(film, row)
+    rows = [first[(film, symmetry[0])] for film, symmetry in zip(matches["film"].tolist(), matches["film_symmetry"].tolist())]
+    ranked = sorted(range(len(matches)), key=lambda match: (rows[match], abs(matches["mismatch"][match]), match))
+    kept, counts = [], {}
+    for match in ranked:
+        if counts.get(rows[match], 0) < k:
+            kept.append(match)
+            counts[rows[match]] = counts.get(rows[match], 0) + 1
+    return matches[numpy.array(kept, dtype=numpy.intp)]
+
+@pytest.mark.parametrize("film, substrate", [("cubic", "hexagonal"), ("hexagonal", "cubic"), ("tetragonal", "cubic")])
+@pytest.mark.parametrize("k", [1, 3])
+def test_lattice_top_k_is_the_sorted_full_output(work_dir, film, substrate, k):
+    matches = matching.match(film + ".txt", substrate + ".txt", 0.05)
+    expected = (LATTICE_HEADER + format_lattice_matches(top_k_lattice_matches(film + ".txt", matches, k))).encode()
+    assert expected.count(b"\n") > 1
+    for options in (["--engine", "indexed"], ["--engine", "vectorized"], ["--jobs", "2"], ["--chunk-pairs", "50"],
+                    ["--cache"], ["--cache"], ["--incremental"], ["--incremental"]):
+        assert lattice_output(film, substrate, "--top-k", str(k), *options) == expected, options
+    assert (LATTICE_HEADER + format_lattice_matches(matching.match(film + ".txt", substrate + ".txt", 0.05, top_k=k))).encode() == expected
+
+def top_k_compositions(substrates, database, tolerance, k):
+    """Text of the k compositions of every substrate with the smallest
+    |a/a_substrate - 1|, by a stable sort of all of its matches."""
+    text = COMPOSITION_HEADER
+    for row in range(len(substrates)):
+        matches = matching.compositions_for(substrates[row:row + 1], database, tolerance)
+        if len(matches) == 0:
+            continue # also substrates of a symmetry without orientations
+        factors = dict(SUBSTRATE_ORIENTATIONS[substrates[row]["symmetry"]])
+        orientation_a = substrates[row]["a"]*numpy.array([factors[label] for label in matches["film_symmetry"].tolist()])
+        mismatch = abs(matches["a"].astype(numpy.float64)/orientation_a - 1)
+        text += format_composition_matches(matches[numpy.lexsort((numpy.arange(len(matches)), mismatch))[:k]])
+    return text.encode()
+
+@pytest.mark.parametrize("substrate", ["cubic", "hexagonal"])
+@pytest.mark.parametrize("k", [1, 5])
+def test_composition_top_k_is_the_sorted_full_output(work_dir, substrate, k):
+    expected = top_k_compositions(load_catalog(substrate + ".txt"), "db.npz", 0.02, k)
+    assert expected.count(b"\n") > 1
+    for arguments in (["db.npz"], ["db.npz", "--no-index"], ["db.cdb"], ["--resolution", "10"], ["db.npz", "--jobs", "2"],
+                      ["db.npz", "--incremental"], ["db.npz", "--incremental"]):
+        assert composition_output(substrate, *(arguments + ["--top-k", str(k)])) == expected, arguments
@@ -0,0 +1,21 @@
+"""The vectorized engine of lattice_matcher.py against the scalar one."""
+import numpy
+import pytest
+from orientation_rules import round_ratio, round_ratio_array
+from tests.outputs import LATTICE_PAIRS, lattice_output
+
+@pytest.mark.parametrize("film, substrate", LATTICE_PAIRS)
+def test_vectorized_engine_matches_scalar(work_dir, film, substrate):
+    expected = lattice_output(film, substrate, "--engine", "scalar")
+    assert expected.count(b"\n") > 1
+    assert lattice_output(film, substrate, "--engine", "vectorized") == expected
+
+def test_vectorized_engine_in_small_blocks(work_dir):
+    expected = lattice_output("cubic", "hexagonal", "--engine", "scalar")
+    for chunk_pairs in ("1", "100"):
+        assert lattice_output("cubic", "hexagonal", "--engine", "vectorized", "--chunk-pairs", chunk_pairs) == expected, chunk_pairs
+
+def test_round_ratio_array_matches_round_ratio():
+    # halves round to even in both
+    ratios = numpy.array([0.2, 0.3, 0.4, 0.5, 0.7, 1.0, 1.4, 1.5, 2.5, 3.5, 7.2])
+    numpy.testing.assert_array_equal(round_ratio_array(ratios), [round_ratio(ratio) for ratio in ratios])
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+###############################################################################
+##                               Top-k Matches                               ##
+###############################################################################
+"""The k matches with the smallest absolute mismatch of every film, the --top-k
+mode of lattice_matcher.py.
+"""
+import numpy
+from match_output import concatenate_records, lattice_match_records
+from orientation_rules import database_columns
+from parallel_engines import parallel_match_blocks
+from result_store import within_group_rank
+
+# substrates are matched in this many passes, each leaving out the matches
+# that cannot enter the current top k of their film
+TOP_K_PASSES = 8
+
+class TopKMatches(object):
+    """The k matches with the smallest absolute mismatch of every film among
+    the matches added so far. Ties keep the earlier match in output order.
+
+    Films are identified by composition and symmetry, the film symmetry of a
+    match is the first character of its label.
+
+    Args:
+        film_database: structured array of film materials (material_catalog.py)
+        k: number of matches kept per film
+    """
+
+    def __init__(self, film_database, k):
+        film_comp, film_sym = database_columns(film_database)[:2]
+        self.keys, self.film_rows, self.film_keys = numpy.unique(numpy.char.add(numpy.char.add(film_comp, "\t"), film_sym),
+                                                                  return_index=True, return_inverse=True)
+        self.k = k
+        self.records, self.critical, self.rows, self.sequence = None, numpy.zeros(0), numpy.zeros(0, dtype=numpy.intp), numpy.zeros(0, dtype=numpy.int64)
+        self.pending = []
+        self.pending_count = 0
+        self.added = 0
+
+    def add(self, records, critical):
+        """Adds a block of matches in output order."""
+        if len(records) == 0:
+            return
+        self.pending.append((records, critical, numpy.arange(self.added, self.added + len(records))))
+        self.added += len(records)
+        self.pending_count += len(records)
+        # ranking is deferred until the pending matches outnumber the kept ones
+        if self.pending_count > max(len(self.critical), 2**16):
+            self.compact()
+
+    def compact(self):
+        """Ranks the pending matches into the kept ones."""
+        if not self.pending:
+            return
+        records = concatenate_records([self.records] + [block[0] for block in self.pending])
+        critical = numpy.concatenate([self.critical] + [block[1] for block in self.pending])
+        sequence = numpy.concatenate([self.sequence] + [block[2] for block in self.pending])
+        keys = numpy.char.add(numpy.char.add(records["film"], "\t"), records["film_symmetry"].astype("U1"))
+        rows = self.film_rows[numpy.minimum(numpy.searchsorted(self.keys, keys), len(self.keys) - 1)]
+        order = numpy.lexsort((sequence, abs(records["mismatch"]), rows))
+        keep = order[within_group_rank(rows[order]) < self.k]
+        self.records, self.critical, self.rows, self.sequence = records[keep], critical[keep], rows[keep], sequence[keep]
+        self.pending = []
+        self.pending_count = 0
+
+    def bounds(self):
+        """Absolute mismatch a new match of every film row has to stay below
+        to enter the top k of its film: the k-th best one kept for the film,
+        infinity while it has fewer than k matches."""
+        self.compact()
+        bounds = numpy.full(len(self.keys), numpy.inf)
+        if self.records is not None:
+            # the kept matches are ordered by film and rank, the last of a full film is its k-th best
+            films, counts = numpy.unique(self.rows, return_counts=True)
+            full = counts == self.k
+            last = numpy.cumsum(counts) - 1
+            bounds[self.film_keys[films[full]]] = abs(self.records["mismatch"][last[full]])
+        return bounds[self.film_keys]
+
+    def result(self):
+        """(records, critical) of the kept matches ordered by film (in film
+        database order), absolute mismatch and output order."""
+        self.compact()
+        if self.records is None:
+            return lattice_match_records([], "", [], "", [numpy.zeros(0)]*3), numpy.zeros(0)
+        return self.records, self.critical
+
+def top_k_match_blocks(film_database, substrate_database, tolerance, k, chunk_pairs=2**20, jobs=1, engine="indexed", stats=None):
+    """The k best matches of every film, see TopKMatches.
+
+    The substrates are matched in TOP_K_PASSES passes with parallel_match_blocks().
+    After each pass every film whose top k is full only takes matches below
+    the absolute mismatch of its k-th best one, so later passes build and rank
+    fewer records. The tolerance alone decides which pairs match.
+
+    Args:
+        film_database: structured array of film materials (material_catalog.py)
+        substrate_database: structured array of substrate materials
+        tolerance: tolerance level for mismatch as a decimal
+        k: number of matches per film
+        chunk_pairs, jobs, engine, stats: as for parallel_match_blocks()
+    Returns:
+        (records, critical) as TopKMatches.result().
+    """
+    substrate_database = numpy.atleast_1d(substrate_database)
+    top = TopKMatches(film_database, k)
+    for subs in numpy.array_split(numpy.arange(len(substrate_database)), min(TOP_K_PASSES, max(1, len(substrate_database)))):
+        bounds = top.bounds()
+        if len(subs) == 0 or not (bounds > 0).any():
+            continue
+        for records, critical in parallel_match_blocks(film_database, substrate_database[subs[0]:subs[-1] + 1], tolerance, chunk_pairs, jobs, engine, stats,
+                                                       film_bounds=bounds):
+            top.add(records, critical)
+    return top.result()